@@ -0,0 +1,171 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+#
+# fsfsverify-bench.py: time fsfsverify's svndiff parsing on a large
+#                      synthetic DELTA representation
+#
+# A rev file holding one DELTA rep of WINDOWS svndiff1 windows is
+# generated, half of them with zlib-compressed instructions and data,
+# and verified through an mmap of the file, through plain file reads,
+# as fsfsverify does when a file can't be mapped, and as fsfsverify
+# did before it used mmap: through file reads, one SvndiffInstruction
+# per instruction, and a zlib stream copying its buffer for every byte.
+#
+# USAGE: ./fsfsverify-bench.py [WINDOWS [INSTRUCTIONS-PER-WINDOW]]
+#
+
+import os
+import sys
+import time
+import tempfile
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fsfsverify
+
+
+class OldZlibByteStream(fsfsverify.ByteStream):
+  '''fsfsverify.ZlibByteStream as it was before it used MmapByteStream,
+  reduced to what verifying needs.'''
+
+  def __init__(self, fileobj, length):
+    self._f = fileobj
+    self._z = zlib.decompressobj(15)
+    self._buffer = self._z.decompress(self._f.read(length))
+    self._origBufferLength = len(self._buffer)
+
+  def readByte(self):
+    if not self._buffer:
+      raise fsfsverify.NoMoreData("Unexpected end of data stream!")
+
+    byte = self._buffer[0]
+    self._buffer = self._buffer[1:]
+
+    return ord(byte)
+
+  def tell(self):
+    return self._origBufferLength - len(self._buffer)
+
+
+def varint(n):
+  s = chr(n & 0x7F)
+  n >>= 7
+  while n:
+    s = chr((n & 0x7F) | 0x80) + s
+    n >>= 7
+  return s
+
+
+def section(raw, compress):
+  '''Return RAW as an svndiff1 instruction or data section.'''
+  if compress:
+    compressed = zlib.compress(raw)
+    if len(compressed) < len(raw):
+      return varint(len(raw)) + compressed
+  return varint(len(raw)) + raw
+
+
+def make_window(ninstrs, compress):
+  instrs = []
+  data = []
+  target = 0
+  for i in range(ninstrs):
+    if i % 2:
+      # copy-source, with the length coded as a separate varint
+      length = 100 + i % 1000
+      instrs.append(chr(0x00) + varint(length) + varint(i * 7))
+    else:
+      length = 1 + i % 63
+      instrs.append(chr(0x80 | length))
+      data.append(('%08d' % i) * 8)
+      data[-1] = data[-1][:length]
+    target += length
+  instrs = section(''.join(instrs), compress)
+  data = section(''.join(data), compress)
+  return (varint(0) + varint(1000000) + varint(target) +
+          varint(len(instrs)) + varint(len(data)) + instrs + data)
+
+
+def write_rev_file(fname, nwindows, ninstrs):
+  svndiff = ['SVN\x01']
+  for i in range(nwindows):
+    svndiff.append(make_window(ninstrs, i % 2 == 0))
+  svndiff = ''.join(svndiff)
+  f = open(fname, 'wb')
+  f.write('DELTA\n')
+  f.write(svndiff)
+  f.write('ENDREP\n')
+  f.close()
+  return len('DELTA\n'), len(svndiff)
+
+
+def verify(fname, offset, length):
+  f = open(fname, 'rb')
+  f.seek(offset)
+  start = time.time()
+  fsfsverify.Svndiff(f, length).verify()
+  elapsed = time.time() - start
+  f.close()
+  return elapsed
+
+
+def main():
+  nwindows = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+  ninstrs = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+  # Svndiff.verify() logs every rep it verifies by default.
+  fsfsverify.LOG_MASK = 0
+
+  fd, fname = tempfile.mkstemp(suffix='.rev')
+  os.close(fd)
+  try:
+    offset, length = write_rev_file(fname, nwindows, ninstrs)
+    size = os.path.getsize(fname)
+
+    mapped = verify(fname, offset, length)
+
+    mapFile = fsfsverify.mapFile
+    fsfsverify.mapFile = lambda f: None
+    try:
+      unmapped = verify(fname, offset, length)
+
+      ZlibByteStream = fsfsverify.ZlibByteStream
+      fsfsverify.ZlibByteStream = OldZlibByteStream
+      try:
+        old = verify(fname, offset, length)
+      finally:
+        fsfsverify.ZlibByteStream = ZlibByteStream
+    finally:
+      fsfsverify.mapFile = mapFile
+  finally:
+    os.remove(fname)
+
+  mb = size / (1024.0 * 1024.0)
+  print('%d windows of %d instructions, %.1f MB' % (nwindows, ninstrs, mb))
+  print('old:        %.3fs (%.1f MB/s)' % (old, mb / old))
+  print('file reads: %.3fs (%.1f MB/s, %.1fx)' % (unmapped, mb / unmapped,
+                                                  old / unmapped))
+  print('mmap:       %.3fs (%.1f MB/s, %.1fx)' % (mapped, mb / mapped,
+                                                  old / mapped))
+
+if __name__ == '__main__':
+  main()
@@ -19,6 +19,11 @@ import os
 import optparse
 import sys
 import re
+import mmap
+import weakref
+import shutil
+import tempfile
+from StringIO import StringIO
 
 try:
     import hashlib
@@ -103,6 +108,15 @@ class ByteStream(object):
   def readByte(self):
     return ord(self._f.read(1))
 
+  def readVarint(self):
+    i = long(0)
+    while True:
+      byte = self.readByte()
+      i = (i << 7) + (byte & 0x7F)
+      if byte & 0x80 == 0:
+        break
+    return i
+
   def tell(self):
     return self._f.tell()
 
@@ -133,66 +147,150 @@ class ByteStream(object):
     return self._f.seek(*args, **kwargs)
 
 
-class ZlibByteStream(ByteStream):
-  def __init__(self, fileobj, length):
-    self._f = fileobj
+class MmapByteStream(ByteStream):
+  '''A ByteStream over a string or an mmap of a whole file.  The cursor is
+  just an index into the data, so cloning a stream or advancing it is
+  free, and nothing is copied until it is read.'''
 
-    # Store the number of bytes consumed thus far so we can compute an offset
-    self._numBytesConsumed = 0
+  def __init__(self, data, pos=0):
+    self._data = data
+    self._pos = pos
+    self._end = len(data)
 
-    self._startingOffset = self._f.tell()
+  def readByte(self):
+    pos = self._pos
+    if pos >= self._end:
+      raise NoMoreData, "Unexpected end of data stream!"
+    self._pos = pos + 1
+    return ord(self._data[pos])
+
+  def readVarint(self):
+    i, self._pos = _decodeVarint(self._data, self._pos, self._end)
+    return i
+
+  def readInstructions(self, instrLength):
+    '''Consume svndiff instructions until at least INSTRLENGTH bytes of
+    them have been read, as repeatedly creating SvndiffInstruction(self)
+    would, but without building an object for each of them.  Return
+    (instruction bytes, data length, source length, target length).'''
+    data = self._data
+    pos = start = self._pos
+    end = self._end
+    stop = pos + instrLength
+    dataLength = sourceLength = targetLength = 0
+    while pos < stop:
+      instrOffset = pos
+      if pos >= end:
+        self._pos = pos
+        raise NoMoreData, "Unexpected end of data stream!"
+      byte = ord(data[pos])
+      pos += 1
+      instruction = byte >> 6
+      length = byte & 0x3F
+
+      if instruction == 3:
+        self._pos = instrOffset
+        raise InvalidInstruction(
+          "Invalid instruction found at offset %d (%02X)" % (instrOffset,
+                                                             byte),
+          instrOffset)
+
+      # The length, if not in the first byte, and then the offset for
+      # copy-source and copy-target, are varints.
+      if length == 0:
+        length, pos = _decodeVarint(data, pos, end)
+      if instruction != 2:
+        offset, pos = _decodeVarint(data, pos, end)
+
+      if instruction == 0:
+        sourceLength += length
+      elif instruction == 2:
+        dataLength += length
+      targetLength += length
+
+    self._pos = pos
+    return (pos - start, dataLength, sourceLength, targetLength)
 
-    import zlib, binascii
-    self._z = zlib.decompressobj(15)
+  def tell(self):
+    return self._pos
 
-    self._buffer = self._z.decompress(self._f.read(length))
-    self._origBufferLength = len(self._buffer)
+  def advance(self, numBytes):
+    self._pos += numBytes
 
-  def readByte(self):
-    if not self._buffer:
+  def clone(self):
+    return MmapByteStream(self._data, self._pos)
+
+  def read(self, size=-1):
+    if size < 0:
+      size = self._end - self._pos
+    data = self._data[self._pos:self._pos + size]
+    self._pos += len(data)
+    return data
+
+  def seek(self, offset, whence=0):
+    if whence == 1:
+      offset += self._pos
+    elif whence == 2:
+      offset += self._end
+    self._pos = offset
+
+
+def _decodeVarint(data, pos, end):
+  '''Decode the varint at DATA[POS:END], returning its value and the
+  position following it.'''
+  i = long(0)
+  while True:
+    if pos >= end:
       raise NoMoreData, "Unexpected end of data stream!"
+    byte = ord(data[pos])
+    pos += 1
+    i = (i << 7) + (byte & 0x7F)
+    if byte & 0x80 == 0:
+      return i, pos
 
-    byte = self._buffer[0]
-    self._buffer = self._buffer[1:]
 
-    return ord(byte)
+class ZlibByteStream(MmapByteStream):
+  def __init__(self, fileobj, length):
+    self._f = fileobj
 
-  def tell(self):
-    return self._origBufferLength - len(self._buffer)
+    self._startingOffset = self._f.tell()
 
-  def advance(self, numBytes):
-    while numBytes:
-      self.readByte()
+    import zlib
+    z = zlib.decompressobj(15)
+
+    # Offsets in this stream are offsets into the decompressed data.
+    MmapByteStream.__init__(self, z.decompress(self._f.read(length)))
 
   def clone(self):
-    if hasattr(self._f, 'clone'):
-      newFileObj = self._f.clone()
-    else:
-      newFileObj = open(self._f.name, 'rb')
-      newFileObj.seek(self._f.tell())
-    return ByteStream(newFileObj)
+    return MmapByteStream(self._data, self._pos)
 
-  # The following let ByteStream behave as a file within the
-  # context of this script.
 
-  def read(self, *args, **kwargs):
-    raise
+# file object -> mmap of it, or None if it can't be mapped
+_mappedFiles = weakref.WeakKeyDictionary()
 
-  def seek(self, *args, **kwargs):
-    raise
+def mapFile(f):
+  '''Return a read-only mmap of the whole of the file F, or None if it
+  can't be mapped.'''
+  try:
+    return _mappedFiles[f]
+  except KeyError:
+    pass
+  except TypeError:
+    return None
+
+  try:
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  except (AttributeError, EnvironmentError, ValueError):
+    m = None
+  _mappedFiles[f] = m
+  return m
 
 
 def getVarint(byteStream):
   '''Grabs a variable sized int from a bitstream (meaning this function
   doesn't seek).'''
 
-  i = long(0)
-  while True:
-    byte = byteStream.readByte()
-    i = (i << 7) + (byte & 0x7F)
-    if byte & 0x80 == 0:
-      break
-  return i
+  return byteStream.readVarint()
 
 
 INSTR_COPY_SOURCE = 'copy-source'
@@ -385,6 +483,18 @@ class Window(object):
       e.windowOffset = self.windowOffset
       raise e
 
+    if hasattr(self.instrByteStream, 'readInstructions') \
+        and not LOG_MASK & LOG_INSTRUCTIONS:
+      # Nothing to log, so just add up the lengths.
+      try:
+        (computedInstrLength, computedDataLength, computedSourceLength,
+         computedTargetLength) = \
+          self.instrByteStream.readInstructions(expectedInstrLength)
+      except PotentiallyFixableException as e:
+        e.window = self
+        e.windowOffset = self.windowOffset
+        raise
+
     while computedInstrLength < expectedInstrLength:
       try:
         instr = SvndiffInstruction(self.instrByteStream)
@@ -480,7 +590,11 @@ class Svndiff(object):
   def verify(self):
     self._f.seek(self.startingOffset+4)
 
-    bs = ByteStream(self._f)
+    data = mapFile(self._f)
+    if data is None:
+      bs = ByteStream(self._f)
+    else:
+      bs = MmapByteStream(data, self.startingOffset+4)
 
     log(LOG_SVNDIFF, 2, "<Svndiff so: %d ver: %d>", self.startingOffset,
         self.version)
@@ -651,6 +765,7 @@ class NodeType(object):
 
 class NodeRev(object):
   def __init__(self, f, currentRev):
+    global skippedChecks
     self.pred = None
     self.text = None
     self.props = None
@@ -764,13 +879,11 @@ class NodeRev(object):
               nodeType, nodeId = v
 
               if nodeId.rev != self.id.rev:
-                  if not os.path.exists(str(nodeId.rev)):
+                  idLine = readLineInRev(nodeId.rev, nodeId.offset)
+                  if idLine is None:
+                      skippedChecks += 1
                       print("Can't check %s" % repr(nodeId))
                       continue
-                  tmp = open(str(nodeId.rev),'rb')
-                  tmp.seek(nodeId.offset)
-                  idLine = tmp.readline()
-                  tmp.close()
               else:
                   f.seek(nodeId.offset)
                   idLine = f.readline()
@@ -1071,6 +1184,205 @@ def fixStream(e, revFile):
   print("Fixed? :-)  Re-run fsfsverify without the -f option")
 
 
+def findRevFiles(reposPath):
+  '''Return a (rev, filename, offset, length) tuple for every revision of
+  the FSFS repository at REPOSPATH.  OFFSET and LENGTH locate the
+  revision within FILENAME if it is a pack file, and are None otherwise.'''
+  db = os.path.join(reposPath, 'db')
+  try:
+    formatLines = open(os.path.join(db, 'format')).read().split('\n')
+    youngest = int(open(os.path.join(db, 'current')).read().split()[0])
+  except (IOError, ValueError, IndexError):
+    raise CmdlineError("'%s' doesn't look like an FSFS repository" % reposPath)
+
+  shardSize = None
+  for line in formatLines[1:]:
+    fields = line.split()
+    if fields[:2] == ['layout', 'sharded']:
+      shardSize = int(fields[2])
+    elif fields[:2] == ['addressing', 'logical']:
+      raise CmdlineError("Repositories with logical addressing "
+                         "aren't supported")
+
+  minUnpackedRev = 0
+  minUnpackedPath = os.path.join(db, 'min-unpacked-rev')
+  if os.path.exists(minUnpackedPath):
+    minUnpackedRev = int(open(minUnpackedPath).read())
+
+  revsDir = os.path.join(db, 'revs')
+  revFiles = []
+  manifests = {}
+  for rev in range(youngest + 1):
+    if rev < minUnpackedRev:
+      shard = rev // shardSize
+      packDir = os.path.join(revsDir, '%d.pack' % shard)
+      if shard not in manifests:
+        manifests[shard] = [int(line) for line in
+                            open(os.path.join(packDir, 'manifest'))]
+      offsets = manifests[shard]
+      packFile = os.path.join(packDir, 'pack')
+      index = rev % shardSize
+      offset = offsets[index]
+      if index + 1 < len(offsets):
+        length = offsets[index + 1] - offset
+      else:
+        length = os.path.getsize(packFile) - offset
+      revFiles.append((rev, packFile, offset, length))
+    elif shardSize:
+      revFiles.append((rev, os.path.join(revsDir, str(rev // shardSize),
+                                         str(rev)), None, None))
+    else:
+      revFiles.append((rev, os.path.join(revsDir, str(rev)), None, None))
+  return revFiles
+
+
+# Where to find the other revisions directory entries point into, as a
+# dictionary of rev -> (filename, offset of the revision in it), or None
+# to look for a rev file named after the revision in the current
+# directory.  Set by verifyRepository() for its workers.
+revLocations = None
+
+# The number of directory entries which couldn't be checked because the
+# revision they point into wasn't found.
+skippedChecks = 0
+
+def readLineInRev(rev, offset):
+  '''Return the line at OFFSET in revision REV, or None if the revision
+  can't be found.'''
+  if revLocations is None:
+    (filename, revOffset) = (str(rev), 0)
+  elif rev in revLocations:
+    (filename, revOffset) = revLocations[rev]
+  else:
+    return None
+  if not os.path.exists(filename):
+    return None
+  f = open(filename, 'rb')
+  try:
+    f.seek(revOffset + offset)
+    return f.readline()
+  finally:
+    f.close()
+
+
+def setRevLocations(locations):
+  global revLocations
+  revLocations = locations
+
+
+def verifyRevFile(task):
+  '''Verify one revision, given as a (rev, filename, offset, length,
+  noderevRegexp) tuple, for verifyRepository().  Return (rev, name of the
+  exception raised or None, its message, the offset of a potentially
+  fixable problem or None, its window offset or None, the number of
+  directory entries which couldn't be checked).'''
+  global currentRev, skippedChecks
+  (rev, filename, offset, length, noderevRegexp) = task
+
+  # The output of the checks is only of interest for a failure.
+  savedStdout, savedStderr = sys.stdout, sys.stderr
+  sys.stdout = sys.stderr = StringIO()
+  tmpDir = None
+  skippedChecks = 0
+  try:
+    try:
+      if offset is not None:
+        # Copy the revision out of the pack file, since its offsets are
+        # relative to its own start.
+        tmpDir = tempfile.mkdtemp()
+        packFile = open(filename, 'rb')
+        packFile.seek(offset)
+        filename = os.path.join(tmpDir, str(rev))
+        open(filename, 'wb').write(packFile.read(length))
+        packFile.close()
+
+      currentRev = rev
+      revFile = open(filename, 'rb')
+      (root, changed) = getRootAndChangedPaths(revFile)
+      if noderevRegexp:
+        strategy = RegexpStrategy(filename, root, currentRev)
+      else:
+        strategy = ClassicStrategy(filename, root, currentRev)
+      for noderev in strategy:
+        verify(noderev, revFile, False, False)
+      revFile.close()
+      return (rev, None, None, None, None, skippedChecks)
+    except PotentiallyFixableException as e:
+      return (rev, e.__class__.__name__, str(e), e.offset,
+              getattr(e, 'windowOffset', None), skippedChecks)
+    except Exception as e:
+      return (rev, e.__class__.__name__, str(e), None, None, skippedChecks)
+  finally:
+    sys.stdout, sys.stderr = savedStdout, savedStderr
+    if tmpDir is not None:
+      shutil.rmtree(tmpDir, True)
+
+
+def verifyRepository(reposPath, jobs=None, noderevRegexp=False):
+  '''Verify every revision of the repository at REPOSPATH, using a pool
+  of JOBS processes (default: one per CPU), and print a summary.  Return
+  the number of revisions which failed or had checks skipped.'''
+  import multiprocessing
+
+  revFiles = findRevFiles(reposPath)
+  tasks = [revFile + (noderevRegexp,) for revFile in revFiles]
+  total = len(tasks)
+  locations = {}
+  for (rev, filename, offset, length) in revFiles:
+    locations[rev] = (filename, offset or 0)
+
+  pool = multiprocessing.Pool(jobs, setRevLocations, (locations,))
+  failures = []
+  skipped = []
+  done = 0
+  try:
+    for result in pool.imap_unordered(verifyRevFile, tasks, 16):
+      done += 1
+      if result[1] is not None:
+        failures.append(result[:5])
+        sys.stderr.write("r%d: %s: %s\n" % (result[0], result[1],
+                                            result[2].split('\n')[0]))
+      elif result[5]:
+        skipped.append((result[0], result[5]))
+        sys.stderr.write("r%d: %d directory entries not checked\n" % (
+          result[0], result[5]))
+      if done % 1000 == 0 or done == total:
+        sys.stderr.write("Verified %d of %d revisions (%d failed)\n" % (
+          done, total, len(failures)))
+  finally:
+    pool.close()
+    pool.join()
+
+  failures.sort()
+  skipped.sort()
+  print("Verified %d revisions, %d failed, %d not fully checked." % (
+    total, len(failures), len(skipped)))
+  if failures:
+    print("")
+    print("Failed revisions:")
+    for (rev, errorClass, message, offset, windowOffset) in failures:
+      print("  r%d: %s: %s" % (rev, errorClass, message.split('\n')[0]))
+
+  if skipped:
+    print("")
+    print("Revisions with directory entries which couldn't be checked:")
+    for (rev, count) in skipped:
+      print("  r%d: %d entries" % (rev, count))
+
+  fixable = [failure for failure in failures if failure[3] is not None]
+  if fixable:
+    print("")
+    print("Potentially fixable (try -f on the rev file):")
+    for (rev, errorClass, message, offset, windowOffset) in fixable:
+      if windowOffset is None:
+        print("  r%d: %s at offset %d" % (rev, errorClass, offset))
+      else:
+        print("  r%d: %s at offset %d (window at offset %d)" % (
+          rev, errorClass, offset, windowOffset))
+
+  return len(failures) + len(skipped)
+
+
 def checkOptions(options):
   count = 0
   for k,v in options.__dict__.items():
@@ -1081,6 +1393,12 @@ def checkOptions(options):
     sys.stderr.write("Please use only one of -c, -f, and -t.\n")
     sys.exit(1)
 
+  if options.repository and (count or options.dumpWindows
+                             or options.dumpInstructions or options.noVerify):
+    sys.stderr.write("-R can't be combined with -c, -f, -t, -w, -i "
+                     "or --no-verify.\n")
+    sys.exit(1)
+
   if options.dumpChanged and (options.dumpWindows or options.dumpInstructions):
     sys.stderr.write(\
       "-c is incompatible with -w and -i.  Dropping -w and/or -i.\n")
@@ -1104,7 +1422,8 @@ def handleError(error, withTraceback=False):
 if __name__ == '__main__':
   from optparse import OptionParser
 
-  parser = OptionParser("usage: %prog [OPTIONS] REV-FILE")
+  parser = OptionParser("usage: %prog [OPTIONS] REV-FILE\n"
+                        "       %prog -R [-j JOBS] [-n] REPOS-PATH")
   parser.add_option("-c", "--changed-paths",
                     action="store_true", dest="dumpChanged",
                     help="Dump changed path information", default=False)
@@ -1128,6 +1447,14 @@ if __name__ == '__main__':
                     action="store", type="string", dest="truncate",
                     help="Truncate the specified node rev.",
                     default=None)
+  parser.add_option("-R", "--repository",
+                    action="store_true", dest="repository",
+                    help="Verify every revision of the repository at "
+                         "REPOS-PATH, in parallel.", default=False)
+  parser.add_option("-j", "--jobs",
+                    action="store", type="int", dest="jobs",
+                    help="Number of processes to use with -R (default: "
+                         "the number of CPUs).", default=None)
   parser.add_option("", "--traceback",
                     action="store_true", dest="showTraceback",
                     help="Show error tracebacks (mainly used for debugging).",
@@ -1142,6 +1469,14 @@ if __name__ == '__main__':
 
   checkOptions(options)
 
+  if options.repository:
+    try:
+      failed = verifyRepository(args[0], options.jobs, options.noderevRegexp)
+    except CmdlineError as e:
+      sys.stderr.write("Error: %s\n" % str(e))
+      sys.exit(1)
+    sys.exit(failed and 1 or 0)
+
   filename = args[0]
 
   if options.dumpInstructions:
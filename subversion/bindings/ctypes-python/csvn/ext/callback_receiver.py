@@ -22,8 +22,17 @@ which accept callbacks into Pythonic generator
 functions.
 """
 
-from threading import Thread, Lock, Condition, currentThread
+from threading import Thread, currentThread
 import sys, traceback, weakref
+try:
+    # Python >=3.0
+    from queue import Queue, Full, Empty
+except ImportError:
+    # Python <3.0
+    from Queue import Queue, Full, Empty
+
+# Marks the end of the results in the queue
+_DONE = object()
 
 class CallbackReceiver(Thread):
     """A thread which collects input from callbacks and
@@ -31,20 +40,27 @@ class CallbackReceiver(Thread):
 
        Classes which inherit from this class should define
        a 'collect' method which dispatches results to the
-       iterator via the 'send' method."""
+       iterator via the 'send' method.
+
+       Results are handed over in batches of up to BATCH_SIZE, and at
+       most QUEUE_SIZE batches may be waiting for the iterator before
+       the collector thread blocks.  Alternatively, 'results' runs the
+       collect method in the calling thread and returns a list."""
+
+    BATCH_SIZE = 256
+    QUEUE_SIZE = 8
 
     def __init__(self, *args, **kwargs):
         """Create a new callback iterator"""
         Thread.__init__(self)
         self.args = args
         self.kwargs = kwargs
-        self.lock = Lock()
-        self.result_produced = Condition(self.lock)
-        self.result_consumed = Condition(self.lock)
-        self.result = None
+        self.queue = Queue(self.QUEUE_SIZE)
+        self.batch = []
+        self.eager_results = None
         self.done = False
-        self.consumed = False
         self.exception = None
+        self.calling_thread = None
 
     def run(self, *args, **kwargs):
         try:
@@ -61,49 +77,57 @@ class CallbackReceiver(Thread):
 
         finally:
 
-            # Wake up the parent, and tell 'im we're all
-            # done our work
-            self.done = True
-            try:
-                self.lock.acquire()
-                self.result_produced.notify()
-            finally:
-                self.lock.release()
-
+            # Hand over what is left, and tell the iterator
+            # we're all done our work
+            if self.batch:
+                self._put(self.batch)
+                self.batch = []
+            self._put(_DONE)
 
     def send(self, result):
         """Send a new result to the iterator"""
-        try:
-            self.lock.acquire()
-
-            # Save the result
-            self.result = result
-            self.consumed = False
-
-            # A new result is ready!
-            self.result_produced.notify()
-
-            # Wait for the iterator to pickup the result
-            while not self.done and self.consumed is not True:
-                self.result_consumed.wait(0.5)
-
+        if self.eager_results is not None:
+            self.eager_results.append(result)
+            return
+        if self.done:
+            return
+        self.batch.append(result)
+        if len(self.batch) >= self.BATCH_SIZE:
+            self._put(self.batch)
+            self.batch = []
+
+    def _put(self, item):
+        """Queue ITEM for the iterator, waiting while the queue is full
+           unless the iterator has gone away"""
+        while not self.done:
+            try:
+                self.queue.put(item, True, 0.5)
+                return
+            except Full:
                 # If the calling thread died, we should stop.
-                if not self.calling_thread.isAlive():
+                if not self.calling_thread.is_alive():
                     self.done = True
-        finally:
-            self.lock.release()
+
+    def results(self):
+        """Run the collect method in the calling thread, and return
+           a list of all the results.  Exceptions thrown by the collect
+           method are passed on as they are."""
+        self.eager_results = []
+        self.collect(*self.args, **self.kwargs)
+        results, self.eager_results = self.eager_results, None
+        return results
 
     def shutdown(self, _):
         """Shut down the child thread"""
 
-        # Tell the child thread to wake up (and die) if it has been
-        # waiting for us to consume some data
+        # Tell the child thread to stop, and wake it up if it has
+        # been waiting for us to consume some data
         self.done = True
         try:
-            self.lock.acquire()
-            self.result_consumed.notify()
-        finally:
-            self.lock.release()
+            while True:
+                self.queue.get_nowait()
+        except Empty:
+            pass
 
     def __iter__(self):
         """Iterate over the callback results"""
@@ -112,7 +136,7 @@ class CallbackReceiver(Thread):
         self.calling_thread = currentThread()
 
         # Setup the iterator
-        iterator = iter(_CallbackResultIterator(self))
+        iterator = self._iterate()
 
         # Cleanup: When the iterator goes out of scope, shut
         #          down the collector thread.
@@ -120,66 +144,23 @@ class CallbackReceiver(Thread):
 
         return iterator
 
-class _CallbackResultIterator(object):
-
-    def __init__(self, receiver):
-        self.receiver = receiver
-
-    def __iter__(self):
-
-        # Start up receiver thread, and
-        # wait for the first result
-        self.receiver.done = False
-        try:
-            self.receiver.lock.acquire()
-            self.receiver.start()
-            if not self.receiver.done:
-                self.receiver.result_produced.wait()
-        finally:
-            self.receiver.lock.release()
-
-        # ### TODO: simplify, removing support for Python 2.4
-        # Return the first result. Only Python 2.5 supports 'yield'
-        # inside a try-finally block, so we jump through some hoops here
-        # to avoid that case.
-        if not self.receiver.done and self.receiver.result is not None:
-            yield self.receiver.result
-
-            try:
-                self.receiver.lock.acquire()
-                self.receiver.consumed = True
-                self.receiver.result_consumed.notify()
-            finally:
-                self.receiver.lock.release()
+    def _iterate(self):
+        self.done = False
+        self.start()
 
-        # Grab any further results
-        while not self.receiver.done:
+        while True:
+            batch = self.queue.get()
+            if batch is _DONE:
+                break
+            for result in batch:
+                yield result
 
-            # Wait for a result to be produced
-            try:
-                self.receiver.lock.acquire()
-                self.receiver.result_produced.wait()
-            finally:
-                self.receiver.lock.release()
-
-            # Look like a result is ready. Consume it
-            if not self.receiver.done and self.receiver.result is not None:
-                yield self.receiver.result
-
-                # Notify the child thread that we've consumed their output
-                try:
-                    self.receiver.lock.acquire()
-                    self.receiver.consumed = True
-                    self.receiver.result_consumed.notify()
-                finally:
-                    self.receiver.lock.release()
+        # Wait for the thread to exit before returning
+        self.join()
 
         # If the child thread raised an exception, re-raise it
-        if self.receiver.exception:
-            raise self.receiver.exception
-
-        # Wait for the thread to exit before returning
-        self.receiver.join()
+        if self.exception:
+            raise self.exception
 
 class CollectionError(Exception):
     pass
@@ -212,7 +212,7 @@ class RemoteRepository(object):
         return self.proplist(path, rev)[name]
 
     def log(self, start_rev, end_rev, paths=None, limit=0,
-            discover_changed_paths=FALSE, stop_on_copy=FALSE):
+            discover_changed_paths=FALSE, stop_on_copy=FALSE, eager=False):
         """A generator function which returns information about the revisions
            between START_REV and END_REV. Each return value is a
            csvn.types.LogEntry object which describes a revision.
@@ -246,11 +246,20 @@ class RemoteRepository(object):
              a SVN_ERR_FS_NO_SUCH_REVISION SubversionException, without
              returning any logs.
 
+             If EAGER is True, all the log entries are fetched before this
+             function returns, and a list of them is returned.  This avoids
+             the helper thread which otherwise hands the entries over as
+             they arrive.
+
         """
 
         paths = _types.Array(c_char_p, paths is None and [""] or paths)
-        return iter(_LogMessageReceiver(self, start_rev, end_rev, paths,
-                                        limit, discover_changed_paths, stop_on_copy))
+        receiver = _LogMessageReceiver(self, start_rev, end_rev, paths,
+                                       limit, discover_changed_paths,
+                                       stop_on_copy)
+        if eager:
+            return receiver.results()
+        return iter(receiver)
 
 
     # Private. Produces a delta editor for the commit, so that the Txn
@@ -137,6 +137,11 @@ class RemoteRepositoryTestCase(unittest.TestCase):
             self.assertEqual(found.author, e_author)
             expected = expected[1:]
 
+    def test_log_eager(self):
+        found = self.repos.log(7, 9, ["trunk/README.txt"], eager=True)
+        self.assertEqual([(entry.revision, entry.author) for entry in found],
+                         [(8, 'clark'), (9, 'bruce')])
+
     def test_revprop_list(self):
         # Test argument-free case
         props = self.repos.revprop_list()
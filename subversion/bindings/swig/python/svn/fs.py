@@ -60,7 +60,7 @@ del _unprefix_names
 
 
 # Names that are not to be exported
-import sys as _sys, os as _os, tempfile as _tempfile, subprocess as _subprocess
+import sys as _sys, os as _os, io as _io, tempfile as _tempfile, subprocess as _subprocess
 try:
   # Python <3.0
   # Check for Python <3.0 first to prevent the presence of the python2-future
@@ -101,6 +101,17 @@ class _PopenStdoutWrapper(object):
           except _subprocess.TimeoutExpired:
             self._pobject.kill()
 
+def _iter_lines_and_close(fp):
+  "Private generator yielding the lines of FP, closing it when done."
+  try:
+    for line in fp:
+      yield line
+  finally:
+    fp.close()
+
+# Largest file, and diff output, that FileDiff.iter_lines() holds in memory.
+DIFF_MEMORY_SIZE = 4 * 1024 * 1024
+
 class FileDiff:
   def __init__(self, root1, path1, root2, path2, pool=None, diffoptions=[]):
     assert path1 or path2
@@ -197,6 +208,90 @@ class FileDiff:
 
       return builtins.open(self.difftemp, "rb")
 
+  def _read_contents(self, root, path, max_size, pool=None):
+    "Return the contents of PATH in ROOT, or None if larger than MAX_SIZE."
+    if path is None:
+      return b''
+    if max_size is not None and file_length(root, path, pool) > max_size:
+      return None
+    chunks = []
+    stream = file_contents(root, path, pool)
+    try:
+      while True:
+        chunk = _svncore.svn_stream_read(stream, _svncore.SVN_STREAM_CHUNK_SIZE)
+        if not chunk:
+          break
+        chunks.append(chunk)
+    finally:
+      _svncore.svn_stream_close(stream)
+    return b''.join(chunks)
+
+  def iter_lines(self, label1=None, label2=None, max_size=DIFF_MEMORY_SIZE):
+    """Return an iterator over the lines of a unified diff of the two files.
+
+    The diff is computed with the internal Subversion diff, whatever
+    diffoptions were given, and no external process is run.  Files of at
+    most MAX_SIZE bytes are diffed in memory straight from the filesystem
+    streams; larger ones are dumped to temporary files as get_files()
+    does.  The diff output itself is buffered in memory up to MAX_SIZE
+    bytes before spilling over to an anonymous temporary file.  A MAX_SIZE
+    of None keeps everything in memory.
+
+    LABEL1 and LABEL2 are used in the '---' and '+++' headers, and
+    default to the paths being compared.  The lines are bytes, including
+    their line endings."""
+    if label1 is None:
+      label1 = self.path1 or self.path2
+    if label2 is None:
+      label2 = self.path2 or self.path1
+    if not isinstance(label1, bytes):
+      label1 = label1.encode('UTF-8')
+    if not isinstance(label2, bytes):
+      label2 = label2.encode('UTF-8')
+
+    if max_size is None:
+      output = _io.BytesIO()
+    else:
+      output = _tempfile.SpooledTemporaryFile(max_size=max_size)
+    diffopt = _svndiff.file_options_create()
+
+    contents2 = None
+    contents1 = self._read_contents(self.root1, self.path1, max_size)
+    if contents1 is not None:
+      contents2 = self._read_contents(self.root2, self.path2, max_size)
+
+    if contents1 is not None and contents2 is not None:
+      diffobj = _svndiff.mem_string_diff(contents1, contents2, diffopt)
+      _svndiff.mem_string_output_unified3(output,
+                                          diffobj,
+                                          True,
+                                          b"@@",
+                                          label1, label2,
+                                          b"utf8",
+                                          contents1, contents2,
+                                          diffopt.context_size,
+                                          None, None)
+    else:
+      # Too large to hold in memory; diff temporary copies instead.
+      contents1 = None
+      self.get_files()
+      diffobj = _svndiff.file_diff_2(self.tempfile1.encode('UTF-8'),
+                                     self.tempfile2.encode('UTF-8'),
+                                     diffopt)
+      _svndiff.file_output_unified4(output,
+                                    diffobj,
+                                    self.tempfile1.encode('UTF-8'),
+                                    self.tempfile2.encode('UTF-8'),
+                                    label1, label2,
+                                    b"utf8",
+                                    None,
+                                    diffopt.show_c_function,
+                                    diffopt.context_size,
+                                    None, None)
+
+    output.seek(0)
+    return _iter_lines_and_close(output)
+
   def __del__(self):
     # it seems that sometimes the files are deleted, so just ignore any
     # failures trying to remove them
@@ -301,6 +301,23 @@ class SubversionFSTestCase(unittest.TestCase):
 
     self.assertTrue(diffoutput.find(u'-' + self.unistr) > 0)
 
+  def test_diff_repos_paths_iter_lines(self):
+    """Test diffing of a repository path without temporary files."""
+
+    root = fs.revision_root(self.fs, self.commitedrev)
+    fdiff = fs.FileDiff(root, b"/trunk/UniTest.txt", None, None)
+    lines = list(fdiff.iter_lines())
+
+    self.assertEqual(lines[0], b'--- /trunk/UniTest.txt\n')
+    self.assertTrue(b'-' + self.unistr.encode('utf8') + b'\n' in lines)
+    self.assertEqual(fdiff.tempfile1, None)
+
+    # Files larger than max_size go through temporary files, but the
+    # output is the same.
+    fdiff = fs.FileDiff(root, b"/trunk/UniTest.txt", None, None)
+    self.assertEqual(list(fdiff.iter_lines(max_size=1)), lines)
+    self.assertNotEqual(fdiff.tempfile1, None)
+
   def test_diff_repos_paths_external(self):
     """Test diffing of a repository path using an external diff (if available)."""
 
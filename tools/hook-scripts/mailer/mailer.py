@@ -33,10 +33,15 @@
 #                              [CONFIG-FILE]
 #        mailer.py lock        REPOS AUTHOR [CONFIG-FILE]
 #        mailer.py unlock      REPOS AUTHOR [CONFIG-FILE]
+#        mailer.py send-spool  REPOS [CONFIG-FILE]
 #
 #   Using CONFIG-FILE, deliver an email describing the changes between
 #   REV and REV-1 for the repository REPOS.
 #
+#   If [general] spool_dir is set, emails are queued in that directory
+#   rather than sent, and 'send-spool' runs until killed, delivering the
+#   queued emails via SMTP.
+#
 #   ACTION was added as a fifth argument to the post-revprop-change hook
 #   in Subversion 1.2.0.  Its value is one of 'A', 'M' or 'D' to indicate
 #   if the property was added, modified or deleted, respectively.
@@ -49,18 +54,30 @@ import sys
 if sys.hexversion >= 0x3000000:
   PY3 = True
   import configparser
+  import queue as Queue
   from urllib.parse import quote as _url_quote
 else:
   PY3 = False
   import ConfigParser as configparser
+  import Queue
   from urllib import quote as  _url_quote
 import time
 import subprocess
-from io import BytesIO
 import smtplib
+import json
 import re
 import tempfile
+import shutil
 import codecs
+import threading
+import functools
+from collections import deque
+try:
+  import fcntl
+except ImportError:
+  # Windows
+  fcntl = None
+  import msvcrt
 
 # Minimal version of Subversion's bindings required
 _MIN_SVN_VERSION = [1, 5, 0]
@@ -141,10 +158,18 @@ def main(pool, cmd, config_fname, repos_dir, cmd_args):
                   'repos_basename': os.path.basename(repos.repos_dir)
                  })
     messenger = Lock(pool, cfg, repos, author, cmd == 'lock')
+  elif cmd == 'send-spool':
+    repos = Repository(repos_dir, 0, pool) ### any old revision will do
+    cfg = Config(config_fname, repos,
+                 {'repos_basename': os.path.basename(repos.repos_dir)})
+    return SpoolSender(cfg).run()
   else:
     raise UnknownSubcommand(cmd)
 
-  return messenger.generate()
+  try:
+    return messenger.generate()
+  finally:
+    messenger.output.close()
 
 
 def remove_leading_slashes(path):
@@ -206,6 +231,11 @@ class OutputBase:
     representation."""
     raise NotImplementedError
 
+  def close(self):
+    """Override this method, if resources are kept between messages.
+    Called once all the output representations have been finished."""
+    pass
+
   def write_binary(self, output):
     """Override this method.
     Append the binary data OUTPUT to the output representation."""
@@ -263,6 +293,24 @@ class MailedOutput(OutputBase):
                                and self.reply_to[2] == ']':
       self.reply_to = self.reply_to[3:]
 
+  def start_buffer(self):
+    """Direct the output to a temporary buffer, which is kept in memory
+    up to [general] message_buffer_size bytes and spills to disk beyond
+    that.  Return the buffer."""
+    try:
+      max_size = int(self.cfg.general.message_buffer_size)
+    except (AttributeError, ValueError):
+      max_size = 1024 * 1024
+    self.buffer = tempfile.SpooledTemporaryFile(max_size=max_size)
+    self.write_binary = self.buffer.write
+    return self.buffer
+
+  def finish_buffer(self):
+    "Rewind the buffer for reading, and return it."
+    self.buffer.flush()
+    self.buffer.seek(0)
+    return self.buffer
+
   def _rfc2047_encode(self, hdr):
     # Return the result of splitting HDR into tokens (on space
     # characters), encoding (per RFC2047) each token as necessary, and
@@ -306,14 +354,158 @@ class MailedOutput(OutputBase):
     return hdrs + '\n'
 
 
+class SMTPSession:
+  """A connection to the configured SMTP server, logged in if a username
+  is specified.  It is opened on first use and then kept for all the
+  messages sent through it, until close() is called.
+
+  Errors in setting up the session, such as login failures, for which
+  too many occurrences could lead to SMTP server lockout, are reported
+  to stderr and re-raised."""
+
+  CHUNKSIZE = 64 * 1024
+
+  def __init__(self, cfg):
+    self.cfg = cfg
+    self.server = None
+
+  def _connect(self):
+    if self.cfg.is_set('general.smtp_port'):
+       smtp_port = self.cfg.general.smtp_port
+    else:
+       smtp_port = 0
+    try:
+      if self.cfg.is_set('general.smtp_ssl') and self.cfg.general.smtp_ssl == 'yes':
+        server = smtplib.SMTP_SSL(self.cfg.general.smtp_hostname, smtp_port)
+      else:
+        server = smtplib.SMTP(self.cfg.general.smtp_hostname, smtp_port)
+    except Exception as detail:
+      sys.stderr.write("mailer.py: Failed to instantiate SMTP object: %s\n" % (detail,))
+      # Any error to instantiate is fatal
+      raise
+
+    if self.cfg.is_set('general.smtp_username'):
+      try:
+        server.login(self.cfg.general.smtp_username,
+                     self.cfg.general.smtp_password)
+      except smtplib.SMTPException as detail:
+        sys.stderr.write("mailer.py: SMTP login failed with username %s and/or password: %s\n"
+                         % (self.cfg.general.smtp_username, detail,))
+        try:
+          server.quit()
+        except smtplib.SMTPException:
+          pass
+        # Any error at login is fatal
+        raise
+
+    self.server = server
+
+  def sendmail_file(self, from_addr, to_addrs, fp):
+    """Send the message read from the binary file object FP, streaming it
+    to the server rather than holding it in memory.
+
+    As with smtplib.SMTP.sendmail(), SMTPRecipientsRefused is raised if
+    all of TO_ADDRS are refused; otherwise the message is sent to the
+    others, and a dict mapping each refused recipient to the server's
+    (code, response) is returned.  The refusals are reported to stderr."""
+    if self.server is None:
+      self._connect()
+    else:
+      try:
+        # make sure the server did not drop us while we were idle
+        self.server.rset()
+      except (smtplib.SMTPException, IOError):
+        self.abort()
+        self._connect()
+    server = self.server
+
+    server.ehlo_or_helo_if_needed()
+    # the message is sent as it is, so declare it 8-bit where possible
+    mail_options = [ ]
+    if server.has_extn('8bitmime'):
+      mail_options.append('BODY=8BITMIME')
+    if server.has_extn('smtputf8'):
+      for addr in [from_addr] + list(to_addrs):
+        try:
+          addr.encode('ascii')
+        except UnicodeError:
+          mail_options.append('SMTPUTF8')
+          break
+    code, resp = server.mail(from_addr, mail_options)
+    if code != 250:
+      server.rset()
+      raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = { }
+    for addr in to_addrs:
+      code, resp = server.rcpt(addr)
+      if code != 250 and code != 251:
+        refused[addr] = (code, resp)
+    if len(refused) == len(to_addrs):
+      server.rset()
+      raise smtplib.SMTPRecipientsRefused(refused)
+
+    code, resp = server.docmd('data')
+    if code != 354:
+      server.rset()
+      raise smtplib.SMTPDataError(code, resp)
+
+    # CRLF line endings and dot-stuffing, as smtplib.SMTP.data() does
+    chunk = [ ]
+    size = 0
+    for line in fp:
+      line = line.rstrip(b'\r\n')
+      if line[:1] == b'.':
+        line = b'.' + line
+      chunk.append(line + b'\r\n')
+      size += len(line) + 2
+      if size >= self.CHUNKSIZE:
+        server.send(b''.join(chunk))
+        chunk = [ ]
+        size = 0
+    chunk.append(b'.\r\n')
+    server.send(b''.join(chunk))
+
+    code, resp = server.getreply()
+    if code != 250:
+      raise smtplib.SMTPDataError(code, resp)
+    for addr, (code, resp) in sorted(refused.items()):
+      sys.stderr.write("mailer.py: SMTP recipient refused: %s: %s %s\n"
+                       % (addr, code, to_str(resp)))
+    return refused
+
+  def abort(self):
+    "Drop the connection without further ado, e.g. after an error."
+    if self.server is not None:
+      try:
+        self.server.close()
+      except Exception:
+        pass
+      self.server = None
+
+  def close(self):
+    if self.server is None:
+      return
+    try:
+      self.server.quit()
+    except smtplib.SMTPException as detail:
+      sys.stderr.write("mailer.py: Error occurred during SMTP session cleanup: %s\n"
+                           % (detail,))
+    self.server = None
+
+
 class SMTPOutput(MailedOutput):
   "Deliver a mail message to an MTA using SMTP."
 
+  def __init__(self, cfg, repos, prefix_param):
+    MailedOutput.__init__(self, cfg, repos, prefix_param)
+
+    # all the messages of this run share a single SMTP session
+    self.session = SMTPSession(cfg)
+
   def start(self, group, params):
     MailedOutput.start(self, group, params)
 
-    self.buffer = BytesIO()
-    self.write_binary = self.buffer.write
+    self.start_buffer()
 
     self.write(self.mail_headers(group, params))
 
@@ -332,32 +524,9 @@ class SMTPOutput(MailedOutput):
     (to minimize the chances of said lockout).
     """
 
-    if self.cfg.is_set('general.smtp_port'):
-       smtp_port = self.cfg.general.smtp_port
-    else:
-       smtp_port = 0
     try:
-      if self.cfg.is_set('general.smtp_ssl') and self.cfg.general.smtp_ssl == 'yes':
-        server = smtplib.SMTP_SSL(self.cfg.general.smtp_hostname, smtp_port)
-      else:
-        server = smtplib.SMTP(self.cfg.general.smtp_hostname, smtp_port)
-    except Exception as detail:
-      sys.stderr.write("mailer.py: Failed to instantiate SMTP object: %s\n" % (detail,))
-      # Any error to instantiate is fatal
-      raise
-
-    try:
-      if self.cfg.is_set('general.smtp_username'):
-        try:
-          server.login(self.cfg.general.smtp_username,
-                       self.cfg.general.smtp_password)
-        except smtplib.SMTPException as detail:
-          sys.stderr.write("mailer.py: SMTP login failed with username %s and/or password: %s\n"
-                           % (self.cfg.general.smtp_username, detail,))
-          # Any error at login is fatal
-          raise
-
-      server.sendmail(self.from_addr, self.to_addrs, self.buffer.getvalue())
+      self.session.sendmail_file(self.from_addr, self.to_addrs,
+                                 self.finish_buffer())
 
     ### TODO: 'raise .. from' is Python 3+. When we convert this
     ###       script to Python 3, uncomment 'from detail' below
@@ -377,14 +546,215 @@ class SMTPOutput(MailedOutput):
       # All other errors are fatal; this includes:
       # SMTPHeloError, SMTPDataError, SMTPNotSupportedError
       sys.stderr.write("mailer.py: SMTP error occurred: %s\n" % (detail,))
+      self.session.abort()
       raise
 
     finally:
+      self.buffer.close()
+
+  def close(self):
+    self.session.close()
+
+
+class Spool:
+  """A directory of mail messages waiting to be delivered.
+
+  Messages are written to the 'tmp' subdirectory and then renamed into
+  'new', so a message in 'new' is always complete.  Messages which can
+  never be delivered are moved to 'failed'.  Each file holds a line of
+  JSON with the envelope sender and recipients, followed by the message.
+  The process delivering the messages holds a lock on the 'lock' file."""
+
+  def __init__(self, path):
+    self.path = path
+    for subdir in ('tmp', 'new', 'failed'):
       try:
-        server.quit()
-      except smtplib.SMTPException as detail:
-        sys.stderr.write("mailer.py: Error occurred during SMTP session cleanup: %s\n"
-                             % (detail,))
+        os.makedirs(os.path.join(path, subdir))
+      except OSError:
+        if not os.path.isdir(os.path.join(path, subdir)):
+          raise
+    self._counter = 0
+    self._lock_file = None
+
+  def lock(self):
+    """Take the exclusive lock on the spool, which is held until the
+    process exits.  Raise SpoolLocked if another process has it."""
+    fp = open(os.path.join(self.path, 'lock'), 'a')
+    try:
+      if fcntl is not None:
+        fcntl.flock(fp.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+      else:
+        msvcrt.locking(fp.fileno(), msvcrt.LK_NBLCK, 1)
+    except (IOError, OSError):
+      fp.close()
+      raise SpoolLocked(self.path)
+    self._lock_file = fp
+
+  def add(self, from_addr, to_addrs, fp):
+    "Queue the message read from the binary file object FP."
+    self._counter += 1
+    name = '%.6f.%d.%d' % (time.time(), os.getpid(), self._counter)
+    tmpname = os.path.join(self.path, 'tmp', name)
+    out = open(tmpname, 'wb')
+    try:
+      out.write(to_bytes(json.dumps({'from': from_addr, 'to': to_addrs})))
+      out.write(b'\n')
+      shutil.copyfileobj(fp, out)
+      out.flush()
+      os.fsync(out.fileno())
+    finally:
+      out.close()
+    os.rename(tmpname, os.path.join(self.path, 'new', name))
+
+  def pending(self):
+    "Return the names of the queued messages, oldest first."
+    return sorted(os.listdir(os.path.join(self.path, 'new')))
+
+  def open(self, name):
+    """Return the (FROM_ADDR, TO_ADDRS, FP) of queued message NAME, where
+    FP is a binary file object positioned at the start of the message.
+    The caller must close FP."""
+    fp = open(os.path.join(self.path, 'new', name), 'rb')
+    try:
+      envelope = json.loads(to_str(fp.readline()))
+    except:
+      fp.close()
+      raise
+    return envelope['from'], envelope['to'], fp
+
+  def remove(self, name):
+    os.remove(os.path.join(self.path, 'new', name))
+
+  def fail(self, name):
+    os.rename(os.path.join(self.path, 'new', name),
+              os.path.join(self.path, 'failed', name))
+
+
+class SpoolOutput(MailedOutput):
+  "Queue a mail message in the spool, for delivery by 'send-spool'."
+
+  def __init__(self, cfg, repos, prefix_param):
+    MailedOutput.__init__(self, cfg, repos, prefix_param)
+
+    self.spool = Spool(cfg.general.spool_dir)
+
+  def start(self, group, params):
+    MailedOutput.start(self, group, params)
+
+    self.start_buffer()
+
+    self.write(self.mail_headers(group, params))
+
+  def finish(self):
+    try:
+      self.spool.add(self.from_addr, self.to_addrs, self.finish_buffer())
+    finally:
+      self.buffer.close()
+
+
+class SpoolSender:
+  """Deliver the messages queued by SpoolOutput via SMTP, forever.
+
+  Up to [general] spool_jobs messages are sent at the same time, each
+  sending thread keeping its own SMTP session open.  A message that fails
+  to be delivered is retried with an increasing delay, up to
+  [general] spool_retries times, before it is moved aside to the
+  spool's 'failed' directory.  Only one sender may run per spool, which
+  is enforced by locking it."""
+
+  POLL_INTERVAL = 5
+  RETRY_DELAY = 30
+  MAX_RETRY_DELAY = 3600
+
+  def __init__(self, cfg):
+    self.cfg = cfg
+    self.spool = Spool(cfg.general.spool_dir)
+    self.jobs = int(getattr(cfg.general, 'spool_jobs', 2))
+    self.retries = int(getattr(cfg.general, 'spool_retries', 10))
+
+    self.queue = Queue.Queue()
+    # Protects .busy and .attempts
+    self.lock = threading.Lock()
+    # names of the messages queued for, or being sent by, the threads
+    self.busy = set()
+    # name -> (number of failed attempts, time of the next attempt)
+    self.attempts = { }
+
+  def run(self):
+    try:
+      self.spool.lock()
+    except SpoolLocked:
+      sys.stderr.write("mailer.py: another sender is running for %s\n"
+                       % (self.spool.path,))
+      raise
+
+    for i in range(self.jobs):
+      t = threading.Thread(target=self._work)
+      t.setDaemon(True)
+      t.start()
+
+    while True:
+      now = time.time()
+      self.lock.acquire()
+      try:
+        for name in self.spool.pending():
+          if name in self.busy or self.attempts.get(name, (0, 0))[1] > now:
+            continue
+          self.busy.add(name)
+          self.queue.put(name)
+      finally:
+        self.lock.release()
+      time.sleep(self.POLL_INTERVAL)
+
+  def _work(self):
+    session = SMTPSession(self.cfg)
+    while True:
+      name = self.queue.get()
+      try:
+        self._send(session, name)
+      except Exception as detail:
+        sys.stderr.write("mailer.py: %s: %s\n" % (name, detail))
+      finally:
+        self.lock.acquire()
+        self.busy.discard(name)
+        self.lock.release()
+
+  def _send(self, session, name):
+    try:
+      from_addr, to_addrs, fp = self.spool.open(name)
+      try:
+        session.sendmail_file(from_addr, to_addrs, fp)
+      finally:
+        fp.close()
+    except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused) as detail:
+      # no point trying again
+      sys.stderr.write("mailer.py: %s: %s\n" % (name, detail))
+      self.spool.fail(name)
+      self.lock.acquire()
+      self.attempts.pop(name, None)
+      self.lock.release()
+    except Exception as detail:
+      session.abort()
+      self.lock.acquire()
+      try:
+        count = self.attempts.get(name, (0, 0))[0] + 1
+        if count > self.retries:
+          self.attempts.pop(name, None)
+        else:
+          delay = min(self.RETRY_DELAY * 2 ** (count - 1),
+                      self.MAX_RETRY_DELAY)
+          self.attempts[name] = (count, time.time() + delay)
+      finally:
+        self.lock.release()
+      sys.stderr.write("mailer.py: %s: attempt %d failed: %s\n"
+                       % (name, count, detail))
+      if count > self.retries:
+        self.spool.fail(name)
+    else:
+      self.spool.remove(name)
+      self.lock.acquire()
+      self.attempts.pop(name, None)
+      self.lock.release()
 
 
 class StandardOutput(OutputBase):
@@ -449,7 +819,10 @@ class Messenger:
     if cfg.is_set('general.mail_command'):
       cls = PipeOutput
     elif cfg.is_set('general.smtp_hostname'):
-      cls = SMTPOutput
+      if cfg.is_set('general.spool_dir'):
+        cls = SpoolOutput
+      else:
+        cls = SMTPOutput
     else:
       cls = StandardOutput
 
@@ -524,18 +897,32 @@ class Commit(Messenger):
     # build a renderer, tied to our output stream
     renderer = TextCommitRenderer(self.output)
 
-    for (group, param_tuple), (params, paths) in sorted(self.groups.items()):
-      try:
-        self.output.start(group, params)
+    # the diffs are the same for every group, so only produce them once
+    try:
+      diff_jobs = int(self.cfg.general.diff_jobs)
+    except (AttributeError, ValueError):
+      diff_jobs = 1
+    try:
+      diff_memory = int(self.cfg.general.diff_memory)
+    except (AttributeError, ValueError):
+      diff_memory = 16 * 1024 * 1024
+    cache = DiffCache(self.repos, self.pool, diff_jobs, diff_memory)
 
-        # generate the content for this group and set of params
-        generate_content(renderer, self.cfg, self.repos, self.changelist,
-                         group, params, paths, subpool)
+    try:
+      for (group, param_tuple), (params, paths) in sorted(self.groups.items()):
+        try:
+          self.output.start(group, params)
 
-        self.output.finish()
-      except MessageSendFailure:
-        ret = 1
-      svn.core.svn_pool_clear(subpool)
+          # generate the content for this group and set of params
+          generate_content(renderer, self.cfg, self.repos, self.changelist,
+                           group, params, paths, subpool, cache)
+
+          self.output.finish()
+        except MessageSendFailure:
+          ret = 1
+        svn.core.svn_pool_clear(subpool)
+    finally:
+      cache.close()
 
     svn.core.svn_pool_destroy(subpool)
     return ret
@@ -577,18 +964,30 @@ class PropChange(Messenger):
           self.output.write(propvalue)
         elif self.action == 'M':
           self.output.write('Property diff:\n')
-          tempfile1 = tempfile.NamedTemporaryFile()
-          tempfile1.write(_stdin.read())
-          tempfile1.flush()
-          tempfile2 = tempfile.NamedTemporaryFile()
-          tempfile2.write(self.repos.get_rev_prop(self.propname))
-          tempfile2.flush()
-          self.output.run(self.cfg.get_diff_cmd(group, {
-            'label_from' : 'old property value',
-            'label_to' : 'new property value',
-            'from' : tempfile1.name,
-            'to' : tempfile2.name,
-            }))
+          old_value = _stdin.read()
+          new_value = self.repos.get_rev_prop(self.propname)
+          if self.cfg.get('diff', group, None).strip():
+            tempfile1 = tempfile.NamedTemporaryFile()
+            tempfile1.write(old_value)
+            tempfile1.flush()
+            tempfile2 = tempfile.NamedTemporaryFile()
+            tempfile2.write(new_value)
+            tempfile2.flush()
+            self.output.run(self.cfg.get_diff_cmd(group, {
+              'label_from' : 'old property value',
+              'label_to' : 'new property value',
+              'from' : tempfile1.name,
+              'to' : tempfile2.name,
+              }))
+          else:
+            # no diff command; the values are not in the repository for
+            # Subversion's internal diff to read, so use difflib
+            import difflib
+            for line in difflib.unified_diff(
+                to_str(old_value).splitlines(True),
+                to_str(new_value).splitlines(True),
+                'old property value', 'new property value'):
+              self.output.write(line)
         self.output.finish()
       except MessageSendFailure:
         ret = 1
@@ -764,11 +1163,12 @@ class DiffURLSelections:
     return self._get_url('modify', repos_rev, change)
 
 def generate_content(renderer, cfg, repos, changelist, group, params, paths,
-                     pool):
+                     pool, cache=None):
+
+  if cache is None:
+    cache = DiffCache(repos, pool)
 
-  svndate = repos.get_rev_prop(svn.core.SVN_PROP_REVISION_DATE)
-  ### pick a different date format?
-  date = time.ctime(svn.core.secs_from_timestr(svndate, pool))
+  date = cache.get_date(repos.rev)
 
   diffsels = DiffSelections(cfg, group, params)
   diffurls = DiffURLSelections(cfg, group, params)
@@ -776,6 +1176,11 @@ def generate_content(renderer, cfg, repos, changelist, group, params, paths,
   show_nonmatching_paths = cfg.get('show_nonmatching_paths', group, params) \
       or 'yes'
 
+  try:
+    truncate_body = int(cfg.get('truncate_body', group, params))
+  except ValueError:
+    truncate_body = 0
+
   params_with_rev = params.copy()
   params_with_rev['rev'] = repos.rev
   commit_url = cfg.get('commit_url', group, params_with_rev)
@@ -791,7 +1196,8 @@ def generate_content(renderer, cfg, repos, changelist, group, params, paths,
 
   if len(paths) != len(changelist) and show_nonmatching_paths == 'yes':
     other_diffs = DiffGenerator(changelist, paths, False, cfg, repos, date,
-                                group, params, diffsels, diffurls, pool)
+                                group, params, diffsels, diffurls, pool,
+                                cache)
   else:
     other_diffs = None
 
@@ -811,8 +1217,9 @@ def generate_content(renderer, cfg, repos, changelist, group, params, paths,
     other_deleted_data=other_deleted_data,
     other_modified_data=other_modified_data,
     diffs=DiffGenerator(changelist, paths, True, cfg, repos, date, group,
-                        params, diffsels, diffurls, pool),
+                        params, diffsels, diffurls, pool, cache),
     other_diffs=other_diffs,
+    truncate_body=truncate_body,
     )
   renderer.render(data)
 
@@ -846,11 +1253,231 @@ def generate_list(changekind, changelist, paths, in_paths):
   return items
 
 
+class DiffCache:
+  """The diffs of a single commit, shared by the renderings of all its
+  groups.
+
+  Diffs are keyed on the paths and revisions being compared plus the
+  labels and diff command used, so a file's diff is produced at most once
+  per commit no matter how many groups show it.  With JOBS greater than
+  one, up to JOBS diff commands are run concurrently in background
+  threads.  The repository is only accessed from the calling thread, so
+  diffs made without a diff command, by svn.fs.FileDiff.iter_lines(),
+  are always produced there.
+
+  At most MEMORY_LIMIT bytes of diff lines are kept in memory; the lines
+  of diffs that do not fit are written to temporary files instead."""
+
+  def __init__(self, repos, pool, jobs=1, memory_limit=16 * 1024 * 1024):
+    self.repos = repos
+    self.pool = pool
+    self.jobs = max(1, jobs)
+    self.memory_limit = memory_limit
+
+    self._dates = { }
+    self._diffs = { }
+    self._queue = None
+    self._threads = [ ]
+    # Protects ._memory, the bytes of diff lines held in memory
+    self._lock = threading.Lock()
+    self._memory = 0
+
+  def get_date(self, rev):
+    "Return the formatted svn:date of revision REV."
+    try:
+      return self._dates[rev]
+    except KeyError:
+      pass
+    svndate = self.repos.get_rev_prop(svn.core.SVN_PROP_REVISION_DATE, rev)
+    ### pick a different date format?
+    date = self._dates[rev] = time.ctime(
+      svn.core.secs_from_timestr(svndate, self.pool))
+    return date
+
+  def get_diff(self, key, make_diff, get_diff_cmd, label_from, label_to,
+               limit=0):
+    """Return the _DiffJob for KEY.  If it is not known yet, call
+    MAKE_DIFF to get the svn.fs.FileDiff to compare, and GET_DIFF_CMD
+    with the substitutions for the diff command to run.  If LIMIT is
+    non-zero, only that many bytes of the diff are kept.  If GET_DIFF_CMD
+    is None, Subversion's internal diff is used instead."""
+    job = self._diffs.get(key)
+    if job is None:
+      diff = make_diff()
+      job = self._diffs[key] = _DiffJob(diff, get_diff_cmd,
+                                        label_from, label_to, limit,
+                                        self._reserve)
+      if not job.binary and job.cmd is not None and self.jobs > 1:
+        self._submit(job)
+    return job
+
+  def _submit(self, job):
+    if self._queue is None:
+      self._queue = Queue.Queue()
+      for i in range(self.jobs):
+        t = threading.Thread(target=self._work)
+        t.setDaemon(True)
+        t.start()
+        self._threads.append(t)
+    self._queue.put(job)
+
+  def _work(self):
+    while True:
+      job = self._queue.get()
+      if job is None:
+        return
+      job.run()
+
+  def _reserve(self, size):
+    """Account for SIZE more bytes of diff lines kept in memory, or for
+    -SIZE bytes released.  Return False, accounting for nothing, if
+    keeping them would go over the memory limit."""
+    self._lock.acquire()
+    try:
+      if size > 0 and self._memory + size > self.memory_limit:
+        return False
+      self._memory += size
+      return True
+    finally:
+      self._lock.release()
+
+  def close(self):
+    """Stop the background threads, once they have finished their work,
+    and release the diffs."""
+    for t in self._threads:
+      self._queue.put(None)
+    for t in self._threads:
+      t.join()
+    self._threads = [ ]
+    self._queue = None
+    for job in self._diffs.values():
+      job.release()
+    self._diffs = { }
+
+
+class _DiffJob:
+  """The diff of one file, produced on demand or by a DiffCache thread.
+
+  Its lines are kept in memory for as long as RESERVE, called with the
+  size of each line, allows; after that they go to a temporary file."""
+
+  def __init__(self, diff, get_diff_cmd, label_from, label_to, limit=0,
+               reserve=None):
+    self.diff = diff
+    self.label_from = label_from
+    self.label_to = label_to
+    self.limit = limit
+    # what was dropped to stay within LIMIT
+    self.omitted_lines = 0
+    self.omitted_bytes = 0
+    self.binary = diff.either_binary()
+    self.src_fname = self.dst_fname = None
+    self.cmd = None
+    if not self.binary and get_diff_cmd is not None:
+      self.src_fname, self.dst_fname = diff.get_files()
+      self.cmd = get_diff_cmd({
+        'label_from' : label_from,
+        'label_to' : label_to,
+        'from' : self.src_fname,
+        'to' : self.dst_fname,
+        })
+    self.reserve = reserve or (lambda size: True)
+    self._done = False
+    self._lines = None
+    # the temporary file holding the lines, if they did not fit in memory
+    self._file = None
+    # bytes of ._lines accounted for by .reserve
+    self._reserved = 0
+    self._error = None
+    self._lock = threading.Lock()
+
+  def run(self):
+    # Whoever gets here first does the work, and everybody else waits.
+    self._lock.acquire()
+    try:
+      if self._done:
+        return
+      self._done = True
+      try:
+        if self.cmd is None:
+          # no temporary files or diff process needed
+          lines = self.diff.iter_lines(self.label_from, self.label_to)
+        else:
+          try:
+            content = DiffContent(self.cmd)
+          except OSError:
+            # diff command does not exist, try difflib.unified_diff()
+            content = DifflibDiffContent(self.label_from, self.label_to,
+                                         self.src_fname, self.dst_fname)
+          lines = (line.raw for line in content)
+        self._lines = [ ]
+        size = 0
+        for line in lines:
+          size += len(line)
+          if self.limit and size > self.limit:
+            self.omitted_lines += 1
+            self.omitted_bytes += len(line)
+          elif self._file is not None:
+            self._file.write(line)
+          elif self.reserve(len(line)):
+            self._reserved += len(line)
+            self._lines.append(line)
+          else:
+            self._spill()
+            self._file.write(line)
+      except Exception as e:
+        self._error = e
+        self.release()
+      # the lines are all we need from here on
+      for fname in (self.src_fname, self.dst_fname):
+        if fname is None:
+          continue
+        try:
+          os.remove(fname)
+        except OSError:
+          pass
+    finally:
+      self._lock.release()
+
+  def _spill(self):
+    "Move the lines kept in memory to a temporary file."
+    self._file = tempfile.TemporaryFile()
+    self._file.writelines(self._lines)
+    self._lines = None
+    self.reserve(-self._reserved)
+    self._reserved = 0
+
+  def iter_lines(self):
+    """Return an iterator over the raw lines of the diff, waiting for it
+    if necessary."""
+    self.run()
+    if self._error is not None:
+      raise self._error
+    if self._file is None:
+      return iter(self._lines)
+    return self._iter_file()
+
+  def _iter_file(self):
+    # The renderer reads one diff at a time, so the file is not shared.
+    self._file.seek(0)
+    for line in self._file:
+      yield line
+
+  def release(self):
+    "Drop the lines of the diff."
+    self._lines = None
+    self.reserve(-self._reserved)
+    self._reserved = 0
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+
+
 class DiffGenerator:
   "This is a generator-like object returning DiffContent objects."
 
   def __init__(self, changelist, paths, in_paths, cfg, repos, date, group,
-               params, diffsels, diffurls, pool):
+               params, diffsels, diffurls, pool, cache=None):
     self.changelist = changelist
     self.paths = paths
     self.in_paths = in_paths
@@ -862,24 +1489,53 @@ class DiffGenerator:
     self.diffsels = diffsels
     self.diffurls = diffurls
     self.pool = pool
+    if cache is None:
+      cache = DiffCache(repos, pool)
+    self.cache = cache
+
+    try:
+      self.truncate_diff = int(cfg.get('truncate_diff', group, params))
+    except ValueError:
+      self.truncate_diff = 0
 
     self.diff = self.diff_url = None
 
     self.idx = 0
 
+    # items prepared ahead of the renderer, whose diffs may be running
+    self.ahead = deque()
+
   def __nonzero__(self):
     # we always have some items
     return True
 
   def __getitem__(self, idx):
+    # Keep enough diffs in flight to occupy all of the cache's threads
+    # while the renderer works through the current one.  Without
+    # threads, there is nothing to gain from looking ahead.
+    if self.cache.jobs > 1:
+      ahead = self.cache.jobs
+    else:
+      ahead = 0
+    while len(self.ahead) <= ahead:
+      item = self._next_item()
+      if item is None:
+        break
+      self.ahead.append(item)
+    if not self.ahead:
+      raise IndexError
+    return self.ahead.popleft()
+
+  def _next_item(self):
     while True:
       if self.idx == len(self.changelist):
-        raise IndexError
+        return None
 
       path, change = self.changelist[self.idx]
       self.idx = self.idx + 1
 
       diff = diff_url = None
+      diff_args = None
       kind = None
       label1 = None
       label2 = None
@@ -898,10 +1554,7 @@ class DiffGenerator:
         continue
 
       if change.base_rev != -1:
-        svndate = self.repos.get_rev_prop(svn.core.SVN_PROP_REVISION_DATE,
-                                          change.base_rev)
-        ### pick a different date format?
-        base_date = time.ctime(svn.core.secs_from_timestr(svndate, self.pool))
+        base_date = self.cache.get_date(change.base_rev)
       else:
         base_date = ''
 
@@ -919,8 +1572,8 @@ class DiffGenerator:
 
         # show the diff?
         if self.diffsels.delete:
-          diff = svn.fs.FileDiff(self.repos.get_root(change.base_rev),
-                                 base_path_bytes, None, None, self.pool)
+          diff_args = (self.repos.get_root(change.base_rev),
+                       base_path_bytes, None, None, self.pool)
 
           label1 = '%s\t%s\t(r%s)' % (base_path, self.date, change.base_rev)
           label2 = '/dev/null\t00:00:00 1970\t(deleted)'
@@ -940,10 +1593,10 @@ class DiffGenerator:
 
             # show the diff?
             if self.diffsels.modify:
-              diff = svn.fs.FileDiff(self.repos.get_root(change.base_rev),
-                                     base_path_bytes,
-                                     self.repos.root_this, change.path,
-                                     self.pool)
+              diff_args = (self.repos.get_root(change.base_rev),
+                           base_path_bytes,
+                           self.repos.root_this, change.path,
+                           self.pool)
               label1 = ('%s\t%s\t(r%s, copy source)'
                         % (base_path, base_date, change.base_rev))
               label2 = ('%s\t%s\t(r%s)'
@@ -953,8 +1606,8 @@ class DiffGenerator:
             # this file was copied.
             kind = 'C'
             if self.diffsels.copy:
-              diff = svn.fs.FileDiff(None, None, self.repos.root_this,
-                                     change.path, self.pool)
+              diff_args = (None, None, self.repos.root_this,
+                           change.path, self.pool)
               label1 = ('/dev/null\t00:00:00 1970\t'
                         '(empty, because file is newly added)')
               label2 = ('%s\t%s\t(r%s, copy of r%s, %s)'
@@ -971,8 +1624,8 @@ class DiffGenerator:
 
           # show the diff?
           if self.diffsels.add:
-            diff = svn.fs.FileDiff(None, None, self.repos.root_this,
-                                   change.path, self.pool)
+            diff_args = (None, None, self.repos.root_this,
+                         change.path, self.pool)
             label1 = '/dev/null\t00:00:00 1970\t' \
                      '(empty, because file is newly added)'
             label2 = '%s\t%s\t(r%s)' \
@@ -991,32 +1644,37 @@ class DiffGenerator:
 
         # show the diff?
         if self.diffsels.modify:
-          diff = svn.fs.FileDiff(self.repos.get_root(change.base_rev),
-                                 base_path,
-                                 self.repos.root_this, change.path,
-                                 self.pool)
+          diff_args = (self.repos.get_root(change.base_rev),
+                       base_path,
+                       self.repos.root_this, change.path,
+                       self.pool)
           label1 = '%s\t%s\t(r%s)' \
                    % (base_path, base_date, change.base_rev)
           label2 = '%s\t%s\t(r%s)' \
                    % (to_str(change.path), self.date, self.repos.rev)
           singular = False
 
-      if diff:
-        binary = diff.either_binary()
+      if diff_args:
+        diff_cmd = self.cfg.get('diff', self.group, None)
+        if diff_cmd.strip():
+          get_diff_cmd = functools.partial(self.cfg.get_diff_cmd, self.group)
+        else:
+          # an empty 'diff' option selects Subversion's internal diff
+          get_diff_cmd = None
+        key = (base_path_bytes, change.base_rev, change.path, label1, label2,
+               diff_cmd, self.truncate_diff)
+        job = self.cache.get_diff(key,
+                                  lambda: svn.fs.FileDiff(*diff_args),
+                                  get_diff_cmd,
+                                  label1, label2, self.truncate_diff)
+        diff = job.diff
+        binary = job.binary
+        src_fname = job.src_fname
+        dst_fname = job.dst_fname
         if binary:
-          content = src_fname = dst_fname = None
+          content = None
         else:
-          src_fname, dst_fname = diff.get_files()
-          try:
-            content = DiffContent(self.cfg.get_diff_cmd(self.group, {
-              'label_from' : label1,
-              'label_to' : label2,
-              'from' : src_fname,
-              'to' : dst_fname,
-              }))
-          except OSError:
-            # diff command does not exist, try difflib.unified_diff()
-            content = DifflibDiffContent(label1, label2, src_fname, dst_fname)
+          content = CachedDiffContent(job)
 
       # return a data item for this diff
       return _data(
@@ -1096,6 +1754,40 @@ class DiffContent:
       type=ltype,
       )
 
+class CachedDiffContent:
+  "This is a generator-like object returning annotated lines of a diff."
+
+  def __init__(self, job):
+    self.job = job
+    self.seen_change = False
+    self.lines = None
+
+  def omitted(self):
+    "Return the number of lines and bytes of the diff left out."
+    self.job.run()
+    return self.job.omitted_lines, self.job.omitted_bytes
+
+  def __nonzero__(self):
+    # we always have some items
+    return True
+
+  def __getitem__(self, idx):
+    # the lines are read in order, so IDX is not needed
+    if self.lines is None:
+      self.lines = self.job.iter_lines()
+    try:
+      line = next(self.lines)
+    except StopIteration:
+      raise IndexError
+
+    line, ltype, self.seen_change = _classify_diff_line(line,
+                                                        self.seen_change)
+    return _data(
+      raw=line,
+      text=line[1:-1],  # remove indicator and newline
+      type=ltype,
+      )
+
 class DifflibDiffContent():
   "This is a generator-like object returning annotated lines of a diff."
 
@@ -1136,6 +1828,9 @@ class TextCommitRenderer:
 
     w = self.output.write
 
+    # bytes of diff output left before diffs are omitted, if limited
+    self.budget = data.truncate_body or None
+
     w('Author: %s\nDate: %s\nNew Revision: %s\n' % (data.author,
                                                       data.date,
                                                       data.rev))
@@ -1244,9 +1939,36 @@ class TextCommitRenderer:
           w('Binary file (source and/or target). No diff available.\n')
         continue
 
+      if self.budget is not None and self.budget <= 0:
+        w('Diff omitted: the size limit of this email has been reached.\n')
+        continue
+
       wb = self.output.write_binary
+      written = 0
+      omitted_lines = omitted_bytes = 0
       for line in diff.content:
+        if self.budget is not None and written + len(line.raw) > self.budget:
+          # keep going, just to count what gets dropped
+          omitted_lines += 1
+          omitted_bytes += len(line.raw)
+          continue
         wb(line.raw)
+        written += len(line.raw)
+
+      if self.budget is not None:
+        self.budget -= written
+        if omitted_lines:
+          # nothing more fits
+          self.budget = 0
+
+      if hasattr(diff.content, 'omitted'):
+        # lines the diff was already cut down by (see truncate_diff)
+        more_lines, more_bytes = diff.content.omitted()
+        omitted_lines += more_lines
+        omitted_bytes += more_bytes
+      if omitted_lines:
+        w('\n[Diff truncated: %d more lines (%d bytes) not shown]\n'
+          % (omitted_lines, omitted_bytes))
 
 
 class Repository:
@@ -1471,16 +2193,73 @@ class Config:
       # there is no self.defaults.for_paths
       pass
 
+    # The for_paths patterns are anchored at the start of the path, so a
+    # path can only match those whose literal prefix it starts with.
+    # Index the groups in a character trie of those prefixes; each node
+    # is a pair of the indexes into _group_re of the groups whose prefix
+    # ends there, and a dict of the child nodes.
+    self._prefix_root = ([ ], { })
+    for idx in range(len(self._group_re)):
+      node = self._prefix_root
+      for c in _literal_prefix(self._group_re[idx][1].pattern):
+        node = node[1].setdefault(c, ([ ], { }))
+      node[0].append(idx)
+
+    # directory -> (candidate group indexes, trie node reached)
+    self._dir_candidates = { }
+    # (group index, log message) -> list of search_logmsg param dicts
+    self._logmsg_params = { }
+
+  def _candidate_groups(self, path):
+    """Return the indexes into _group_re of the groups whose for_paths
+    could match PATH, in order."""
+    slash = path.rfind('/') + 1
+    dirname = path[:slash]
+
+    # paths in the same directory share most of their walk down the trie
+    try:
+      dir_found, dir_node = self._dir_candidates[dirname]
+    except KeyError:
+      dir_found = list(self._prefix_root[0])
+      dir_node = _walk_prefix_trie(self._prefix_root, dirname, dir_found)
+      dir_found.sort()
+      self._dir_candidates[dirname] = (dir_found, dir_node)
+
+    if dir_node is None or not dir_node[1]:
+      return dir_found
+    found = list(dir_found)
+    _walk_prefix_trie(dir_node, path[slash:], found)
+    found.sort()
+    return found
+
+  def _search_logmsg(self, idx, search_logmsg_re, logmsg):
+    "Return the params captured by each match of SEARCH_LOGMSG_RE."
+    try:
+      return self._logmsg_params[idx, logmsg]
+    except KeyError:
+      pass
+    found = self._logmsg_params[idx, logmsg] = \
+        [match.groupdict() for match in search_logmsg_re.finditer(logmsg)]
+    return found
+
   def which_groups(self, path, logmsg):
     "Return the path's associated groups."
     groups = []
-    for group, pattern, exclude_pattern, repos_params, search_logmsg_re in self._group_re:
-      match = pattern.match(to_str(path))
+    path = to_str(path)
+    for idx in self._candidate_groups(path):
+      group, pattern, exclude_pattern, repos_params, search_logmsg_re = \
+          self._group_re[idx]
+      match = pattern.match(path)
       if match:
-        if exclude_pattern and exclude_pattern.match(to_str(path)):
+        if exclude_pattern and exclude_pattern.match(path):
           continue
-        params = repos_params.copy()
-        params.update(match.groupdict())
+        # the params are never modified, so share them when we can
+        captured = match.groupdict()
+        if captured:
+          params = repos_params.copy()
+          params.update(captured)
+        else:
+          params = repos_params
 
         if search_logmsg_re is None:
           groups.append((group, params))
@@ -1488,10 +2267,10 @@ class Config:
           if logmsg is None:
             logmsg = ''
 
-          for match in search_logmsg_re.finditer(logmsg):
+          for captured in self._search_logmsg(idx, search_logmsg_re, logmsg):
             # Add captured variables to (a copy of) params
             msg_params = params.copy()
-            msg_params.update(match.groupdict())
+            msg_params.update(captured)
             groups.append((group, msg_params))
 
     if not groups:
@@ -1500,6 +2279,53 @@ class Config:
     return groups
 
 
+def _literal_prefix(pattern):
+  """Return a literal string which every string matched from the start
+  by the regular expression PATTERN begins with.  It may be empty."""
+  # An alternative at the top level could match anything.
+  depth = 0
+  escaped = in_class = False
+  for c in pattern:
+    if escaped:
+      escaped = False
+    elif c == '\\':
+      escaped = True
+    elif in_class:
+      in_class = c != ']'
+    elif c == '[':
+      in_class = True
+    elif c == '(':
+      depth += 1
+    elif c == ')':
+      depth -= 1
+    elif c == '|' and depth == 0:
+      return ''
+
+  if pattern[:1] == '^':
+    pattern = pattern[1:]
+  prefix = [ ]
+  for i in range(len(pattern)):
+    c = pattern[i]
+    if c in '.^$*+?{}[]\\|()':
+      break
+    if pattern[i+1:i+2] in ('*', '?', '{'):
+      # this character is optional
+      break
+    prefix.append(c)
+  return ''.join(prefix)
+
+
+def _walk_prefix_trie(node, s, found):
+  """Follow S down the trie from NODE, adding to FOUND the groups of the
+  nodes passed.  Return the node reached, or None if S leaves the trie."""
+  for c in s:
+    node = node[1].get(c)
+    if node is None:
+      return None
+    found.extend(node[0])
+  return node
+
+
 class _sub_section:
   pass
 
@@ -1518,6 +2344,8 @@ class UnknownSubcommand(Exception):
   pass
 class MessageSendFailure(Exception):
   pass
+class SpoolLocked(Exception):
+  pass
 
 
 if __name__ == '__main__':
@@ -1529,6 +2357,7 @@ if __name__ == '__main__':
        %s propchange2 REPOS REVISION AUTHOR REVPROPNAME ACTION [CONFIG-FILE]
        %s lock        REPOS AUTHOR [CONFIG-FILE]
        %s unlock      REPOS AUTHOR [CONFIG-FILE]
+       %s send-spool  REPOS [CONFIG-FILE]
 
 If no CONFIG-FILE is provided, the script will first search for a mailer.conf
 file in REPOS/conf/.  Failing that, it will search the directory in which
@@ -1538,7 +2367,11 @@ ACTION was added as a fifth argument to the post-revprop-change hook
 in Subversion 1.2.0.  Its value is one of 'A', 'M' or 'D' to indicate
 if the property was added, modified or deleted, respectively.
 
-""" % (scriptname, scriptname, scriptname, scriptname, scriptname))
+send-spool runs until killed, delivering the emails queued in the
+[general] spool_dir directory.
+
+""" % (scriptname, scriptname, scriptname, scriptname, scriptname,
+       scriptname))
     sys.exit(1)
 
   # Command list:  subcommand -> number of arguments expected (not including
@@ -1548,6 +2381,7 @@ if the property was added, modified or deleted, respectively.
               'propchange2': 4,
               'lock'       : 1,
               'unlock'     : 1,
+              'send-spool' : 0,
               }
 
   config_fname = None
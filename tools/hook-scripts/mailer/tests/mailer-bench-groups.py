@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+#
+# mailer-bench-groups.py: time Config.which_groups() against a plain
+#                         scan of every group
+#
+# A configuration with GROUPS groups is generated, and the groups of
+# PATHS changed paths are looked up, both with Config.which_groups() and
+# with the linear scan it replaced.  The two must agree.
+#
+# USAGE: ./mailer-bench-groups.py [GROUPS [PATHS]]
+#
+
+
+import sys
+import os
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mailer
+
+
+def write_config(fname, ngroups):
+  fp = open(fname, 'w')
+  fp.write('[general]\n\n'
+           '[defaults]\n'
+           'to_addr = commits@example.com\n\n')
+  for i in range(ngroups):
+    fp.write('[project%d]\n' % i)
+    if i % 10 == 0:
+      # a group capturing the branch name
+      fp.write('for_paths = project%d/branches/(?P<branch>[^/]+)/\n' % i)
+    elif i % 10 == 1:
+      fp.write('for_paths = project%d/\n'
+               'exclude_paths = project%d/tags/\n' % (i, i))
+    elif i % 10 == 2:
+      fp.write('for_paths = project%d/trunk/.*\\.c$\n'
+               'search_logmsg = (?P<issue>ISSUE-[0-9]+)\n' % i)
+    else:
+      fp.write('for_paths = project%d/(trunk|branches)/\n' % i)
+    fp.write('to_addr = project%d@example.com\n\n' % i)
+  # a couple of groups which can match anywhere
+  fp.write('[everything-c]\nfor_paths = .*\\.c$\nto_addr = c@example.com\n\n'
+           '[docs]\nfor_paths = [^/]+/trunk/doc/\nto_addr = doc@example.com\n')
+  fp.close()
+
+
+def make_paths(ngroups, npaths):
+  paths = [ ]
+  for i in range(npaths):
+    project = (i * 7) % ngroups
+    where = ('trunk', 'branches/1.x', 'tags/1.0')[i % 3]
+    # changed paths are bytes, as they come from the repository
+    paths.append(mailer.to_bytes('project%d/%s/src/dir%d/file%d.%s'
+                                 % (project, where, i % 50, i, 'ch'[i % 2])))
+  return paths
+
+
+def linear_which_groups(cfg, path, logmsg):
+  "Config.which_groups() as it was, scanning every group for every path."
+  groups = []
+  for group, pattern, exclude_pattern, repos_params, search_logmsg_re in cfg._group_re:
+    match = pattern.match(mailer.to_str(path))
+    if match:
+      if exclude_pattern and exclude_pattern.match(mailer.to_str(path)):
+        continue
+      params = repos_params.copy()
+      params.update(match.groupdict())
+
+      if search_logmsg_re is None:
+        groups.append((group, params))
+      else:
+        if logmsg is None:
+          logmsg = ''
+
+        for match in search_logmsg_re.finditer(logmsg):
+          msg_params = params.copy()
+          msg_params.update(match.groupdict())
+          groups.append((group, msg_params))
+
+  if not groups:
+    groups.append((None, cfg._default_params))
+
+  return groups
+
+
+class _Repos:
+  repos_dir = '/repos/bench'
+
+
+def main():
+  ngroups = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+  npaths = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+
+  fd, fname = tempfile.mkstemp(suffix='.conf')
+  os.close(fd)
+  try:
+    write_config(fname, ngroups)
+    cfg = mailer.Config(fname, _Repos(), {'author': 'bench'})
+  finally:
+    os.remove(fname)
+
+  paths = make_paths(ngroups, npaths)
+  logmsg = 'Fix ISSUE-123 and ISSUE-456.'
+
+  start = time.time()
+  expected = [linear_which_groups(cfg, path, logmsg) for path in paths]
+  linear = time.time() - start
+
+  start = time.time()
+  actual = [cfg.which_groups(path, logmsg) for path in paths]
+  indexed = time.time() - start
+
+  if actual != expected:
+    sys.stderr.write('FAIL: which_groups() differs from the linear scan\n')
+    sys.exit(1)
+
+  print('%d groups, %d paths' % (ngroups, npaths))
+  print('linear scan:  %.3fs' % linear)
+  print('which_groups: %.3fs (%.1fx)' % (indexed, linear / max(indexed, 1e-9)))
+
+if __name__ == '__main__':
+  main()
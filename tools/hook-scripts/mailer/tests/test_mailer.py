@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+#
+# test_mailer.py: unit tests for parts of mailer.py that can be tested
+#                 without a repository
+#
+# USAGE: ./test_mailer.py
+#
+
+
+import sys
+import os
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import mailer
+
+
+class _FileDiff:
+  "Stands in for svn.fs.FileDiff, comparing two files of given lines."
+
+  def __init__(self, tmpdir, name, from_lines, to_lines):
+    self.files = [ ]
+    for suffix, lines in (('.from', from_lines), ('.to', to_lines)):
+      fname = os.path.join(tmpdir, name + suffix)
+      fp = open(fname, 'w')
+      fp.writelines(lines)
+      fp.close()
+      self.files.append(fname)
+
+  def either_binary(self):
+    return False
+
+  def get_files(self):
+    self.used_files = True
+    return self.files
+
+  def iter_lines(self, label1, label2):
+    import difflib
+    lines = [ ]
+    for fname in self.files:
+      fp = open(fname)
+      lines.append(fp.readlines())
+      fp.close()
+    return iter([line.encode('UTF-8') for line in
+                 difflib.unified_diff(lines[0], lines[1], label1, label2)])
+
+
+def _diff_cmd(substitutions):
+  return ['diff', '-u', substitutions['from'], substitutions['to']]
+
+
+class DiffCacheTests(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def get_diff(self, cache, name, nlines):
+    diff = _FileDiff(self.tmpdir, name, ['a\n'] * nlines, ['b\n'] * nlines)
+    return cache.get_diff(name, lambda: diff, _diff_cmd, 'from', 'to')
+
+  def test_memory_limit(self):
+    cache = mailer.DiffCache(None, None, memory_limit=1000)
+    small = self.get_diff(cache, 'small', 10)
+    large = self.get_diff(cache, 'large', 1000)
+    small_lines = list(small.iter_lines())
+    large_lines = list(large.iter_lines())
+    self.assertEqual(len(small_lines), 23)
+    self.assertEqual(len(large_lines), 2003)
+    self.assertEqual(large_lines[-1], b'+b\n')
+
+    # the large diff went to a file, and released the memory it had used
+    self.assertEqual(large._lines, None)
+    self.assertEqual(cache._memory, sum([len(x) for x in small_lines]))
+    # and can be read again, for the next group
+    self.assertEqual(list(large.iter_lines()), large_lines)
+
+    cache.close()
+    self.assertEqual(small._lines, None)
+    self.assertEqual(large._file, None)
+    self.assertEqual(cache._memory, 0)
+
+  def test_internal_diff(self):
+    cache = mailer.DiffCache(None, None, jobs=2)
+    diff = _FileDiff(self.tmpdir, 'x', ['a\n', 'b\n'], ['a\n', 'c\n'])
+    job = cache.get_diff('x', lambda: diff, None, 'from', 'to')
+    # run in this thread, without temporary files
+    self.assertEqual(cache._queue, None)
+    self.assertEqual(list(job.iter_lines()),
+                     [b'--- from\n', b'+++ to\n', b'@@ -1,2 +1,2 @@\n',
+                      b' a\n', b'-b\n', b'+c\n'])
+    self.assertFalse(hasattr(diff, 'used_files'))
+    cache.close()
+
+
+class _Cache:
+  def __init__(self, jobs):
+    self.jobs = jobs
+
+class _Generator(mailer.DiffGenerator):
+  "A DiffGenerator over a list of items, recording how far it looked."
+
+  def __init__(self, items, jobs):
+    self.items = items
+    self.taken = 0
+    self.cache = _Cache(jobs)
+    self.ahead = mailer.deque()
+
+  def _next_item(self):
+    if self.taken == len(self.items):
+      return None
+    self.taken += 1
+    return self.items[self.taken - 1]
+
+
+class DiffGeneratorTests(unittest.TestCase):
+
+  def test_look_ahead(self):
+    gen = _Generator(['a', 'b', 'c', 'd', 'e'], 1)
+    self.assertEqual(gen[0], 'a')
+    self.assertEqual(gen.taken, 1)
+
+    gen = _Generator(['a', 'b', 'c', 'd', 'e'], 2)
+    self.assertEqual(gen[0], 'a')
+    self.assertEqual(gen.taken, 3)
+    self.assertEqual(list(gen), ['b', 'c', 'd', 'e'])
+
+
+class _SMTPServer:
+  "Stands in for smtplib.SMTP, recording the commands it gets."
+
+  def __init__(self, extensions, refuse):
+    self.extensions = extensions
+    self.refuse = refuse
+    self.commands = [ ]
+    self.data = b''
+
+  def has_extn(self, name):
+    return name in self.extensions
+
+  def ehlo_or_helo_if_needed(self):
+    pass
+
+  def rset(self):
+    self.commands.append(('rset',))
+
+  def mail(self, from_addr, options=[]):
+    self.commands.append(('mail', from_addr, options))
+    return 250, b'OK'
+
+  def rcpt(self, addr):
+    self.commands.append(('rcpt', addr))
+    if addr in self.refuse:
+      return 550, b'no such user'
+    return 250, b'OK'
+
+  def docmd(self, cmd):
+    self.commands.append((cmd,))
+    return 354, b'go ahead'
+
+  def send(self, data):
+    self.data += data
+
+  def getreply(self):
+    return 250, b'OK'
+
+
+class SMTPSessionTests(unittest.TestCase):
+
+  def sendmail(self, server, to_addrs):
+    session = mailer.SMTPSession(None)
+    session.server = server
+    fp = tempfile.TemporaryFile()
+    fp.write(b'Subject: test\n\n.body\n')
+    fp.seek(0)
+    sys.stderr, stderr = open(os.devnull, 'w'), sys.stderr
+    try:
+      return session.sendmail_file('from@example.com', to_addrs, fp)
+    finally:
+      sys.stderr.close()
+      sys.stderr = stderr
+      fp.close()
+
+  def test_refused(self):
+    server = _SMTPServer(['8bitmime'], ['b@example.com'])
+    refused = self.sendmail(server, ['a@example.com', 'b@example.com'])
+    self.assertEqual(refused, {'b@example.com': (550, b'no such user')})
+    self.assertEqual(server.commands[1],
+                     ('mail', 'from@example.com', ['BODY=8BITMIME']))
+    self.assertEqual(server.data, b'Subject: test\r\n\r\n..body\r\n.\r\n')
+
+    server = _SMTPServer([], ['a@example.com'])
+    self.assertRaises(mailer.smtplib.SMTPRecipientsRefused,
+                      self.sendmail, server, ['a@example.com'])
+    self.assertEqual(server.commands[1], ('mail', 'from@example.com', [ ]))
+    self.assertEqual(server.data, b'')
+
+
+class _General:
+  pass
+
+class _Config:
+  def __init__(self, spool_dir, retries):
+    self.general = _General()
+    self.general.spool_dir = spool_dir
+    self.general.spool_retries = str(retries)
+
+class _FailingSession:
+  def sendmail_file(self, from_addr, to_addrs, fp):
+    raise IOError('connection refused')
+
+  def abort(self):
+    pass
+
+
+class SpoolSenderTests(unittest.TestCase):
+
+  def setUp(self):
+    self.tmpdir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpdir)
+
+  def test_no_retries(self):
+    sender = mailer.SpoolSender(_Config(self.tmpdir, 0))
+    fp = tempfile.TemporaryFile()
+    fp.write(b'Subject: test\n\nbody\n')
+    fp.seek(0)
+    sender.spool.add('from@example.com', ['to@example.com'], fp)
+    fp.close()
+    name = sender.spool.pending()[0]
+
+    sender._send(_FailingSession(), name)
+    self.assertEqual(sender.spool.pending(), [ ])
+    self.assertEqual(os.listdir(os.path.join(self.tmpdir, 'failed')), [name])
+    self.assertEqual(sender.attempts, { })
+
+  def test_one_sender(self):
+    spool = mailer.Spool(self.tmpdir)
+    spool.lock()
+    sender = mailer.SpoolSender(_Config(self.tmpdir, 0))
+    sys.stderr, stderr = open(os.devnull, 'w'), sys.stderr
+    try:
+      self.assertRaises(mailer.SpoolLocked, sender.run)
+    finally:
+      sys.stderr.close()
+      sys.stderr = stderr
+    spool._lock_file.close()
+
+
+if __name__ == '__main__':
+  unittest.main()
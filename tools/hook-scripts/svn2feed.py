@@ -60,15 +60,18 @@ Options:
 
  -P, --svn-path=DIR     Look in DIR for the svnlook binary.  If not provided,
                         svnlook must be on the PATH.
+
+ -b, --bindings         Read the revisions in-process through the Subversion
+                        Python bindings instead of running svnlook for each
+                        one.  Recommended when generating many items.
+
+The items in the feed are kept in FEED-FILE.items, one per line, and the
+feed file is rewritten (atomically) only when they change.
 """
 
 # TODO:
 # --item-url should support arbitrary formatting of the revision number,
 #   to be useful with web viewers other than ViewVC.
-# Rather more than intended is being cached in the pickle file. Instead of
-#   only old items being drawn from the pickle, all the global feed metadata
-#   is actually set only on initial feed creation, and thereafter simply
-#   re-used from the pickle each time.
 
 # $HeadURL$
 # $LastChangedDate$
@@ -86,6 +89,8 @@ if sys.version_info < (2, 4):
 import getopt
 import os
 import subprocess
+import tempfile
+import json
 try:
   # Python <3.0
   import cPickle as pickle
@@ -109,7 +114,7 @@ def usage_and_exit(errmsg=None):
     stream.flush()
     if errmsg:
         stream.write("\nError: %s\n" % errmsg)
-	stream.flush()
+        stream.flush()
         sys.exit(2)
     sys.exit(0)
 
@@ -122,42 +127,246 @@ def check_url(url, opt):
                      "'%s' option" % (url, opt))
 
 
+def import_bindings():
+    """Return the svn.core, svn.fs and svn.repos modules, or exit with an
+    error if the Subversion Python bindings are not available."""
+    try:
+        import svn.core, svn.fs, svn.repos
+    except ImportError:
+        sys.stderr.write("Error: The Subversion Python bindings are "
+                         "required by --bindings.\n")
+        sys.exit(1)
+    return svn.core, svn.fs, svn.repos
+
+def _to_str(value):
+    "Decode VALUE if it is bytes which are not str (i.e. on Python 3)."
+    if isinstance(value, bytes) and not isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+def write_atomically(path, write):
+    """Call WRITE with a binary file object open on a temporary file next
+    to PATH, then move the temporary file over PATH."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+                                    prefix=os.path.basename(path) + '.')
+    try:
+        f = os.fdopen(fd, 'wb')
+        try:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+
+class ItemStore:
+    """The most recent feed items, stored one JSON object per line, oldest
+    first.  New items are appended to the file, which is only rewritten
+    once it holds twice as many lines as there are items to keep.  A line
+    which can't be read (e.g. the last one, after a crash while it was
+    appended) is skipped, and the file rewritten by the next save."""
+
+    def __init__(self, path, max_items):
+        self.path = path
+        self.max_items = max_items
+        self.lines = 0
+        self.pending = []
+        self.damaged = False
+        items = {}
+        if os.path.exists(path):
+            f = open(path, 'rb')
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    item = None
+                if not isinstance(item, dict) or 'revision' not in item:
+                    sys.stderr.write("Warning: skipping a damaged line in "
+                                     "'%s'.\n" % path)
+                    self.damaged = True
+                    continue
+                # a revision added again supersedes its older line
+                items[item['revision']] = item
+                self.lines += 1
+            f.close()
+        self._set_items(items)
+
+    def _set_items(self, items):
+        revisions = sorted(items.keys())[-self.max_items:]
+        self.items = dict([(revision, items[revision])
+                           for revision in revisions])
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def add(self, item):
+        "Add ITEM (a dict with a 'revision' key), unless it is already kept."
+        if self.items.get(item['revision']) == item:
+            return
+        self.items[item['revision']] = item
+        self._set_items(self.items)
+        self.pending.append(item)
+
+    def newest_first(self):
+        return [self.items[revision]
+                for revision in sorted(self.items.keys(), reverse=True)]
+
+    def save(self):
+        "Write out any added items.  Return true if there were some."
+        if not self.pending:
+            return False
+        if self.damaged \
+               or self.lines + len(self.pending) > 2 * self.max_items:
+            items = self.newest_first()
+            items.reverse()
+            def write(f):
+                for item in items:
+                    f.write(self._encode(item))
+            write_atomically(self.path, write)
+            self.lines = len(items)
+            self.damaged = False
+        else:
+            f = open(self.path, 'ab')
+            for item in self.pending:
+                f.write(self._encode(item))
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            self.lines += len(self.pending)
+        self.pending = []
+        return True
+
+    def _encode(self, item):
+        return (json.dumps(item, sort_keys=True) + '\n').encode('utf-8')
+
+
 class Svn2Feed:
     def __init__(self, svn_path, repos_path, item_url, feed_file,
-                 max_items, feed_url):
+                 max_items, feed_url, bindings=False):
         self.repos_path = repos_path
         self.item_url = item_url
         self.feed_file = feed_file
         self.max_items = max_items
         self.feed_url = feed_url
+        self.bindings = bindings
         self.svnlook_cmd = 'svnlook'
         if svn_path is not None:
             self.svnlook_cmd = os.path.join(svn_path, 'svnlook')
         self.feed_title = ("%s's Subversion Commits Feed"
                 % (os.path.basename(os.path.abspath(self.repos_path))))
         self.feed_desc = "The latest Subversion commits"
+        self.store = ItemStore(self.feed_file + ".items", max_items)
+        if not self.store.exists():
+            # Carry over the items of a feed generated by an older
+            # version of this script.
+            for item in self._load_pickled_items():
+                self.store.add(item)
+
+    def add_revision_item(self, revision):
+        self.add_revision_items([revision])
+
+    def add_revision_items(self, revisions):
+        if self.bindings:
+            items = self._get_item_dicts(revisions)
+        else:
+            items = [self._get_item_dict(revision) for revision in revisions]
+        for item in items:
+            self.store.add(item)
+
+    def write_output(self):
+        """Write the feed file, if the items have changed or it doesn't
+        exist yet."""
+        if self.store.save() or not os.path.exists(self.feed_file):
+            write_atomically(self.feed_file, self._write_feed)
+
+    def _load_pickled_items(self):
+        return []
 
     def _get_item_dict(self, revision):
         revision = str(revision)
 
         cmd = [self.svnlook_cmd, 'info', '-r', revision, self.repos_path]
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        proc.wait()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                universal_newlines=True)
         info_lines = proc.stdout.readlines()
+        proc.wait()
 
         cmd = [self.svnlook_cmd, 'changed', '-r', revision, self.repos_path]
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        proc.wait()
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                universal_newlines=True)
         changed_data = proc.stdout.readlines()
+        proc.wait()
 
+        return self._make_item_dict(revision, info_lines[0].strip('\n'),
+                                    self._format_updated_ts(info_lines[1]),
+                                    info_lines[3], changed_data)
+
+    def _get_item_dicts(self, revisions):
+        """Return the item dicts for REVISIONS, reading them from the
+        repository in-process."""
+        core, fs, repos = import_bindings()
+        fs_ptr = repos.fs(repos.open(self.repos_path))
+        items = []
+        for revision in revisions:
+            props = fs.revision_proplist(fs_ptr, revision)
+            author = _to_str(props.get(core.SVN_PROP_REVISION_AUTHOR, b''))
+            date = _to_str(props.get(core.SVN_PROP_REVISION_DATE))
+            log = _to_str(props.get(core.SVN_PROP_REVISION_LOG, b''))
+
+            # the first line of the log message, as 'svnlook info' gives it
+            log_line = (log.splitlines() or [''])[0] + '\n'
+
+            # the changed paths, as 'svnlook changed' gives them
+            root = fs.revision_root(fs_ptr, revision)
+            base_root = None
+            changed_data = []
+            for path, change in sorted(fs.paths_changed2(root).items()):
+                if change.change_kind == fs.path_change_add:
+                    status = 'A '
+                elif change.change_kind == fs.path_change_delete:
+                    status = 'D '
+                elif change.change_kind == fs.path_change_replace:
+                    # a deletion of the old node followed by an addition
+                    # of the new one, as svnperms.py reports it
+                    if base_root is None:
+                        base_root = fs.revision_root(fs_ptr, revision - 1)
+                    deleted = _to_str(path).lstrip('/')
+                    if fs.check_path(base_root, path) == core.svn_node_dir:
+                        deleted += '/'
+                    changed_data.append('D   %s\n' % deleted)
+                    status = 'A '
+                else:
+                    status = ((change.text_mod and 'U' or '_')
+                              + (change.prop_mod and 'U' or ' '))
+                path = _to_str(path).lstrip('/')
+                if change.node_kind == core.svn_node_dir:
+                    path += '/'
+                changed_data.append('%s  %s\n' % (status, path))
+
+            # svn:date is UTC already: "2006-07-28T14:47:18.123456Z"
+            items.append(self._make_item_dict(str(revision), author,
+                                              date[:19] + 'Z',
+                                              log_line, changed_data))
+        return items
+
+    def _make_item_dict(self, revision, author, date, log_line, changed_data):
         desc = ("\nRevision: %s\nLog: %sModified: \n%s"
-                % (revision, info_lines[3], changed_data))
+                % (revision, log_line, changed_data))
 
         item_dict = {
-            'author': info_lines[0].strip('\n'),
+            'revision': int(revision),
+            'author': author,
             'title': "Revision %s" % revision,
             'link': self.item_url and "%s?rev=%s" % (self.item_url, revision),
-            'date': self._format_updated_ts(info_lines[1]),
+            'date': date,
             'description': "<pre>" + desc + "</pre>",
             }
 
@@ -174,9 +383,7 @@ class Svn2Feed:
 
 class Svn2RSS(Svn2Feed):
     def __init__(self, svn_path, repos_path, item_url, feed_file,
-                 max_items, feed_url):
-        Svn2Feed.__init__(self, svn_path, repos_path, item_url, feed_file,
-                          max_items, feed_url)
+                 max_items, feed_url, bindings=False):
         try:
             import PyRSS2Gen
         except ImportError:
@@ -189,42 +396,42 @@ module from:
 """)
             sys.exit(1)
         self.PyRSS2Gen = PyRSS2Gen
-
-        (file, ext) = os.path.splitext(self.feed_file)
-        self.pickle_file = file + ".pickle"
-        if os.path.exists(self.pickle_file):
-            self.rss = pickle.load(open(self.pickle_file, "r"))
-        else:
-            self.rss = self.PyRSS2Gen.RSS2(
-                    title = self.feed_title,
-                    link = self.feed_url,
-                    description = self.feed_desc,
-                    lastBuildDate = datetime.datetime.now(),
-                    items = [])
+        Svn2Feed.__init__(self, svn_path, repos_path, item_url, feed_file,
+                          max_items, feed_url, bindings)
 
     @staticmethod
     def get_default_file_extension():
         return ".rss"
 
-    def add_revision_item(self, revision):
-        rss_item = self._make_rss_item(revision)
-        self.rss.items.insert(0, rss_item)
-        if len(self.rss.items) > self.max_items:
-            del self.rss.items[self.max_items:]
-
-    def write_output(self):
-        s = pickle.dumps(self.rss)
-        f = open(self.pickle_file, "w")
-        f.write(s)
-        f.close()
-
-        f = open(self.feed_file, "w")
-        self.rss.write_xml(f)
-        f.close()
-
-    def _make_rss_item(self, revision):
-        info = self._get_item_dict(revision)
-
+    def _load_pickled_items(self):
+        (file, ext) = os.path.splitext(self.feed_file)
+        pickle_file = file + ".pickle"
+        if not os.path.exists(pickle_file):
+            return []
+        rss = pickle.load(open(pickle_file, "rb"))
+        items = []
+        for rss_item in rss.items:
+            items.append({
+                'revision': int(rss_item.title.split()[-1]),
+                'author': rss_item.author,
+                'title': rss_item.title,
+                'link': rss_item.link,
+                'date': rss_item.pubDate,
+                'description': rss_item.description,
+                })
+        return items
+
+    def _write_feed(self, f):
+        rss = self.PyRSS2Gen.RSS2(
+                title = self.feed_title,
+                link = self.feed_url,
+                description = self.feed_desc,
+                lastBuildDate = datetime.datetime.now(),
+                items = [self._make_rss_item(info)
+                         for info in self.store.newest_first()])
+        rss.write_xml(f)
+
+    def _make_rss_item(self, info):
         rss_item = self.PyRSS2Gen.RSSItem(
                 author = info['author'],
                 title = info['title'],
@@ -237,51 +444,46 @@ module from:
 
 class Svn2Atom(Svn2Feed):
     def __init__(self, svn_path, repos_path, item_url, feed_file,
-                 max_items, feed_url):
-        Svn2Feed.__init__(self, svn_path, repos_path, item_url, feed_file,
-                          max_items, feed_url)
+                 max_items, feed_url, bindings=False):
         from xml.dom import getDOMImplementation
         self.dom_impl = getDOMImplementation()
-
-        self.pickle_file = self.feed_file + ".pickle"
-        if os.path.exists(self.pickle_file):
-            self.document = pickle.load(open(self.pickle_file, "r"))
-            self.feed = self.document.getElementsByTagName('feed')[0]
-        else:
-            self._init_atom_document()
+        Svn2Feed.__init__(self, svn_path, repos_path, item_url, feed_file,
+                          max_items, feed_url, bindings)
 
     @staticmethod
     def get_default_file_extension():
         return ".atom"
 
-    def add_revision_item(self, revision):
-        item = self._make_atom_item(revision)
-
-        total = 0
-        for childNode in self.feed.childNodes:
-            if childNode.nodeName == 'entry':
-                if total == 0:
-                    self.feed.insertBefore(item, childNode)
-                    total += 1
-                total += 1
-                if total > self.max_items:
-                    self.feed.removeChild(childNode)
-        if total == 0:
-            self.feed.appendChild(item)
-
-    def write_output(self):
-        s = pickle.dumps(self.document)
-        f = open(self.pickle_file, "w")
-        f.write(s)
-        f.close()
-
-        f = open(self.feed_file, "w")
-        f.write(self.document.toxml())
-        f.close()
-
-    def _make_atom_item(self, revision):
-        info = self._get_item_dict(revision)
-
+    def _load_pickled_items(self):
+        pickle_file = self.feed_file + ".pickle"
+        if not os.path.exists(pickle_file):
+            return []
+        document = pickle.load(open(pickle_file, "rb"))
+        items = []
+        for entry in document.getElementsByTagName('entry'):
+            info = {}
+            for name in ('title', 'updated', 'summary', 'name'):
+                node = entry.getElementsByTagName(name)[0]
+                info[name] = ''.join([child.data
+                                      for child in node.childNodes])
+            items.append({
+                'revision': int(info['title'].split()[-1]),
+                'author': info['name'],
+                'title': info['title'],
+                'link': entry.getElementsByTagName('link')[0]
+                        .getAttribute('href'),
+                'date': info['updated'],
+                'description': info['summary'],
+                })
+        return items
+
+    def _write_feed(self, f):
+        self._init_atom_document()
+        for info in self.store.newest_first():
+            self.feed.appendChild(self._make_atom_item(info))
+        f.write(self.document.toxml("utf-8"))
+
+    def _make_atom_item(self, info):
         doc = self.document
         entry = doc.createElement("entry")
 
@@ -353,8 +555,9 @@ class Svn2Atom(Svn2Feed):
 def main():
     # Parse the command-line options and arguments.
     try:
-        opts, args = getopt.gnu_getopt(sys.argv[1:], "hP:r:u:f:m:U:F:",
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hbP:r:u:f:m:U:F:",
                                        ["help",
+                                        "bindings",
                                         "svn-path=",
                                         "revision=",
                                         "item-url=",
@@ -377,11 +580,14 @@ def main():
     item_url = feed_url = None
     feed_file = None
     feedcls = None
+    bindings = False
     feed_classes = { 'rss': Svn2RSS, 'atom': Svn2Atom }
 
     for opt, arg in opts:
         if opt in ("-h", "--help"):
             usage_and_exit()
+        elif opt in ("-b", "--bindings"):
+            bindings = True
         elif opt in ("-P", "--svn-path"):
             svn_path = arg
         elif opt in ("-r", "--revision"):
@@ -417,7 +623,14 @@ def main():
     if feed_url is None:
         usage_and_exit("Option -U [--feed-url] is required.")
 
-    if commit_rev is None:
+    if commit_rev is None and bindings:
+        core, fs, repos = import_bindings()
+        try:
+            revisions = [fs.youngest_rev(repos.fs(repos.open(repos_path)))]
+        except core.SubversionException:
+            usage_and_exit("svn2feed.py: Invalid value '%s' for " \
+                           "REPOS-PATH" % (repos_path))
+    elif commit_rev is None:
         svnlook_cmd = 'svnlook'
         if svn_path is not None:
             svnlook_cmd = os.path.join(svn_path, 'svnlook')
@@ -456,9 +669,8 @@ def main():
                      feedcls.get_default_file_extension())
 
     feed = feedcls(svn_path, repos_path, item_url, feed_file, max_items,
-                   feed_url)
-    for revision in revisions:
-        feed.add_revision_item(revision)
+                   feed_url, bindings)
+    feed.add_revision_items(revisions)
     feed.write_output()
 
 
@@ -123,10 +123,32 @@ class Config:
         return ret
 
 
+LITERAL = re.compile(r"[^.^$*+?{}\[\]\\|()]*")
+ESCAPE_OR_CLASS = re.compile(r"\\.|\[\^?\]?[^]]*\]")
+GROUP = re.compile(r"\([^()]*\)")
+
+def literal_prefix(pattern):
+    """Return the literal text every path matched by PATTERN starts with.
+    It may be empty."""
+    # Drop escapes, classes and groups, innermost first; a "|" left
+    # over is an alternative at the top level, which could match anything.
+    toplevel, count = ESCAPE_OR_CLASS.sub("", pattern), 1
+    while count:
+        toplevel, count = GROUP.subn("", toplevel)
+    if "|" in toplevel:
+        return ""
+    prefix = LITERAL.match(pattern).group()
+    if pattern[len(prefix):len(prefix)+1] in ("*", "?", "{"):
+        # The last literal character is optional.
+        prefix = prefix[:-1]
+    return prefix
+
 class Permission:
     def __init__(self):
         self._group = {}
         self._permlist = []
+        # user -> (prefix lengths, {prefix: [(index, pattern, perms), ...]})
+        self._rules = {}
 
     def parse_groups(self, groupsiter):
         for option, value in groupsiter:
@@ -149,6 +171,7 @@ class Permission:
             if option[0] == "/":
                 option = option[1:]
             pattern = re.compile("^%s$" % option)
+            prefix = literal_prefix(option)
             for entry in value.split():
                 openpar, closepar = entry.find("("), entry.find(")")
                 groupsusers = entry[:openpar].split(",")
@@ -163,14 +186,39 @@ class Permission:
                                          groupuser[1:])
                     else:
                         users.append(groupuser)
-                self._permlist.append((pattern, users, perms))
+                self._permlist.append((pattern, users, perms, prefix))
+        self._rules.clear()
+
+    def _user_rules(self, user):
+        """Return the rules which apply to USER, indexed by the literal
+        prefix every path they match must start with."""
+        try:
+            return self._rules[user]
+        except KeyError:
+            pass
+        index = {}
+        for i, (pattern, users, perms, prefix) in \
+                enumerate(self._permlist):
+            if user in users or "*" in users:
+                index.setdefault(prefix, []).append((i, pattern, perms))
+        lengths = sorted(set([len(prefix) for prefix in index]))
+        rules = self._rules[user] = (lengths, index)
+        return rules
 
     def get(self, user, path):
-        ret = []
-        for pattern, users, perms in self._permlist:
-            if pattern.match(path) and (user in users or "*" in users):
-                ret = perms
-        return ret
+        # The last matching entry wins, so try the candidates from the
+        # end of the file backwards.
+        lengths, index = self._user_rules(user)
+        candidates = []
+        for length in lengths:
+            if length > len(path):
+                break
+            candidates.extend(index.get(path[:length], ()))
+        candidates.sort(reverse=True)
+        for i, pattern, perms in candidates:
+            if pattern.match(path):
+                return perms
+        return []
 
 class SVNLook:
     def __init__(self, repospath, txn=None, rev=None):
@@ -237,12 +285,100 @@ class SVNLook:
             return None
         return output.strip()
 
+class SVNRepos:
+    """Like SVNLook, but reading the repository in-process through the
+    Subversion Python bindings rather than running svnlook."""
 
-def check_perms(filename, section, repos, txn=None, rev=None, author=None):
-    svnlook = SVNLook(repos, txn=txn, rev=rev)
-    if author is None:
-        author = svnlook.author()
-    changes = svnlook.changed()
+    def __init__(self, repospath, txn=None, rev=None):
+        try:
+            import svn.core, svn.fs, svn.repos
+        except ImportError:
+            raise Error("the Subversion Python bindings are not available")
+        self._core = svn.core
+        self._fs = svn.fs
+        self.repospath = repospath
+        self.txn = txn
+        self.rev = rev
+        self.fs_ptr = svn.repos.fs(svn.repos.open(self._bytes(repospath)))
+        if txn is not None:
+            self._txn = svn.fs.open_txn(self.fs_ptr, self._bytes(txn))
+            self.root = svn.fs.txn_root(self._txn)
+            self.base_rev = svn.fs.txn_base_revision(self._txn)
+        else:
+            self._txn = None
+            self.rev = int(rev)
+            self.root = svn.fs.revision_root(self.fs_ptr, self.rev)
+            self.base_rev = self.rev - 1
+
+    def _bytes(self, s):
+        if isinstance(s, bytes):
+            return s
+        return s.encode("utf-8")
+
+    def _str(self, b):
+        if b is None or isinstance(b, str):
+            return b
+        return b.decode("utf-8")
+
+    def changed(self, **kwargs):
+        """Return the changes as SVNLook.changed() does, as a list of
+        (changedata, changeprop, path) tuples."""
+        core, fs = self._core, self._fs
+        base_root = None
+        changes = []
+        for path, change in fs.paths_changed2(self.root).items():
+            kind = change.node_kind
+            if kind == core.svn_node_unknown:
+                # Older filesystems don't record the kind of a change.
+                if change.change_kind == fs.path_change_delete:
+                    if base_root is None:
+                        base_root = fs.revision_root(self.fs_ptr,
+                                                     self.base_rev)
+                    kind = fs.check_path(base_root, path)
+                else:
+                    kind = fs.check_path(self.root, path)
+            if change.change_kind == fs.path_change_replace:
+                # svnlook shows a replacement as a deletion of the old
+                # node followed by an addition of the new one.
+                if base_root is None:
+                    base_root = fs.revision_root(self.fs_ptr,
+                                                 self.base_rev)
+                deleted = self._str(path).lstrip("/")
+                if fs.check_path(base_root, path) == core.svn_node_dir:
+                    deleted += "/"
+                changes.append(("D", None, deleted))
+            path = self._str(path).lstrip("/")
+            if kind == core.svn_node_dir:
+                path += "/"
+            changedata, changeprop = None, None
+            if change.change_kind in (fs.path_change_add,
+                                      fs.path_change_replace):
+                changedata = "A"
+            elif change.change_kind == fs.path_change_delete:
+                changedata = "D"
+            else:
+                if change.text_mod:
+                    changedata = "U"
+                if change.prop_mod:
+                    changeprop = "U"
+                if changedata is None and changeprop is None:
+                    continue
+            changes.append((changedata, changeprop, path))
+        changes.sort(key=lambda change: change[2])
+        return changes
+
+    def author(self, **kwargs):
+        if self._txn is not None:
+            author = self._fs.txn_prop(self._txn,
+                                       self._core.SVN_PROP_REVISION_AUTHOR)
+        else:
+            author = self._fs.revision_prop(self.fs_ptr, self.rev,
+                                            self._core.SVN_PROP_REVISION_AUTHOR)
+        return self._str(author)
+
+
+def get_permission(filename, section):
+    """Return the Permission for SECTION of config file FILENAME."""
     try:
         config = Config(filename)
     except IOError:
@@ -253,6 +389,18 @@ def check_perms(filename, section, repos, txn=None, rev=None, author=None):
     perm.parse_groups(config.walk("groups"))
     perm.parse_groups(config.walk(section+" groups"))
     perm.parse_perms(config.walk(section))
+    return perm
+
+def check_perms(filename, section, repos, txn=None, rev=None, author=None,
+                bindings=False):
+    if bindings:
+        svnlook = SVNRepos(repos, txn=txn, rev=rev)
+    else:
+        svnlook = SVNLook(repos, txn=txn, rev=rev)
+    if author is None:
+        author = svnlook.author()
+    changes = svnlook.changed()
+    perm = get_permission(filename, section)
     permerrors = []
     for changedata, changeprop, path in changes:
         pathperms = perm.get(author, path)
@@ -287,6 +435,8 @@ Options:
                repository name, extracted from repository path)
     -R REV     Query revision REV for commit information (for tests)
     -A AUTHOR  Check commit as if AUTHOR had committed it (for tests)
+    -b         Read the repository through the Subversion Python bindings
+               instead of running svnlook
     -h         Show this message
 """
 
@@ -296,7 +446,7 @@ class MissingArgumentsException(Exception):
 
 def parse_options():
     try:
-        opts, args = my_getopt(sys.argv[1:], "f:s:r:t:R:A:h", ["help"])
+        opts, args = my_getopt(sys.argv[1:], "f:s:r:t:R:A:bh", ["help"])
     except getopt.GetoptError as e:
         raise Error(e.msg)
     class Options: pass
@@ -307,6 +457,7 @@ def parse_options():
     obj.transaction = None
     obj.revision = None
     obj.author = None
+    obj.bindings = False
     for opt, val in opts:
         if opt == "-f":
             obj.filename = val
@@ -320,6 +471,8 @@ def parse_options():
             obj.revision = val
         elif opt == "-A":
             obj.author = val
+        elif opt == "-b":
+            obj.bindings = True
         elif opt in ["-h", "--help"]:
             sys.stdout.write(USAGE)
             sys.exit(0)
@@ -349,7 +502,7 @@ def main():
         opts = parse_options()
         check_perms(opts.filename, opts.section,
                     opts.repository, opts.transaction, opts.revision,
-                    opts.author)
+                    opts.author, opts.bindings)
     except MissingArgumentsException as e:
         sys.stderr.write("%s\n" % str(e))
         sys.stderr.write(USAGE)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+#
+# test_svn2feed.py: unit tests for svn2feed.py's item store
+#
+# USAGE: ./test_svn2feed.py
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import svn2feed
+
+
+def item(revision):
+    return {'revision': revision, 'author': 'jrandom',
+            'title': 'Revision %d' % revision, 'link': None,
+            'date': '2013-04-15T20:41:00Z', 'description': '<pre></pre>'}
+
+
+class ItemStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'feed.rss.items')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def read_lines(self):
+        f = open(self.path, 'rb')
+        lines = f.readlines()
+        f.close()
+        return lines
+
+    def test_append(self):
+        store = svn2feed.ItemStore(self.path, 3)
+        for revision in (1, 2):
+            store.add(item(revision))
+        self.assertTrue(store.save())
+        self.assertFalse(store.save())
+        store = svn2feed.ItemStore(self.path, 3)
+        store.add(item(3))
+        store.save()
+        self.assertEqual(len(self.read_lines()), 3)
+        store = svn2feed.ItemStore(self.path, 3)
+        self.assertEqual(store.newest_first(), [item(3), item(2), item(1)])
+
+    def test_truncated_last_line(self):
+        store = svn2feed.ItemStore(self.path, 5)
+        for revision in (1, 2):
+            store.add(item(revision))
+        store.save()
+        # a crash while appending the third item
+        f = open(self.path, 'ab')
+        f.write(store._encode(item(3))[:20])
+        f.close()
+
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            store = svn2feed.ItemStore(self.path, 5)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual(store.newest_first(), [item(2), item(1)])
+        self.assertTrue(store.damaged)
+
+        # the next save rewrites the file without the damaged line
+        store.add(item(3))
+        store.save()
+        self.assertFalse(store.damaged)
+        self.assertEqual(len(self.read_lines()), 3)
+        store = svn2feed.ItemStore(self.path, 5)
+        self.assertFalse(store.damaged)
+        self.assertEqual(store.newest_first(), [item(3), item(2), item(1)])
+
+    def test_line_without_revision(self):
+        f = open(self.path, 'wb')
+        f.write(b'{"author": "jrandom"}\n[1, 2]\n')
+        f.write(svn2feed.ItemStore(self.path, 5)._encode(item(1)))
+        f.close()
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            store = svn2feed.ItemStore(self.path, 5)
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+        self.assertEqual(store.newest_first(), [item(1)])
+        self.assertTrue(store.damaged)
+
+
+class _Change:
+    def __init__(self, change_kind, node_kind, text_mod=False,
+                 prop_mod=False):
+        self.change_kind = change_kind
+        self.node_kind = node_kind
+        self.text_mod = text_mod
+        self.prop_mod = prop_mod
+
+class _Core:
+    svn_node_none, svn_node_file, svn_node_dir = range(3)
+    SVN_PROP_REVISION_AUTHOR = 'svn:author'
+    SVN_PROP_REVISION_DATE = 'svn:date'
+    SVN_PROP_REVISION_LOG = 'svn:log'
+
+class _FS:
+    "Stands in for svn.fs, over the changes and base tree of revision 2."
+    path_change_modify, path_change_add, path_change_delete, \
+        path_change_replace = range(4)
+
+    def __init__(self, changes, base):
+        self.changes = changes
+        self.base = base
+
+    def revision_proplist(self, fs_ptr, revision):
+        return {'svn:author': b'jrandom',
+                'svn:date': b'2013-04-15T20:41:00.123456Z',
+                'svn:log': b'Replace things.\n\nMore.'}
+
+    def revision_root(self, fs_ptr, revision):
+        return revision
+
+    def paths_changed2(self, root):
+        assert root == 2
+        return self.changes
+
+    def check_path(self, root, path):
+        assert root == 1
+        return self.base.get(path, _Core.svn_node_none)
+
+class _Repos:
+    def open(self, path):
+        return path
+
+    def fs(self, repos):
+        return None
+
+
+class BindingsTests(unittest.TestCase):
+
+    def test_replace(self):
+        fs = _FS({b'/trunk/a.c': _Change(_FS.path_change_replace,
+                                         _Core.svn_node_file),
+                  b'/trunk/b': _Change(_FS.path_change_replace,
+                                       _Core.svn_node_file),
+                  b'/trunk/c.c': _Change(_FS.path_change_modify,
+                                         _Core.svn_node_file, True)},
+                 {b'/trunk/a.c': _Core.svn_node_file,
+                  b'/trunk/b': _Core.svn_node_dir})
+        # Skip Svn2Feed.__init__, which sets up the item store.
+        class Feed(svn2feed.Svn2Feed):
+            def __init__(self):
+                pass
+        feed = Feed()
+        feed.repos_path = '/repos'
+        feed.item_url = None
+        import_bindings = svn2feed.import_bindings
+        svn2feed.import_bindings = lambda: (_Core, fs, _Repos())
+        try:
+            items = feed._get_item_dicts([2])
+        finally:
+            svn2feed.import_bindings = import_bindings
+        self.assertEqual(items[0]['date'], '2013-04-15T20:41:00Z')
+        desc = items[0]['description']
+        positions = [desc.find(line) for line in ('D   trunk/a.c',
+                                                  'A   trunk/a.c',
+                                                  'D   trunk/b/',
+                                                  'A   trunk/b',
+                                                  'U   trunk/c.c')]
+        self.assertEqual(sorted(positions), positions, desc)
+        self.assertFalse(-1 in positions, desc)
+        self.assertFalse('R ' in desc, desc)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+#
+#
+# Licensed to the Apache Software Foundation (ASF) under one
+# or more contributor license agreements.  See the NOTICE file
+# distributed with this work for additional information
+# regarding copyright ownership.  The ASF licenses this file
+# to you under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance
+# with the License.  You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied.  See the License for the
+# specific language governing permissions and limitations
+# under the License.
+#
+#
+#
+# test_svnperms.py: unit tests for the parts of svnperms.py that can be
+#                   tested without a repository
+#
+# USAGE: ./test_svnperms.py
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import svnperms
+
+CONFIG = """\
+[groups]
+dev = alice bob
+
+[proj]
+.* = @dev(add,remove,update)
+trunk/.* = *(add,update)
+trunk/doc/.* = carol(add,remove,update)
+tags/[^/]+/ = @dev(add)
+tags/.+/.+ = alice()
+branches/(alice|bob)-.* = @dev(add,remove,update)
+(trunk|branches/[^/]+)/README = bob()
+x?y/.* = carol(update)
+"""
+
+
+class LiteralPrefixTests(unittest.TestCase):
+
+    def test_literal_prefix(self):
+        for pattern, prefix in (("trunk/.*", "trunk/"),
+                                ("trunk/doc/.*", "trunk/doc/"),
+                                ("tags/[^/]+/", "tags/"),
+                                ("branches/(a|b)-.*", "branches/"),
+                                ("(trunk|tags)/.*", ""),
+                                ("a|b", ""),
+                                ("a[|]b", "a"),
+                                ("a\\|b", "a"),
+                                ("a((b|c)d)|e", ""),
+                                (".*", ""),
+                                ("xy?z", "x"),
+                                ("ab*", "a"),
+                                ("ab{2}", "a"),
+                                ("ab+", "ab"),
+                                ("a\\.b", "a"),
+                                ("README", "README")):
+            self.assertEqual(svnperms.literal_prefix(pattern), prefix,
+                             pattern)
+
+
+class PermissionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, "svnperms.conf")
+        fp = open(self.filename, "w")
+        fp.write(CONFIG)
+        fp.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def linear_get(self, perm, user, path):
+        "The lookup Permission.get did before rules were indexed."
+        ret = []
+        for pattern, users, perms, prefix in perm._permlist:
+            if pattern.match(path) and (user in users or "*" in users):
+                ret = perms
+        return ret
+
+    def test_prefix_index(self):
+        perm = svnperms.get_permission(self.filename, "proj")
+        for user in ("alice", "bob", "carol", "dave"):
+            for path in ("trunk/", "trunk/a.c", "trunk/doc/x", "trunk/README",
+                         "tags/1.0/", "tags/1.0/a.c", "tags/", "branches/",
+                         "branches/alice-x/a", "branches/carol-x/README",
+                         "xy/a", "y/a", "other/a", "t"):
+                self.assertEqual(perm.get(user, path),
+                                 self.linear_get(perm, user, path),
+                                 (user, path))
+
+    def test_config_is_read_each_time(self):
+        perm = svnperms.get_permission(self.filename, "proj")
+        self.assertEqual(perm.get("dave", "trunk/a"), ["add", "update"])
+        # Rewriting the file within the same second, with the same size,
+        # must still take effect.
+        fp = open(self.filename, "w")
+        fp.write(CONFIG.replace("*(add,update)", "*(add,remove)"))
+        fp.close()
+        perm = svnperms.get_permission(self.filename, "proj")
+        self.assertEqual(perm.get("dave", "trunk/a"), ["add", "remove"])
+        self.assertRaises(svnperms.Error, svnperms.get_permission,
+                          self.filename, "nosuchsection")
+
+
+class _Change:
+    def __init__(self, change_kind, node_kind, text_mod=False,
+                 prop_mod=False):
+        self.change_kind = change_kind
+        self.node_kind = node_kind
+        self.text_mod = text_mod
+        self.prop_mod = prop_mod
+
+class _Core:
+    svn_node_none, svn_node_file, svn_node_dir, svn_node_unknown = range(4)
+
+class _FS:
+    "Stands in for svn.fs, over a dict of paths changed and the base tree."
+    path_change_modify, path_change_add, path_change_delete, \
+        path_change_replace = range(4)
+
+    def __init__(self, changes, base):
+        self.changes = changes
+        self.base = base
+
+    def paths_changed2(self, root):
+        return self.changes
+
+    def revision_root(self, fs_ptr, rev):
+        return "base"
+
+    def check_path(self, root, path):
+        assert root == "base"
+        return self.base.get(path, _Core.svn_node_none)
+
+
+class BackendTests(unittest.TestCase):
+
+    def test_equivalence(self):
+        fs = _FS
+        core = _Core
+        changes = {
+            b"/trunk/added.c": _Change(fs.path_change_add, core.svn_node_file),
+            b"/trunk/newdir": _Change(fs.path_change_add, core.svn_node_dir),
+            b"/trunk/gone": _Change(fs.path_change_delete, core.svn_node_dir),
+            b"/trunk/text.c": _Change(fs.path_change_modify,
+                                      core.svn_node_file, text_mod=True),
+            b"/trunk/props.c": _Change(fs.path_change_modify,
+                                       core.svn_node_file, prop_mod=True),
+            b"/trunk/both.c": _Change(fs.path_change_modify,
+                                      core.svn_node_file, True, True),
+            b"/trunk/touched.c": _Change(fs.path_change_modify,
+                                         core.svn_node_file),
+            b"/trunk/replaced.c": _Change(fs.path_change_replace,
+                                          core.svn_node_file, True),
+            b"/trunk/was_dir": _Change(fs.path_change_replace,
+                                       core.svn_node_file),
+            }
+        base = {b"/trunk/gone": core.svn_node_dir,
+                b"/trunk/replaced.c": core.svn_node_file,
+                b"/trunk/was_dir": core.svn_node_dir}
+        # Skip SVNRepos.__init__, which needs the real bindings.
+        class Repos(svnperms.SVNRepos):
+            def __init__(self):
+                pass
+        repos = Repos()
+        repos._core, repos._fs = core, fs(changes, base)
+        repos.fs_ptr, repos.root, repos.base_rev = None, "txn", 1
+
+        # What 'svnlook changed' prints for the same transaction.
+        output = "\n".join(["A   trunk/added.c",
+                            "A   trunk/newdir/",
+                            "D   trunk/gone/",
+                            "U   trunk/text.c",
+                            "_U  trunk/props.c",
+                            "UU  trunk/both.c",
+                            "D   trunk/replaced.c",
+                            "A   trunk/replaced.c",
+                            "D   trunk/was_dir/",
+                            "A   trunk/was_dir"])
+        look = svnperms.SVNLook("/repos", txn="1-1")
+        look._execsvnlook = lambda cmd, **kwargs: (0, output)
+
+        self.assertEqual(sorted(repos.changed(), key=str),
+                         sorted(look.changed(), key=str))
+
+
+if __name__ == "__main__":
+    unittest.main()
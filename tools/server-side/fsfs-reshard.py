@@ -17,7 +17,8 @@
 #
 # In the event that the conversion is interrupted, the repository will be in
 # an inconsistent state.  The repository administrator should then re-run
-# this tool to completion.
+# this tool, with the same arguments, to completion; it resumes from the
+# steps recorded in db/reshard-journal.
 #
 #
 # Note that, currently, resharding from one sharded layout to another is
@@ -51,13 +52,13 @@
 # $LastChangedBy$
 # $LastChangedRevision$
 
-import os, stat, sys
+import os, stat, sys, getopt
 
 from errno import EEXIST
 
 def usage():
   """Print a usage message and exit."""
-  print("""usage: %s REPOS_PATH MAX_FILES_PER_SHARD [START END]
+  print("""usage: %s [-j JOBS] REPOS_PATH MAX_FILES_PER_SHARD [START END]
 
 Perform an offline conversion of an FSFS repository between linear
 (readable by Subversion 1.4 or later) and sharded (readable by
@@ -70,6 +71,10 @@ specify a linear layout.  Subversion 1.5 uses a default value of
 
 Convert revisions START through END inclusive if specified, or all
 revisions if unspecified.
+
+Files are moved by JOBS threads (default 4).  If the conversion is
+interrupted, re-running the same command resumes it from the steps
+recorded in db/reshard-journal.
 """ % sys.argv[0])
   sys.exit(1)
 
@@ -231,17 +236,49 @@ def write_fs_format(repos_path, contents):
   """Write a new filesystem format file for repository REPOS_PATH containing
   CONTENTS."""
   format_path = os.path.join(repos_path, 'db', 'format')
-  f = open(format_path, 'wb')
+  f = open(format_path, 'w')
   f.write(contents)
   f.close()
   os.chmod(format_path, stat.S_IRUSR | stat.S_IRGRP)
 
-def linearise(path):
+def run_in_pool(function, items, jobs):
+  """Call FUNCTION on each of ITEMS, in a pool of JOBS threads, and return
+  an iterator over the results in the order they complete."""
+  if jobs <= 1:
+    for item in items:
+      yield function(item)
+    return
+  from multiprocessing.pool import ThreadPool
+  pool = ThreadPool(jobs)
+  try:
+    for result in pool.imap_unordered(function, items):
+      yield result
+    pool.close()
+  finally:
+    pool.terminate()
+    pool.join()
+
+def move_files(moves):
+  """Rename each (FROM_PATH, TO_PATH) pair in MOVES.  A move already made
+  by an interrupted run (FROM_PATH gone and TO_PATH present) is skipped.
+  Return the number of files moved."""
+  moved = 0
+  for from_path, to_path in moves:
+    try:
+      os.rename(from_path, to_path)
+      moved += 1
+    except OSError:
+      if os.path.exists(from_path) or not os.path.exists(to_path):
+        raise
+  return moved
+
+def linearise(path, jobs=1):
   """Move all the files in subdirectories of PATH into PATH, and remove the
   subdirectories.  Handle conflicts between subdirectory names and files
   contained in subdirectories by ensuring subdirectories have a '.shard'
   suffix prior to moving (the files are assumed not to have this suffix.
-  Abort if a subdirectory is found to contain another subdirectory."""
+  Abort if a subdirectory is found to contain another subdirectory.
+  The subdirectories are emptied by a pool of JOBS threads."""
   # First enumerate all subdirectories of DIR and rename where necessary
   # to include a .shard suffix.
   for name in os.listdir(path):
@@ -252,50 +289,146 @@ def linearise(path):
       continue
     os.rename(subdir_path, subdir_path + '.shard')
 
-  # Now move all the subdirectory contents into the parent and remove
-  # the subdirectories.
-  for root_path, dirnames, filenames in os.walk(path):
-    if root_path == path:
+  # Now plan the moves of all the subdirectory contents into the parent.
+  plan = []
+  for name in sorted(os.listdir(path)):
+    root_path = os.path.join(path, name)
+    if not name.endswith('.shard') or not os.path.isdir(root_path):
       continue
-    if len(dirnames) > 0:
-      sys.stderr.write("error: directory '%s' contains other unexpected directories.\n" \
-        % root_path)
-      sys.stderr.flush()
-      sys.exit(1)
-    for name in filenames:
-      from_path = os.path.join(root_path, name)
-      to_path = os.path.join(path, name)
-      os.rename(from_path, to_path)
+    moves = []
+    for entry in os.listdir(root_path):
+      from_path = os.path.join(root_path, entry)
+      if os.path.isdir(from_path):
+        sys.stderr.write("error: directory '%s' contains other unexpected directories.\n" \
+          % root_path)
+        sys.stderr.flush()
+        sys.exit(1)
+      moves.append((from_path, os.path.join(path, entry)))
+    plan.append((root_path, moves))
+
+  # Then move them, and remove the subdirectories.
+  def linearise_shard(shard):
+    root_path, moves = shard
+    move_files(moves)
     os.rmdir(root_path)
+  for result in run_in_pool(linearise_shard, plan, jobs):
+    pass
 
-def shard(path, max_files_per_shard, start, end):
+def plan_shards(path, max_files_per_shard, start, end):
+  """Return a list of (SHARD_NAME, REVS) pairs giving the revisions START to
+  END inclusive that go into each shard of MAX_FILES_PER_SHARD files, in
+  order.  SHARD_NAME carries the temporary '.shard' suffix."""
+  plan = []
+  for rev in range(start, end + 1):
+    shard_name = str(rev // max_files_per_shard) + '.shard'
+    if not plan or plan[-1][0] != shard_name:
+      plan.append((shard_name, []))
+    plan[-1][1].append(str(rev))
+  return plan
+
+def read_journal(journal_path):
+  """Return the list of steps recorded as complete in the journal
+  JOURNAL_PATH, which need not exist."""
+  try:
+    journal = open(journal_path)
+  except IOError:
+    return []
+  done = []
+  for line in journal:
+    # Ignore a partly written last line.
+    if line.endswith('\n'):
+      done.append(line.rstrip('\n'))
+  journal.close()
+  return done
+
+class Journal:
+  """The steps of a conversion completed so far, one per line of the file
+  JOURNAL_PATH, so that an interrupted conversion can be resumed.  The
+  first line describes the conversion itself."""
+
+  def __init__(self, journal_path):
+    self.path = journal_path
+    lines = read_journal(journal_path)
+    self.first = lines and lines[0] or None
+    self.done = set(lines)
+    self._file = None
+
+  def __contains__(self, step):
+    return step in self.done
+
+  def record(self, step):
+    """Record STEP as complete, making sure it is on disk."""
+    if self._file is None:
+      self._file = open(self.path, 'a')
+    self._file.write(step + '\n')
+    self._file.flush()
+    os.fsync(self._file.fileno())
+    if self.first is None:
+      self.first = step
+    self.done.add(step)
+
+  def remove(self):
+    """Remove the journal, once the conversion is complete."""
+    if self._file is not None:
+      self._file.close()
+      self._file = None
+    if os.path.exists(self.path):
+      os.remove(self.path)
+
+def shard(path, max_files_per_shard, start, end, jobs=1, journal=None):
   """Move the files for revisions START to END inclusive in PATH into
   subdirectories of PATH named such that subdirectory '0' contains at most
   MAX_FILES_PER_SHARD files, those named [0, MAX_FILES_PER_SHARD).  Abort if
-  PATH is found to contain any entries with non-numeric names."""
+  PATH is found to contain any entries with non-numeric names.
+
+  The files are moved into the shards by a pool of JOBS threads, one shard
+  at a time per thread.  Shards are recorded in JOURNAL, if given, as they
+  are completed.  A shard which is recorded there, or which is already in
+  place in PATH, is skipped, so an interrupted run can be resumed by
+  running this again with the same arguments."""
 
   tmp = path + '.reshard'
+  prefix = os.path.basename(path) + ' '
   try:
     os.mkdir(tmp)
   except OSError as e:
     if e.errno != EEXIST:
       raise
 
-  # Move all entries into shards named N.shard.
-  for rev in range(start, end + 1):
-    name = str(rev)
-    shard = rev // max_files_per_shard
-    shard_name = str(shard) + '.shard'
-
-    from_path = os.path.join(path, name)
-    to_path = os.path.join(tmp, shard_name, name)
+  # Work out where every file goes, and create all the shard directories
+  # up front.
+  plan = []
+  for shard_name, revs in plan_shards(path, max_files_per_shard, start, end):
+    if journal is not None and prefix + shard_name in journal:
+      continue
+    if os.path.isdir(os.path.join(path, shard_name[:-6])):
+      # Moved into place by an earlier run.  (Revision files are never
+      # directories, so this can't be one of the linear layout.)
+      continue
+    shard_path = os.path.join(tmp, shard_name)
     try:
-      os.rename(from_path, to_path)
-    except OSError:
-      # The most likely explanation is that the shard directory doesn't
-      # exist.  Let's create it and retry the rename.
-      os.mkdir(os.path.join(tmp, shard_name))
-      os.rename(from_path, to_path)
+      os.mkdir(shard_path)
+    except OSError as e:
+      if e.errno != EEXIST:
+        raise
+    plan.append((shard_name,
+                 [(os.path.join(path, name), os.path.join(shard_path, name))
+                  for name in revs]))
+
+  # Move all entries into shards named N.shard, journalling each shard
+  # once all its files are in place.
+  def move_shard(shard):
+    shard_name, moves = shard
+    move_files(moves)
+    return shard_name
+  total = len(plan)
+  count = 0
+  for shard_name in run_in_pool(move_shard, plan, jobs):
+    if journal is not None:
+      journal.record(prefix + shard_name)
+    count += 1
+    if count % 100 == 0:
+      print('  %d of %d shards done' % (count, total))
 
   # Now rename all the shards to remove the suffix.
   skipped = 0
@@ -309,17 +442,29 @@ def shard(path, max_files_per_shard, start, end):
     from_path = os.path.join(tmp, name)
     to_path = os.path.join(path, os.path.basename(from_path)[:-6])
     os.rename(from_path, to_path)
-  skipped == 0 and os.rmdir(tmp)
+  if skipped == 0:
+    os.rmdir(tmp)
 
 def main():
-  if len(sys.argv) < 3:
+  try:
+    opts, args = getopt.getopt(sys.argv[1:], 'j:')
+  except getopt.GetoptError:
+    usage()
+  jobs = 4
+  for opt, value in opts:
+    if opt == '-j':
+      try:
+        jobs = int(value)
+      except ValueError:
+        usage()
+  if len(args) < 2:
     usage()
 
-  repos_path = sys.argv[1]
-  max_files_per_shard = sys.argv[2]
+  repos_path = args[0]
+  max_files_per_shard = args[1]
   try:
-    start = int(sys.argv[3])
-    end = int(sys.argv[4])
+    start = int(args[2])
+    end = int(args[3])
   except IndexError:
     start = 0
     end = int(current_file(repos_path)[0])
@@ -351,6 +496,20 @@ def main():
   check_repos_format(repos_path)
   sharded = check_fs_format(repos_path)
 
+  # Pick up where an interrupted conversion left off.  Its format file
+  # is gone, so the layout it started from comes from the journal.
+  journal = Journal(os.path.join(db_path, 'reshard-journal'))
+  arguments = '%d %d %d' % (max_files_per_shard, start, end)
+  if journal.first is not None:
+    was_sharded, old_arguments = journal.first.split(' ', 2)[1:]
+    if old_arguments != arguments:
+      sys.stderr.write("error: an interrupted conversion of '%s' must be resumed with the same arguments (%s).\n" \
+        % (repos_path, old_arguments))
+      sys.stderr.flush()
+      sys.exit(1)
+    sharded = was_sharded == '1'
+    print("Resuming the interrupted conversion of '%s'" % repos_path)
+
   # Let the user know what's going on.
   if max_files_per_shard > 0:
     print("Converting '%s' to a sharded structure with %d files per directory" \
@@ -363,33 +522,40 @@ def main():
   # Prevent access to the repository for the duration of the conversion.
   # There's no clean way to do this, but since the format of the repository
   # is indeterminate, let's remove the format file while we're converting.
+  if journal.first is None:
+    journal.record('convert %d %s' % (sharded, arguments))
   print('- marking the repository as invalid')
   remove_fs_format(repos_path)
 
   # First, convert to a linear scheme (this makes recovery easier because
   # it's easier to reason about the behaviour on restart).
   if sharded:
-    print('- linearising db/revs')
-    linearise(os.path.join(repos_path, 'db', 'revs'))
-    print('- linearising db/revprops')
-    linearise(os.path.join(repos_path, 'db', 'revprops'))
+    for name in ('revs', 'revprops'):
+      if 'linearise ' + name in journal:
+        continue
+      print('- linearising db/%s' % name)
+      linearise(os.path.join(db_path, name), jobs)
+      journal.record('linearise ' + name)
 
   if max_files_per_shard == 0:
     # We're done.  Stamp the filesystem with a format 2 db/format file.
     print('- marking the repository as a valid linear repository')
     write_fs_format(repos_path, '2\n')
   else:
-    print('- sharding db/revs')
-    shard(os.path.join(repos_path, 'db', 'revs'), max_files_per_shard,
-          start, end)
-    print('- sharding db/revprops')
-    shard(os.path.join(repos_path, 'db', 'revprops'), max_files_per_shard,
-          start, end)
+    for name in ('revs', 'revprops'):
+      if 'shard ' + name in journal:
+        continue
+      print('- sharding db/%s' % name)
+      shard(os.path.join(db_path, name), max_files_per_shard,
+            start, end, jobs, journal)
+      journal.record('shard ' + name)
 
     # We're done.  Stamp the filesystem with a format 3 db/format file.
     print('- marking the repository as a valid sharded repository')
     write_fs_format(repos_path, '3\nlayout sharded %d\n' % max_files_per_shard)
 
+  # Only now is there nothing left to resume.
+  journal.remove()
   print('- done.')
   sys.exit(0)
 
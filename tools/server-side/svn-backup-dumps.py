@@ -143,6 +143,38 @@
 #    repository name (basename of the repository path).
 #
 #
+# 9. Create several incremental dumps at once.
+#
+#    svn-backup-dumps.py -j <jobs> -c <count> ...
+#
+#    <jobs>       Number of dumps to run at the same time.
+#    ...          More options, see 2, 5-8.
+#
+#    The dumps missing from <dumpdir> are created by <jobs> concurrent
+#    'svnadmin dump' processes, each compressed as it is read.  With
+#    --gzip-path or --bzip2-path a multithreaded compressor such as
+#    pigz or pbzip2 may be used.
+#
+#
+# Every dump file created is recorded in '<dumpdir>/<reposname>.manifest'
+# (a JSON file) with its revision range, compression, size, modification
+# time, SHA-256 checksum, the time it took and whether it has been
+# transferred, so that the dump files can be checked without
+# decompressing them.
+#
+# With -c, a dump file is only skipped if it is in the manifest and is
+# still in <dumpdir> with the recorded size and modification time, or
+# with --verify, the recorded size and checksum.  A file which doesn't
+# match, or which is not in the manifest, is an error which stops the
+# backup; -O dumps it again.
+#
+# The manifest also holds the revision ranges covered by the dumps,
+# which -i continues from; revisions missing from the ranges are
+# reported as gaps.  The dump directory is only scanned to create the
+# manifest when there is none.  Dumps which could not be transferred are
+# transferred again on the next run.
+#
+#
 #
 # TODO:
 #  - find out how to report smbclient errors
@@ -159,9 +191,20 @@ if os.name != "nt":
 import gzip
 import os.path
 import re
+import time
+import json
+import bisect
+import hashlib
+import threading
 from optparse import OptionParser
 from ftplib import FTP
 from subprocess import Popen, PIPE
+try:
+    # Python >=3.0
+    from queue import Queue
+except ImportError:
+    # Python <3.0
+    from Queue import Queue
 
 try:
     import bz2
@@ -169,9 +212,49 @@ try:
 except ImportError:
     have_bz2 = False
 
+# Dump output is read from svnadmin in chunks of this size, and up to
+# PIPE_QUEUE_CHUNKS chunks may wait to be compressed.
+PIPE_CHUNK_SIZE = 1024 * 1024
+PIPE_QUEUE_CHUNKS = 16
+
+# Names of dump files: <reposname>.<fromrev>[-<torev>].svndmp[.gz|.bz2]
+dump_filename_regex = re.compile(r"(.+)\.(\d+)(?:-(\d+))?\.svndmp(\.gz|\.bz2)?$")
+dump_compressions = { None: "none", ".gz": "gzip", ".bz2": "bzip2" }
+
+
+def add_range(ranges, fromrev, torev):
+    """Add the revisions FROMREV to TOREV to RANGES, a sorted list of
+    disjoint [FROMREV, TOREV] lists, merging adjacent ranges."""
+    i = bisect.bisect_left(ranges, [fromrev, torev])
+    ranges.insert(i, [fromrev, torev])
+    if i > 0:
+        i -= 1
+    while i + 1 < len(ranges):
+        if ranges[i + 1][0] <= ranges[i][1] + 1:
+            ranges[i][1] = max(ranges[i][1], ranges[i + 1][1])
+            del ranges[i + 1]
+        elif ranges[i + 1][0] > torev + 1:
+            break
+        else:
+            i += 1
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of the file at PATH."""
+    sha256 = hashlib.sha256()
+    ifd = open(path, "rb")
+    buf = ifd.read(PIPE_CHUNK_SIZE)
+    while len(buf) > 0:
+        sha256.update(buf)
+        buf = ifd.read(PIPE_CHUNK_SIZE)
+    ifd.close()
+    return sha256.hexdigest()
+
 
 class SvnBackupOutput:
 
+    compression = "none"
+
     def __init__(self, abspath, filename):
         self.__filename = filename
         self.__absfilename = os.path.join(abspath, filename)
@@ -209,6 +292,8 @@ class SvnBackupOutputPlain(SvnBackupOutput):
 
 class SvnBackupOutputGzip(SvnBackupOutput):
 
+    compression = "gzip"
+
     def __init__(self, abspath, filename):
         SvnBackupOutput.__init__(self, abspath, filename + ".gz")
 
@@ -226,6 +311,8 @@ class SvnBackupOutputGzip(SvnBackupOutput):
 
 class SvnBackupOutputBzip2(SvnBackupOutput):
 
+    compression = "bzip2"
+
     def __init__(self, abspath, filename):
         SvnBackupOutput.__init__(self, abspath, filename + ".bz2")
 
@@ -243,17 +330,19 @@ class SvnBackupOutputBzip2(SvnBackupOutput):
 class SvnBackupOutputCommand(SvnBackupOutput):
 
     def __init__(self, abspath, filename, file_extension, cmd_path,
-                 cmd_options):
+                 cmd_options, compression):
         SvnBackupOutput.__init__(self, abspath, filename + file_extension)
         self.__cmd_path    = cmd_path
         self.__cmd_options = cmd_options
+        self.compression   = compression
 
     def open(self):
         cmd = [ self.__cmd_path, self.__cmd_options ]
 
         self.__ofd = open(self.get_absfilename(), "wb")
         try:
-            proc = Popen(cmd, stdin=PIPE, stdout=self.__ofd, shell=False)
+            proc = Popen(cmd, stdin=PIPE, stdout=self.__ofd, shell=False,
+                         bufsize=PIPE_CHUNK_SIZE)
         except:
             print((256, "", "Popen failed (%s ...):\n  %s" % (cmd[0],
                   str(sys.exc_info()[1]))))
@@ -320,6 +409,16 @@ class SvnBackup:
         self.__quiet = options.quiet
         self.__deltas = options.deltas
         self.__relative_incremental = options.relative_incremental
+        self.__verify = options.verify
+        self.__jobs = options.jobs
+        if self.__jobs < 1:
+            raise SvnBackupException("the number of jobs must be at least 1.")
+
+        # manifest of the dump files created, see record_dump()
+        self.__manifest_path = os.path.join(self.__dumpdir,
+                                            self.__reposname + ".manifest")
+        self.__manifest_lock = threading.Lock()
+        self.__manifest = self.read_manifest()
 
         # svnadmin/svnlook path
         self.__svnadmin_path = "svnadmin"
@@ -423,6 +522,62 @@ class SvnBackup:
             print("")
         return (rc, bufout, buferr)
 
+    def exec_cmd_pipe(self, cmd, output):
+        """Run CMD, writing its standard output to OUTPUT.  The output is
+        read in large chunks by a separate thread, so that writing (and
+        compressing) it overlaps with the command producing it."""
+        sys.stdout.flush()
+        if os.name == "nt":
+            errout = None
+        else:
+            errout = sys.stdout
+        try:
+            proc = Popen(cmd, stdout=PIPE, stderr=errout, shell=False,
+                         bufsize=PIPE_CHUNK_SIZE)
+        except:
+            return (256, "", "Popen failed (%s ...):\n  %s" % (cmd[0],
+                    str(sys.exc_info()[1])))
+
+        # The chunks are followed by None, or by the exception which
+        # stopped the reader.
+        chunks = Queue(PIPE_QUEUE_CHUNKS)
+        def read_chunks():
+            error = None
+            try:
+                buf = proc.stdout.read(PIPE_CHUNK_SIZE)
+                while len(buf) > 0:
+                    chunks.put(buf)
+                    buf = proc.stdout.read(PIPE_CHUNK_SIZE)
+            except Exception as e:
+                error = e
+            chunks.put(error)
+        reader = threading.Thread(target=read_chunks)
+        reader.daemon = True
+        reader.start()
+
+        buf = b""
+        try:
+            buf = chunks.get()
+            while isinstance(buf, bytes):
+                output.write(buf)
+                buf = chunks.get()
+            if buf is not None:
+                raise buf
+        except:
+            # Stop the command, and let the reader finish.
+            proc.kill()
+            while isinstance(buf, bytes):
+                buf = chunks.get()
+            reader.join()
+            proc.stdout.close()
+            proc.wait()
+            raise
+        reader.join()
+        proc.stdout.close()
+        rc = proc.wait()
+        print("")
+        return (rc, b"", b"")
+
     def exec_cmd_nt(self, cmd, output=None, printerr=False):
         try:
             proc = Popen(cmd, stdout=PIPE, stderr=None, shell=False)
@@ -451,21 +606,149 @@ class SvnBackup:
             print(r[2])
         return -1
 
-    def get_last_dumped_rev(self):
-        filename_regex = re.compile("(.+)\.\d+-(\d+)\.svndmp.*")
-        # start with -1 so the next one will be rev 0
-        highest_rev = -1
-
+    def read_manifest(self):
+        if not os.path.exists(self.__manifest_path):
+            manifest = self.scan_dumpdir()
+            self.__manifest = manifest
+            self.write_manifest()
+            return manifest
+        ifd = open(self.__manifest_path, "r")
+        try:
+            manifest = json.load(ifd)
+        except ValueError as e:
+            ifd.close()
+            raise SvnBackupException("manifest '%s' is corrupt: %s" % \
+                    (self.__manifest_path, str(e)))
+        ifd.close()
+        if "ranges" not in manifest:
+            ranges = []
+            for filename in manifest["dumps"]:
+                m = dump_filename_regex.match(filename)
+                if m and m.group(3) is not None:
+                    add_range(ranges, int(m.group(2)), int(m.group(3)))
+            manifest["ranges"] = ranges
+        return manifest
+
+    def scan_dumpdir(self):
+        """Create a manifest of the dump files already in the dump
+        directory.  Their checksums are not computed."""
+        manifest = { "repository": self.__reposname, "dumps": {},
+                     "ranges": [] }
         for filename in os.listdir(self.__dumpdir):
-            m = filename_regex.match( filename )
-            if m and (m.group(1) == self.__reposname):
-                rev_end = int(m.group(2))
-
-                if rev_end > highest_rev:
-                    # determine the latest revision dumped
-                    highest_rev = rev_end
+            m = dump_filename_regex.match(filename)
+            if not m or m.group(1) != self.__reposname:
+                continue
+            fromrev = int(m.group(2))
+            torev = fromrev
+            if m.group(3) is not None:
+                torev = int(m.group(3))
+                add_range(manifest["ranges"], fromrev, torev)
+            manifest["dumps"][filename] = {
+                "from": fromrev,
+                "to": torev,
+                "compression": dump_compressions[m.group(4)],
+                "size": os.path.getsize(os.path.join(self.__dumpdir,
+                                                     filename)),
+                "mtime": int(os.path.getmtime(os.path.join(self.__dumpdir,
+                                                           filename))),
+                "sha256": None,
+                "transferred": None,
+            }
+        return manifest
+
+    def write_manifest(self):
+        tmppath = self.__manifest_path + ".tmp"
+        ofd = open(tmppath, "w")
+        json.dump(self.__manifest, ofd, indent=1, sort_keys=True,
+                  separators=(",", ": "))
+        ofd.write("\n")
+        ofd.flush()
+        os.fsync(ofd.fileno())
+        ofd.close()
+        if os.name == "nt" and os.path.exists(self.__manifest_path):
+            os.remove(self.__manifest_path)
+        os.rename(tmppath, self.__manifest_path)
+
+    def record_dump(self, output, fromrev, torev, seconds, transferred):
+        """Record the dump file written by OUTPUT, of revisions FROMREV to
+        TOREV (or just FROMREV if TOREV is None), in the manifest.
+        TRANSFERRED is None if no transfer was requested."""
+        absfilename = output.get_absfilename()
+        # single revision dumps (-r) don't count for -c and -i
+        single = torev is None
+        if single:
+            torev = fromrev
+        entry = {
+            "from": fromrev,
+            "to": torev,
+            "compression": output.compression,
+            "size": os.path.getsize(absfilename),
+            "mtime": int(os.path.getmtime(absfilename)),
+            "sha256": file_sha256(absfilename),
+            "seconds": round(seconds, 3),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "transferred": transferred,
+        }
+        self.__manifest_lock.acquire()
+        try:
+            self.__manifest["dumps"][output.get_filename()] = entry
+            if not single:
+                add_range(self.__manifest["ranges"], fromrev, torev)
+            self.write_manifest()
+        finally:
+            self.__manifest_lock.release()
+
+    def is_dumped(self, filename):
+        """Return True if the dump file FILENAME is in the manifest, and
+        is still in the dump directory with the recorded size and
+        modification time, or with --verify, the recorded size and
+        checksum.  Return False if it is not in the dump directory.
+        Other dumps covering its revisions don't count.  Raise
+        SvnBackupException if the file is there but doesn't match, so
+        the backup stops rather than skipping it."""
+        entry = self.__manifest["dumps"].get(filename)
+        absfilename = os.path.join(self.__dumpdir, filename)
+        if not os.path.exists(absfilename):
+            return False
+        if entry is None:
+            raise SvnBackupException("%s is not in the manifest, " \
+                                     "use -O to dump it again." % absfilename)
+        if os.path.getsize(absfilename) != entry["size"]:
+            matches = False
+        elif self.__verify:
+            matches = entry["sha256"] is None or \
+                      file_sha256(absfilename) == entry["sha256"]
+        else:
+            # to the second, which is all some file systems keep
+            matches = entry.get("mtime") is None or \
+                      int(os.path.getmtime(absfilename)) == entry["mtime"]
+        if not matches:
+            raise SvnBackupException("%s doesn't match the manifest, " \
+                                     "use -O to dump it again." % absfilename)
+        return True
 
-        return highest_rev
+    def get_last_dumped_rev(self):
+        ranges = self.__manifest["ranges"]
+        if not ranges:
+            # -1 so the next one will be rev 0
+            return -1
+        return ranges[-1][1]
+
+    def find_gaps(self):
+        """Return a list of the [FROMREV, TOREV] ranges of revisions below
+        the last dumped revision which are not in any dump."""
+        gaps = []
+        nextrev = 0
+        for fromrev, torev in self.__manifest["ranges"]:
+            if fromrev > nextrev:
+                gaps.append([nextrev, fromrev - 1])
+            nextrev = torev + 1
+        return gaps
+
+    def report_gaps(self):
+        for fromrev, torev in self.find_gaps():
+            print("warning: revisions %d-%d are not in any dump." % \
+                    (fromrev, torev))
 
     def transfer_ftp(self, absfilename, filename):
         rc = False
@@ -503,13 +786,34 @@ class SvnBackup:
 
     def transfer(self, absfilename, filename):
         if self.__transfer == None:
-            return
+            return None
         elif self.__transfer[0] == "ftp":
-            self.transfer_ftp(absfilename, filename)
+            return self.transfer_ftp(absfilename, filename)
         elif self.__transfer[0] == "smb":
-            self.transfer_smb(absfilename, filename)
+            return self.transfer_smb(absfilename, filename)
         else:
             print("unknown transfer method '%s'." % self.__transfer[0])
+            return False
+
+    def transfer_pending(self):
+        """Transfer the dump files whose transfer failed before."""
+        if self.__transfer == None:
+            return
+        dumps = self.__manifest["dumps"]
+        for filename in sorted(dumps):
+            if dumps[filename].get("transferred") != False:
+                continue
+            absfilename = os.path.join(self.__dumpdir, filename)
+            if not os.path.exists(absfilename):
+                continue
+            print("transferring " + absfilename)
+            if self.transfer(absfilename, filename):
+                self.__manifest_lock.acquire()
+                try:
+                    dumps[filename]["transferred"] = True
+                    self.write_manifest()
+                finally:
+                    self.__manifest_lock.release()
 
     def create_dump(self, checkonly, overwrite, fromrev, torev=None):
         revparam = "%d" % fromrev
@@ -521,10 +825,12 @@ class SvnBackup:
         output = None
         if self.__bzip2_path:
              output = SvnBackupOutputCommand(self.__dumpdir, filename, ".bz2",
-                                             self.__bzip2_path, "-cz" )
+                                             self.__bzip2_path, "-cz",
+                                             "bzip2")
         elif self.__gzip_path:
              output = SvnBackupOutputCommand(self.__dumpdir, filename, ".gz",
-                                             self.__gzip_path, "-cf" )
+                                             self.__gzip_path, "-cf",
+                                             "gzip")
         elif self.__zip:
             if self.__zip == "gzip":
                 output = SvnBackupOutputGzip(self.__dumpdir, filename)
@@ -535,7 +841,7 @@ class SvnBackup:
         absfilename = output.get_absfilename()
         realfilename = output.get_filename()
         if checkonly:
-            return os.path.exists(absfilename)
+            return self.is_dumped(realfilename)
         elif os.path.exists(absfilename):
             if overwrite:
                 print("overwriting " + absfilename)
@@ -550,12 +856,22 @@ class SvnBackup:
             cmd[2:2] = [ "-q" ]
         if self.__deltas:
             cmd[2:2] = [ "--deltas" ]
+        started = time.time()
         output.open()
-        r = self.exec_cmd(cmd, output, True)
-        output.close()
+        try:
+            try:
+                r = self.exec_cmd_pipe(cmd, output)
+            finally:
+                output.close()
+        except:
+            # Don't leave a truncated dump behind.
+            os.remove(absfilename)
+            raise
         rc = r[0] == 0
         if rc:
-            self.transfer(absfilename, realfilename)
+            seconds = time.time() - started
+            transferred = self.transfer(absfilename, realfilename)
+            self.record_dump(output, fromrev, torev, seconds, transferred)
         return rc
 
     def export_single_rev(self):
@@ -568,6 +884,8 @@ class SvnBackup:
         if self.__count is None:
             return self.create_dump(False, self.__overwrite, 0, headrev)
         baserev = headrev - (headrev % self.__count)
+        if self.__jobs > 1:
+            return self.export_parallel(baserev, headrev)
         rc = True
         cnt = self.__count
         fromrev = baserev - cnt
@@ -583,8 +901,37 @@ class SvnBackup:
                 fromrev = -1
         if rc:
             rc = self.create_dump(False, self.__overwrite, baserev, headrev)
+        self.report_gaps()
         return rc
 
+    def export_parallel(self, baserev, headrev):
+        """Like export(), but first work out which dumps are missing and
+        then create them with up to --jobs dumps running at a time."""
+        from multiprocessing.pool import ThreadPool
+
+        cnt = self.__count
+        dumps = [ (self.__overwrite, baserev, headrev) ]
+        fromrev = baserev - cnt
+        while fromrev >= 0:
+            torev = fromrev + cnt - 1
+            if not self.__overwrite_all and \
+                self.create_dump(True, False, fromrev, torev):
+                break
+            dumps.append((self.__overwrite_all, fromrev, torev))
+            fromrev -= cnt
+
+        def create(dump):
+            overwrite, fromrev, torev = dump
+            return self.create_dump(False, overwrite, fromrev, torev)
+        pool = ThreadPool(min(self.__jobs, len(dumps)))
+        try:
+            results = pool.map(create, dumps, 1)
+        finally:
+            pool.close()
+            pool.join()
+        self.report_gaps()
+        return False not in results
+
     def export_relative_incremental(self):
         headrev = self.get_head_rev()
         if headrev == -1:
@@ -597,11 +944,15 @@ class SvnBackup:
 
         if headrev == last_dumped_rev:
             # already up-to-date
+            self.report_gaps()
             return True
 
-        return self.create_dump(False, False, last_dumped_rev + 1, headrev)
+        rc = self.create_dump(False, False, last_dumped_rev + 1, headrev)
+        self.report_gaps()
+        return rc
 
     def execute(self):
+        self.transfer_pending()
         if self.__rev_nr != None:
             return self.export_single_rev()
         elif self.__relative_incremental:
@@ -622,6 +973,16 @@ if __name__ == "__main__":
                        action="store_true",
                        dest="relative_incremental", default=False,
                        help="perform incremental relative to last dump.")
+    parser.add_option("-j",
+                       action="store", type="int",
+                       dest="jobs", default=1,
+                       help="number of dumps to create at the same time "
+                            "(with -c).")
+    parser.add_option("--verify",
+                       action="store_true",
+                       dest="verify", default=False,
+                       help="check the checksums of the dumps already "
+                            "made (with -c).")
     parser.add_option("--deltas",
                        action="store_true",
                        dest="deltas", default=False,
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+# ====================================================================
+#    Licensed to the Apache Software Foundation (ASF) under one
+#    or more contributor license agreements.  See the NOTICE file
+#    distributed with this work for additional information
+#    regarding copyright ownership.  The ASF licenses this file
+#    to you under the Apache License, Version 2.0 (the
+#    "License"); you may not use this file except in compliance
+#    with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an
+#    "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#    KIND, either express or implied.  See the License for the
+#    specific language governing permissions and limitations
+#    under the License.
+# ====================================================================
+
+# svn_server_log_parse-bench.py: time svn_server_log_parse on a large
+#                                synthetic svnserve log
+#
+# A log of LINES lines with a mix of the common actions is generated
+# and parsed line by line with Parser.parse as it used to be (looking
+# up _parse_ methods with getattr, and matching with re.match on the
+# pattern string), with Parser.parse, with parse_stream, and with
+# parse_file in PROCESSES processes.  All four must count the same
+# actions.  parse_file uses no more processes than there are CPUs, so
+# it can only beat parse_stream on a machine with several cores.
+#
+# USAGE: ./svn_server_log_parse-bench.py [LINES [PROCESSES]]
+
+import os
+import re
+import multiprocessing
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import svn_server_log_parse
+
+ACTIONS = [
+    'open 2 cap=(edit-pipeline svndiff1 absent-entries depth mergeinfo log-revprops) /repos/proj%d SVN/1.7.0%%20(x86_64-pc-linux-gnu) -',
+    'get-latest-rev',
+    'update /trunk r%d depth=infinity send-copyfrom-args',
+    'get-dir /trunk/src/dir%d r1234 props',
+    'get-file /trunk/src/file%d.c r1234 text props',
+    'log (/trunk/src/file%d.c) r5000:0 limit=100 discover-changed-paths revprops=(svn:author svn:date svn:log)',
+    'stat /trunk/src/file%d.c@1234',
+    'check-path /branches/1.%d.x@1234',
+    'diff /trunk r%d:1234 depth=infinity ignore-ancestry',
+    'status /trunk r%d depth=infinity',
+    'commit r%d',
+    'get-mergeinfo (/branches/1.%d.x) inherited',
+    'reparent /repos/proj%d/trunk',
+]
+
+
+def write_log(fname, nlines):
+    fp = open(fname, 'w')
+    for i in range(nlines):
+        action = ACTIONS[i % len(ACTIONS)]
+        if '%d' in action:
+            action = action % (i % 1000,)
+        fp.write('%d 2013-04-15T20:41:%02d.000000Z 10.0.%d.%d user%d proj%d %s\n'
+                 % (1000 + i % 50, i % 60, i % 256, i % 100, i % 40, i % 7,
+                    action))
+    fp.close()
+
+
+class CountingParser(svn_server_log_parse.Parser):
+    def __init__(self):
+        self.counts = {}
+
+    def __getattr__(self, attr):
+        if not attr.startswith('handle_'):
+            raise AttributeError(attr)
+        action = attr[7:]
+        def handle(*args):
+            self.counts[action] = self.counts.get(action, 0) + 1
+        setattr(self, attr, handle)
+        return handle
+
+
+def old_match(line, action):
+    """_match as it was before the patterns were compiled once: re.match
+    on the pattern string, looked up in re's cache on every call."""
+    pattern = svn_server_log_parse._MATCHERS[action].pattern
+    m = re.match(pattern, line)
+    if m is None:
+        raise svn_server_log_parse.MatchError(pattern, line)
+    return m
+
+
+class OldCountingParser(CountingParser):
+    def parse(self, line):
+        """Parser.parse as it was before the dispatch table."""
+        self.line = line
+        words = self.split_line = line.split(' ')
+        try:
+            method = getattr(self, '_parse_' + words[0].replace('-', '_'))
+        except AttributeError:
+            return self.handle_unknown(self.line)
+        return method(' '.join(words[1:]))
+
+
+def count_actions(records):
+    counts = {}
+    for record in records:
+        counts[record.action] = counts.get(record.action, 0) + 1
+    return counts
+
+
+def merge_counts(results):
+    counts = {}
+    for result in results:
+        for action, count in result.items():
+            counts[action] = counts.get(action, 0) + count
+    return counts
+
+
+def main():
+    nlines = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    fd, fname = tempfile.mkstemp(suffix='.log')
+    os.close(fd)
+    try:
+        write_log(fname, nlines)
+        size = os.path.getsize(fname)
+
+        start = time.time()
+        old_parser = OldCountingParser()
+        new_match = svn_server_log_parse._match
+        svn_server_log_parse._match = old_match
+        try:
+            for line in open(fname):
+                old_parser.parse(' '.join(line.split(' ')[5:]).rstrip('\n'))
+        finally:
+            svn_server_log_parse._match = new_match
+        old_by_line = time.time() - start
+
+        start = time.time()
+        parser = CountingParser()
+        for line in open(fname):
+            parser.parse(' '.join(line.split(' ')[5:]).rstrip('\n'))
+        by_line = time.time() - start
+
+        start = time.time()
+        streamed = count_actions(svn_server_log_parse.parse_stream(
+                                     open(fname), 5))
+        stream = time.time() - start
+
+        start = time.time()
+        parallel = merge_counts(svn_server_log_parse.parse_file(
+                                    fname, count_actions, 5, processes))
+        shards = time.time() - start
+    finally:
+        os.remove(fname)
+
+    if not (old_parser.counts == parser.counts == streamed == parallel):
+        sys.stderr.write('FAIL: the parsers counted different actions\n')
+        sys.exit(1)
+
+    mb = size / (1024.0 * 1024.0)
+    print('%d lines, %.1f MB' % (nlines, mb))
+    print('old Parser.parse:  %.3fs (%.0f lines/s)' % (old_by_line,
+                                                       nlines / old_by_line))
+    print('Parser.parse:      %.3fs (%.0f lines/s)' % (by_line,
+                                                       nlines / by_line))
+    print('parse_stream:      %.3fs (%.0f lines/s)' % (stream,
+                                                       nlines / stream))
+    print('parse_file (-j%d):  %.3fs (%.0f lines/s, %d CPUs)' % (
+              processes, shards, nlines / shards, multiprocessing.cpu_count()))
+
+if __name__ == '__main__':
+    main()
@@ -75,10 +75,47 @@ The update report::
     status <PATH> r<N> depth=<D>?
     switch <FROM-PATH> <TO-PATH>@<N> depth=<D>?
     update <PATH> r<N> depth=<D>? send-copyfrom-args?
+
+Parsing whole logs
+------------------
+
+parse_stream() parses an iterable of log lines (such as an open log
+file), yielding a record for each.  The records are namedtuples from
+RECORD_TYPES, with an 'action' field naming the handle_ method the
+line would be passed to, a 'prefix' field holding the leading words of
+the line that are not part of the SVN-ACTION string, and then the
+handle_ method's arguments.  Parser.parse_stream() does the same for
+Parser subclasses, calling the handle_ methods.
+
+parse_file() parses a log file in byte ranges in several processes,
+passing each process's records to a function and returning its
+results.  That only pays off for large files on machines with several
+CPU cores; otherwise parse_stream() is faster.
+
+Aggregating logs
+----------------
+
+An Aggregator counts records by action, repository, user, path, path
+prefix and depth, and per time bucket.  It counts repositories, users
+and paths with a count-min sketch, keeping only the heaviest keys, so
+their memory is bounded however many distinct keys the log has.  The
+time buckets are kept whole, so they grow with the time the log
+covers: use longer buckets for logs of months or years.  Aggregators
+from different processes can be merged; aggregate_file() uses
+parse_file() to do that, counting lines which cannot be parsed as
+'unparsable' actions rather than stopping at them.
+
+Run this module with a log file to print a report; see --help.
 """
 
 
 import re
+import os
+import sys
+import zlib
+import calendar
+import functools
+from collections import namedtuple
 try:
   # Python >=3.0
   from urllib.parse import unquote as urllib_parse_unquote
@@ -100,7 +137,7 @@ INHERITANCE_WORDS = {
 }
 
 #
-# Patterns for _match
+# Patterns for _compile
 #
 
 # <PATH>
@@ -119,6 +156,12 @@ pWORD = r'(\S+)'
 pPROPERTY = pWORD
 # depth=<D>?
 pDEPTH = 'depth=' + pWORD
+pINT = r'(\d+)'
+pCAP = r'cap=\(([^)]*)\)'
+# limit=<N>?
+pLIMIT = r'limit=(\d+)'
+# revprops=all|(<REVPROP> ...)?
+pREVPROPS = r'revprops=(all|\(([^)]+)\))'
 
 #
 # Exceptions
@@ -164,16 +207,18 @@ def _parse_mergeinfo_inheritance(word):
         raise BadMergeinfoInheritanceError(word)
     return svn_inheritance_from_word(word)
 
-def _match(line, *patterns):
-    """Return a re.match object from matching patterns against line.
+def _unquote(s):
+    if '%' not in s:
+        return s
+    return urllib_parse_unquote(s)
 
-    All optional arguments must be strings suitable for ''.join()ing
-    into a single pattern string for re.match.  The last optional
-    argument may instead be a list of such strings, which will be
-    joined into the final pattern as *optional* matches.
+def _compile(*patterns):
+    """Return a compiled regular expression matching patterns.
 
-    Raises:
-    Error -- if re.match returns None (i.e. no match)
+    All arguments must be strings suitable for ''.join()ing into a
+    single pattern string for re.compile.  The last argument may
+    instead be a list of such strings, which will be joined into the
+    final pattern as *optional* matches.
     """
     if isinstance(patterns[-1], list):
         optional = patterns[-1]
@@ -182,11 +227,89 @@ def _match(line, *patterns):
         optional = []
     pattern = r'\s+'.join(patterns)
     pattern += ''.join([r'(\s+' + x + ')?' for x in optional])
-    m = re.match(pattern, line)
+    return re.compile(pattern)
+
+# The matchers for the words following each SVN-ACTION, keyed by the
+# name of the handle_ method.
+_MATCHERS = {
+    'commit': _compile(pREVNUM),
+    'open': _compile(pINT, pCAP, pPATH, pWORD, pWORD),
+    'reparent': _compile(pPATH),
+    'get_dated_rev': _compile(pWORD),
+    'get_dir': _compile(pPATH, pREVNUM, ['text', 'props']),
+    'get_file': _compile(pPATH, pREVNUM, ['text', 'props']),
+    'lock': _compile(pPATHS, ['steal']),
+    'change_rev_prop': _compile(pREVNUM, pPROPERTY),
+    'rev_proplist': _compile(pREVNUM),
+    'rev_prop': _compile(pREVNUM, pPROPERTY),
+    'unlock': _compile(pPATHS, ['break']),
+    'get_lock': _compile(pPATH),
+    'get_locks': _compile(pPATH),
+    'get_locations': _compile(pPATH, pREVNUMS),
+    'get_location_segments': _compile(pPATHREV, pREVRANGE),
+    'get_file_revs': _compile(pPATH, pREVRANGE, ['include-merged-revisions']),
+    # <I> include-descendants?
+    'get_mergeinfo': _compile(pPATHS, pWORD, ['include-descendants']),
+    'log': _compile(pPATHS, pREVRANGE,
+                    [pLIMIT, 'discover-changed-paths', 'strict',
+                     'include-merged-revisions', pREVPROPS]),
+    'check_path': _compile(pPATHREV),
+    'stat': _compile(pPATHREV),
+    'replay': _compile(pPATH, pREVNUM),
+    'checkout_or_export': _compile(pPATH, pREVNUM, [pDEPTH]),
+    'diff_1path': _compile(pPATH, pREVRANGE, [pDEPTH, 'ignore-ancestry']),
+    'diff_2paths': _compile(pPATHREV, pPATHREV, [pDEPTH, 'ignore-ancestry']),
+    'status': _compile(pPATH, pREVNUM, [pDEPTH]),
+    'switch': _compile(pPATH, pPATHREV, [pDEPTH]),
+    'update': _compile(pPATH, pREVNUM, [pDEPTH, 'send-copyfrom-args']),
+}
+
+def _match(line, action):
+    """Return a re.match object from matching the matcher for action
+    against line.
+
+    Raises:
+    Error -- if the matcher does not match
+    """
+    matcher = _MATCHERS[action]
+    m = matcher.match(line)
     if m is None:
-        raise MatchError(pattern, line)
+        raise MatchError(matcher.pattern, line)
     return m
 
+def _parse_lines(parser, lines, fields, skip_errors=False):
+    """Parse each of lines with parser, as Parser.parse_stream does,
+    yielding None after each line.  If skip_errors is true, the Error
+    raised for a line is yielded instead of raised."""
+    dispatch = parser._dispatch
+    for line in lines:
+        parser.prefix, line = _split_line(line, fields)
+        parser.line = line
+        action, _, rest = line.partition(' ')
+        method = dispatch.get(action)
+        try:
+            if method is None:
+                parser.handle_unknown(line)
+            else:
+                method(parser, rest)
+        except Error:
+            if not skip_errors:
+                raise
+            yield sys.exc_info()[1]
+        else:
+            yield None
+
+def _split_line(line, fields):
+    """Return the first fields words of line and the rest of it, without
+    the line ending."""
+    line = line.rstrip('\r\n')
+    if fields == 0:
+        return '', line
+    words = line.split(' ', fields)
+    if len(words) <= fields:
+        return line, ''
+    return ' '.join(words[:fields]), words[fields]
+
 
 class Parser(object):
     """Subclass this and define the handle_ methods according to the
@@ -210,37 +333,68 @@ class Parser(object):
         Error                           -- any other parse error
         """
         self.line = line
-        words = self.split_line = line.split(' ')
+        action, _, rest = line.partition(' ')
         try:
-            method = getattr(self, '_parse_' + words[0].replace('-', '_'))
-        except AttributeError:
-            return self.handle_unknown(self.line)
-        return method(' '.join(words[1:]))
+            method = self._dispatch[action]
+        except KeyError:
+            return self.handle_unknown(line)
+        return method(self, rest)
+
+    def parse_stream(self, lines, fields=0):
+        """Parse each of lines, an iterable of log lines such as an open
+        file, calling the appropriate handle_ methods.  The first fields
+        words of each line are not part of the SVN-ACTION string (e.g.
+        5 for svnserve, which logs the PID, date, client address,
+        username and repository first); they are stored in self.prefix
+        before the handle_ method is called.
+
+        Returns the number of lines parsed.
+
+        Raises the same exceptions as parse.
+        """
+        count = 0
+        for _ in _parse_lines(self, lines, fields):
+            count += 1
+        return count
+
+    class _Dispatch(object):
+        """Maps SVN-ACTION words to the _parse_ methods of a Parser
+        subclass, built the first time the subclass parses a line."""
+        def __get__(self, obj, cls):
+            table = cls.__dict__.get('_dispatch_table')
+            if table is None:
+                table = {}
+                for attr in dir(cls):
+                    # _parse_diff_1path and _parse_diff_2paths are
+                    # called by _parse_diff, not for actions of their own
+                    if attr.startswith('_parse_') and \
+                       not attr.startswith('_parse_diff_'):
+                        table[attr[7:].replace('_', '-')] = getattr(cls, attr)
+                cls._dispatch_table = table
+            return table
+    _dispatch = _Dispatch()
 
     def _parse_commit(self, line):
-        m = _match(line, pREVNUM)
+        m = _match(line, 'commit')
         self.handle_commit(int(m.group(1)))
         return line[m.end():]
 
     def _parse_open(self, line):
-        pINT = r'(\d+)'
-        pCAP = r'cap=\(([^)]*)\)'
-        pCLIENT = pWORD
-        m = _match(line, pINT, pCAP, pPATH, pCLIENT, pCLIENT)
+        m = _match(line, 'open')
         protocol = int(m.group(1))
         if m.group(2) is None:
             capabilities = []
         else:
             capabilities = m.group(2).split()
         path = m.group(3)
-        ra_client = urllib_parse_unquote(m.group(4))
-        client = urllib_parse_unquote(m.group(5))
+        ra_client = _unquote(m.group(4))
+        client = _unquote(m.group(5))
         self.handle_open(protocol, capabilities, path, ra_client, client)
         return line[m.end():]
 
     def _parse_reparent(self, line):
-        m = _match(line, pPATH)
-        self.handle_reparent(urllib_parse_unquote(m.group(1)))
+        m = _match(line, 'reparent')
+        self.handle_reparent(_unquote(m.group(1)))
         return line[m.end():]
 
     def _parse_get_latest_rev(self, line):
@@ -248,72 +402,72 @@ class Parser(object):
         return line
 
     def _parse_get_dated_rev(self, line):
-        m = _match(line, pWORD)
+        m = _match(line, 'get_dated_rev')
         self.handle_get_dated_rev(m.group(1))
         return line[m.end():]
 
     def _parse_get_dir(self, line):
-        m = _match(line, pPATH, pREVNUM, ['text', 'props'])
-        self.handle_get_dir(urllib_parse_unquote(m.group(1)), int(m.group(2)),
+        m = _match(line, 'get_dir')
+        self.handle_get_dir(_unquote(m.group(1)), int(m.group(2)),
                             m.group(3) is not None,
                             m.group(4) is not None)
         return line[m.end():]
 
     def _parse_get_file(self, line):
-        m = _match(line, pPATH, pREVNUM, ['text', 'props'])
-        self.handle_get_file(urllib_parse_unquote(m.group(1)), int(m.group(2)),
+        m = _match(line, 'get_file')
+        self.handle_get_file(_unquote(m.group(1)), int(m.group(2)),
                              m.group(3) is not None,
                              m.group(4) is not None)
         return line[m.end():]
 
     def _parse_lock(self, line):
-        m = _match(line, pPATHS, ['steal'])
-        paths = [urllib_parse_unquote(x) for x in m.group(1).split()]
+        m = _match(line, 'lock')
+        paths = [_unquote(x) for x in m.group(1).split()]
         self.handle_lock(paths, m.group(2) is not None)
         return line[m.end():]
 
     def _parse_change_rev_prop(self, line):
-        m = _match(line, pREVNUM, pPROPERTY)
+        m = _match(line, 'change_rev_prop')
         self.handle_change_rev_prop(int(m.group(1)),
-                                    urllib_parse_unquote(m.group(2)))
+                                    _unquote(m.group(2)))
         return line[m.end():]
 
     def _parse_rev_proplist(self, line):
-        m = _match(line, pREVNUM)
+        m = _match(line, 'rev_proplist')
         self.handle_rev_proplist(int(m.group(1)))
         return line[m.end():]
 
     def _parse_rev_prop(self, line):
-        m = _match(line, pREVNUM, pPROPERTY)
-        self.handle_rev_prop(int(m.group(1)), urllib_parse_unquote(m.group(2)))
+        m = _match(line, 'rev_prop')
+        self.handle_rev_prop(int(m.group(1)), _unquote(m.group(2)))
         return line[m.end():]
 
     def _parse_unlock(self, line):
-        m = _match(line, pPATHS, ['break'])
-        paths = [urllib_parse_unquote(x) for x in m.group(1).split()]
+        m = _match(line, 'unlock')
+        paths = [_unquote(x) for x in m.group(1).split()]
         self.handle_unlock(paths, m.group(2) is not None)
         return line[m.end():]
 
     def _parse_get_lock(self, line):
-        m = _match(line, pPATH)
-        self.handle_get_lock(urllib_parse_unquote(m.group(1)))
+        m = _match(line, 'get_lock')
+        self.handle_get_lock(_unquote(m.group(1)))
         return line[m.end():]
 
     def _parse_get_locks(self, line):
-        m = _match(line, pPATH)
-        self.handle_get_locks(urllib_parse_unquote(m.group(1)))
+        m = _match(line, 'get_locks')
+        self.handle_get_locks(_unquote(m.group(1)))
         return line[m.end():]
 
     def _parse_get_locations(self, line):
-        m = _match(line, pPATH, pREVNUMS)
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'get_locations')
+        path = _unquote(m.group(1))
         revnums = [int(x) for x in m.group(2).split()]
         self.handle_get_locations(path, revnums)
         return line[m.end():]
 
     def _parse_get_location_segments(self, line):
-        m = _match(line, pPATHREV, pREVRANGE)
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'get_location_segments')
+        path = _unquote(m.group(1))
         peg = int(m.group(2))
         left = int(m.group(3))
         right = int(m.group(4))
@@ -321,8 +475,8 @@ class Parser(object):
         return line[m.end():]
 
     def _parse_get_file_revs(self, line):
-        m = _match(line, pPATH, pREVRANGE, ['include-merged-revisions'])
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'get_file_revs')
+        path = _unquote(m.group(1))
         left = int(m.group(2))
         right = int(m.group(3))
         include_merged_revisions    = m.group(4) is not None
@@ -330,26 +484,16 @@ class Parser(object):
         return line[m.end():]
 
     def _parse_get_mergeinfo(self, line):
-        # <I>
-        pMERGEINFO_INHERITANCE = pWORD
-        pINCLUDE_DESCENDANTS = pWORD
-        m = _match(line,
-                   pPATHS, pMERGEINFO_INHERITANCE, ['include-descendants'])
-        paths = [urllib_parse_unquote(x) for x in m.group(1).split()]
+        m = _match(line, 'get_mergeinfo')
+        paths = [_unquote(x) for x in m.group(1).split()]
         inheritance = _parse_mergeinfo_inheritance(m.group(2))
         include_descendants = m.group(3) is not None
         self.handle_get_mergeinfo(paths, inheritance, include_descendants)
         return line[m.end():]
 
     def _parse_log(self, line):
-        # limit=<N>?
-        pLIMIT = r'limit=(\d+)'
-        # revprops=all|(<REVPROP> ...)?
-        pREVPROPS = r'revprops=(all|\(([^)]+)\))'
-        m = _match(line, pPATHS, pREVRANGE,
-                   [pLIMIT, 'discover-changed-paths', 'strict',
-                    'include-merged-revisions', pREVPROPS])
-        paths = [urllib_parse_unquote(x) for x in m.group(1).split()]
+        m = _match(line, 'log')
+        paths = [_unquote(x) for x in m.group(1).split()]
         left = int(m.group(2))
         right = int(m.group(3))
         if m.group(5) is None:
@@ -365,28 +509,28 @@ class Parser(object):
             if m.group(11) is None:
                 revprops = []
             else:
-                revprops = [urllib_parse_unquote(x) for x in m.group(11).split()]
+                revprops = [_unquote(x) for x in m.group(11).split()]
         self.handle_log(paths, left, right, limit, discover_changed_paths,
                         strict, include_merged_revisions, revprops)
         return line[m.end():]
 
     def _parse_check_path(self, line):
-        m = _match(line, pPATHREV)
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'check_path')
+        path = _unquote(m.group(1))
         revnum = int(m.group(2))
         self.handle_check_path(path, revnum)
         return line[m.end():]
 
     def _parse_stat(self, line):
-        m = _match(line, pPATHREV)
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'stat')
+        path = _unquote(m.group(1))
         revnum = int(m.group(2))
         self.handle_stat(path, revnum)
         return line[m.end():]
 
     def _parse_replay(self, line):
-        m = _match(line, pPATH, pREVNUM)
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'replay')
+        path = _unquote(m.group(1))
         revision = int(m.group(2))
         self.handle_replay(path, revision)
         return line[m.end():]
@@ -394,8 +538,8 @@ class Parser(object):
     # the update report
 
     def _parse_checkout_or_export(self, line):
-        m = _match(line, pPATH, pREVNUM, [pDEPTH])
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'checkout_or_export')
+        path = _unquote(m.group(1))
         revision = int(m.group(2))
         depth = _parse_depth(m.group(4))
         self.handle_checkout_or_export(path, revision, depth)
@@ -404,16 +548,16 @@ class Parser(object):
     def _parse_diff(self, line):
         # First, try 1-path form.
         try:
-            m = _match(line, pPATH, pREVRANGE, [pDEPTH, 'ignore-ancestry'])
+            m = _match(line, 'diff_1path')
             f = self._parse_diff_1path
         except Error:
             # OK, how about 2-path form?
-            m = _match(line, pPATHREV, pPATHREV, [pDEPTH, 'ignore-ancestry'])
+            m = _match(line, 'diff_2paths')
             f = self._parse_diff_2paths
         return f(line, m)
 
     def _parse_diff_1path(self, line, m):
-        path = urllib_parse_unquote(m.group(1))
+        path = _unquote(m.group(1))
         left = int(m.group(2))
         right = int(m.group(3))
         depth = _parse_depth(m.group(5))
@@ -423,9 +567,9 @@ class Parser(object):
         return line[m.end():]
 
     def _parse_diff_2paths(self, line, m):
-        from_path = urllib_parse_unquote(m.group(1))
+        from_path = _unquote(m.group(1))
         from_rev = int(m.group(2))
-        to_path = urllib_parse_unquote(m.group(3))
+        to_path = _unquote(m.group(3))
         to_rev = int(m.group(4))
         depth = _parse_depth(m.group(6))
         ignore_ancestry = m.group(7) is not None
@@ -434,27 +578,582 @@ class Parser(object):
         return line[m.end():]
 
     def _parse_status(self, line):
-        m = _match(line, pPATH, pREVNUM, [pDEPTH])
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'status')
+        path = _unquote(m.group(1))
         revision = int(m.group(2))
         depth = _parse_depth(m.group(4))
         self.handle_status(path, revision, depth)
         return line[m.end():]
 
     def _parse_switch(self, line):
-        m = _match(line, pPATH, pPATHREV, [pDEPTH])
-        from_path = urllib_parse_unquote(m.group(1))
-        to_path = urllib_parse_unquote(m.group(2))
+        m = _match(line, 'switch')
+        from_path = _unquote(m.group(1))
+        to_path = _unquote(m.group(2))
         to_rev = int(m.group(3))
         depth = _parse_depth(m.group(5))
         self.handle_switch(from_path, to_path, to_rev, depth)
         return line[m.end():]
 
     def _parse_update(self, line):
-        m = _match(line, pPATH, pREVNUM, [pDEPTH, 'send-copyfrom-args'])
-        path = urllib_parse_unquote(m.group(1))
+        m = _match(line, 'update')
+        path = _unquote(m.group(1))
         revision = int(m.group(2))
         depth = _parse_depth(m.group(4))
         send_copyfrom_args = m.group(5) is not None
         self.handle_update(path, revision, depth, send_copyfrom_args)
         return line[m.end():]
+
+
+#
+# Records
+#
+
+# The arguments of each handle_ method, keyed by the method's name
+# without the handle_ prefix.
+ACTION_FIELDS = {
+    'unknown': ('line',),
+    'open': ('protocol', 'capabilities', 'path', 'ra_client', 'client'),
+    'reparent': ('path',),
+    'get_latest_rev': (),
+    'get_dated_rev': ('date',),
+    'commit': ('revision',),
+    'get_dir': ('path', 'revision', 'text', 'props'),
+    'get_file': ('path', 'revision', 'text', 'props'),
+    'lock': ('paths', 'steal'),
+    'change_rev_prop': ('revision', 'revprop'),
+    'rev_proplist': ('revision',),
+    'rev_prop': ('revision', 'revprop'),
+    'unlock': ('paths', 'break_lock'),
+    'get_lock': ('path',),
+    'get_locks': ('path',),
+    'get_locations': ('path', 'revisions'),
+    'get_location_segments': ('path', 'peg', 'left', 'right'),
+    'get_file_revs': ('path', 'left', 'right', 'include_merged_revisions'),
+    'get_mergeinfo': ('paths', 'inheritance', 'include_descendants'),
+    'log': ('paths', 'left', 'right', 'limit', 'discover_changed_paths',
+            'strict', 'include_merged_revisions', 'revprops'),
+    'check_path': ('path', 'revision'),
+    'stat': ('path', 'revision'),
+    'replay': ('path', 'revision'),
+    'checkout_or_export': ('path', 'revision', 'depth'),
+    'diff_1path': ('path', 'left', 'right', 'depth', 'ignore_ancestry'),
+    'diff_2paths': ('from_path', 'from_rev', 'to_path', 'to_rev', 'depth',
+                    'ignore_ancestry'),
+    'status': ('path', 'revision', 'depth'),
+    'switch': ('from_path', 'to_path', 'to_rev', 'depth'),
+    'update': ('path', 'revision', 'depth', 'send_copyfrom_args'),
+}
+
+# namedtuple types for the records parse_stream yields, keyed like
+# ACTION_FIELDS.
+RECORD_TYPES = {}
+
+# The record parse_stream yields with skip_errors for a line it cannot
+# parse, with the Error raised for it.
+Unparsable = namedtuple('Unparsable', ('action', 'prefix', 'line', 'error'))
+
+class _RecordParser(Parser):
+    """Parser storing a record for each line in self.record."""
+    prefix = ''
+
+def _record_handler(action, record_type):
+    def handle(self, *args):
+        self.record = record_type(action, self.prefix, *args)
+    return handle
+
+for _action, _fields in ACTION_FIELDS.items():
+    RECORD_TYPES[_action] = namedtuple(
+        ''.join([x.capitalize() for x in _action.split('_')]),
+        ('action', 'prefix') + _fields)
+    setattr(_RecordParser, 'handle_' + _action,
+            _record_handler(_action, RECORD_TYPES[_action]))
+del _action, _fields
+
+
+def parse_stream(lines, fields=0, skip_errors=False):
+    """Parse each of lines, an iterable of log lines such as an open
+    file, yielding a record (see RECORD_TYPES) for each.  The first
+    fields words of each line are not part of the SVN-ACTION string and
+    are returned as the record's prefix; see Parser.parse_stream.
+
+    Raises the same exceptions as Parser.parse, unless skip_errors is
+    true, in which case an Unparsable record with action 'unparsable'
+    is yielded for each line which cannot be parsed.
+    """
+    parser = _RecordParser()
+    for error in _parse_lines(parser, lines, fields, skip_errors):
+        if error is None:
+            yield parser.record
+        else:
+            yield Unparsable('unparsable', parser.prefix, parser.line, error)
+
+
+#
+# Parsing files in parallel
+#
+
+def _read_lines(path, start, end):
+    """Yield the lines of the file at path which start at byte offsets
+    start up to (but not including) end."""
+    fp = open(path, 'rb')
+    try:
+        if start > 0:
+            # Skip the line in progress at start, unless start is the
+            # beginning of a line; the previous range reads that one.
+            fp.seek(start - 1)
+            pos = start - 1 + len(fp.readline())
+        else:
+            pos = 0
+        decode = str is not bytes
+        for line in fp:
+            if pos >= end:
+                break
+            pos += len(line)
+            if decode:
+                line = line.decode('utf-8', 'replace')
+            yield line
+    finally:
+        fp.close()
+
+def _parse_range(args):
+    path, start, end, fields, skip_errors, func = args
+    return func(parse_stream(_read_lines(path, start, end), fields,
+                             skip_errors))
+
+def parse_file(path, func, fields=0, processes=1, skip_errors=False):
+    """Parse the log file at path in processes byte ranges, each in a
+    process of its own, calling func with an iterator over the records
+    of each range (see parse_stream, which is passed skip_errors).  func must be picklable, i.e. a
+    module-level function, as must its return value.
+
+    This only helps with several CPU cores and a large file: each
+    process reads its own range and pickles its results back, which on
+    one core, or for a file of a few MB, costs more than parse_stream
+    in a single process.  processes is therefore limited to the number
+    of CPUs and to one per MB of the file.
+
+    Returns the list of func's return values, in file order.
+    """
+    import multiprocessing
+    size = os.path.getsize(path)
+    processes = min(processes, multiprocessing.cpu_count(),
+                    size // (1024 * 1024) + 1)
+    processes = max(1, processes)
+    ranges = []
+    for i in range(processes):
+        ranges.append((path, size * i // processes,
+                       size * (i + 1) // processes, fields, skip_errors,
+                       func))
+    if processes == 1:
+        return [_parse_range(ranges[0])]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(_parse_range, ranges, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+#
+# Aggregation
+#
+
+class CountMinSketch(object):
+    """Estimates of the number of times each of a stream of keys was
+    added, using width * depth counters.  The estimates are never too
+    low, and too high by at most 2 * total / width with a probability
+    of 1 - 2 ** -depth."""
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self.rows = [[0] * width for i in range(depth)]
+
+    def _indexes(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        h1 = zlib.crc32(key) & 0xffffffff
+        h2 = (zlib.crc32(key, 0x9e3779b9) & 0xffffffff) | 1
+        width = self.width
+        return [(h1 + i * h2) % width for i in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Add count to key, returning the new estimate for key."""
+        self.total += count
+        estimates = []
+        for row, i in zip(self.rows, self._indexes(key)):
+            row[i] += count
+            estimates.append(row[i])
+        return min(estimates)
+
+    def estimate(self, key):
+        return min([row[i] for row, i in zip(self.rows, self._indexes(key))])
+
+    def merge(self, other):
+        """Add the counts of other, which must have the same width and
+        depth, to this sketch."""
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError('cannot merge %dx%d and %dx%d sketches'
+                             % (self.width, self.depth,
+                                other.width, other.depth))
+        self.total += other.total
+        for row, other_row in zip(self.rows, other.rows):
+            for i, count in enumerate(other_row):
+                if count:
+                    row[i] += count
+
+
+class HeavyHitters(object):
+    """The most frequent of a stream of keys, with their estimated
+    counts.  Keys are counted with a CountMinSketch, and between
+    capacity and 2 * capacity of the keys with the highest estimates
+    are kept.  Up to batch distinct keys are counted exactly before
+    being added to the sketch, so that frequent keys are hashed only
+    once per batch."""
+    def __init__(self, capacity=1000, width=2048, depth=4, batch=4096):
+        if capacity < 1:
+            raise ValueError('HeavyHitters capacity must be at least 1, '
+                             'not %r' % (capacity,))
+        self.capacity = capacity
+        self.batch = batch
+        self.sketch = CountMinSketch(width, depth)
+        self.pending = {}
+        self.counts = {}
+        # The lowest estimate kept when the keys were last pruned; keys
+        # estimated no higher are not worth keeping.
+        self.threshold = 0
+
+    def add(self, key, count=1):
+        pending = self.pending
+        pending[key] = pending.get(key, 0) + count
+        if len(pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Add the pending counts to the sketch."""
+        add = self.sketch.add
+        counts = self.counts
+        for key, count in self.pending.items():
+            estimate = add(key, count)
+            if estimate > self.threshold or key in counts:
+                counts[key] = estimate
+        self.pending = {}
+        if len(counts) > 2 * self.capacity:
+            self._prune()
+
+    def _prune(self):
+        items = self.top(self.capacity)
+        self.counts = dict(items)
+        self.threshold = items[-1][1]
+
+    def top(self, n):
+        """Return a list of the n most frequent (key, count) pairs, most
+        frequent first."""
+        if self.pending:
+            self.flush()
+        items = sorted(self.counts.items(), key=lambda x: (-x[1], x[0]))
+        return items[:n]
+
+    def merge(self, other):
+        self.flush()
+        other.flush()
+        self.sketch.merge(other.sketch)
+        counts = {}
+        for key in set(self.counts) | set(other.counts):
+            counts[key] = self.sketch.estimate(key)
+        self.counts = counts
+        self.threshold = max(self.threshold, other.threshold)
+        if len(self.counts) > 2 * self.capacity:
+            self._prune()
+
+
+_MONTHS = dict([(m, i + 1) for i, m in
+                enumerate(['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+                           'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'])])
+
+# Seconds since the epoch of the start of each minute seen, keyed by the
+# minute's timestamp string; log lines come in time order, so this stays
+# small.
+_minutes = {}
+
+def _minute_seconds(key, year, month, day, hour, minute):
+    try:
+        return _minutes[key]
+    except KeyError:
+        if len(_minutes) > 10000:
+            _minutes.clear()
+        seconds = _minutes[key] = calendar.timegm(
+            (year, month, day, hour, minute, 0, 0, 0, 0))
+        return seconds
+
+def _parse_svnserve_prefix(prefix):
+    """Return (time, user, repository) from the PID, date, client
+    address, username and repository svnserve logs before each
+    action."""
+    words = prefix.split(' ')
+    if len(words) != 5:
+        return None, None, None
+    date = words[1]
+    # 2008-04-15T20:41:24.000000Z
+    try:
+        time = _minute_seconds(date[:16], int(date[0:4]), int(date[5:7]),
+                               int(date[8:10]), int(date[11:13]),
+                               int(date[14:16])) + int(date[17:19])
+    except ValueError:
+        time = None
+    return time, words[3], words[4]
+
+def _parse_mod_dav_svn_prefix(prefix):
+    """Return (time, user, repository) from a mod_dav_svn log using
+    the "%t %u %{SVN-REPOS-NAME}e %{SVN-ACTION}e" CustomLog format."""
+    words = prefix.split(' ')
+    if len(words) != 4:
+        return None, None, None
+    # [15/Apr/2008:20:41:24 +0000]
+    date = words[0]
+    zone = words[1]
+    try:
+        time = _minute_seconds(date[:18], int(date[8:12]),
+                               _MONTHS[date[4:7]], int(date[1:3]),
+                               int(date[13:15]), int(date[16:18])) \
+               + int(date[19:21])
+        offset = int(zone[1:3]) * 3600 + int(zone[3:5]) * 60
+        if zone[0] == '-':
+            time += offset
+        else:
+            time -= offset
+    except (ValueError, KeyError):
+        time = None
+    return time, words[2], words[3]
+
+# The number of words before the SVN-ACTION string and the function
+# parsing them, for each log format.
+LOG_FORMATS = {
+    'svnserve': (5, _parse_svnserve_prefix),
+    'mod_dav_svn': (4, _parse_mod_dav_svn_prefix),
+}
+
+# The record fields holding paths, and those holding a depth.
+_PATH_FIELDS = {}
+_DEPTH_FIELDS = {}
+for _action, _fields in ACTION_FIELDS.items():
+    _PATH_FIELDS[_action] = [x for x in _fields if x.endswith('path')
+                             or x == 'paths']
+    _DEPTH_FIELDS[_action] = 'depth' in _fields
+del _action, _fields
+
+_DEPTH_NAMES = {svn.core.svn_depth_unknown: 'unknown'}
+for _word in DEPTH_WORDS:
+    _DEPTH_NAMES[svn.core.svn_depth_from_word(_word)] = _word
+del _word
+
+
+class Aggregator(object):
+    """Counts of the records of a log; see "Aggregating logs" in this
+    module's documentation.
+
+    log_format      -- a key of LOG_FORMATS, saying how to find the time,
+                       user and repository of each record
+    bucket          -- the length of the time buckets, in seconds
+    prefix_depth    -- the number of components of the path prefixes
+    capacity        -- the number of repositories, users, paths and
+                       path prefixes to keep counts for
+    width, depth    -- the size of their count-min sketches
+
+    The counts are in these attributes:
+
+    total           -- the number of records
+    actions         -- dict of action (handle_ method name, or
+                       'unparsable' for Unparsable records) to count
+    depths          -- dict of depth word ('unknown' if not given) to count
+    buckets         -- dict of bucket start time (in seconds since the
+                       epoch) to a dict of action to count; one per
+                       bucket of the time the log covers, however few
+                       records each has
+    repositories, users, paths, path_prefixes
+                    -- HeavyHitters; paths start with the repository name
+    """
+    def __init__(self, log_format='svnserve', bucket=60, prefix_depth=2,
+                 capacity=1000, width=2048, depth=4):
+        self.log_format = log_format
+        self._parse_prefix = LOG_FORMATS[log_format][1]
+        self.bucket = bucket
+        self.prefix_depth = prefix_depth
+        self.total = 0
+        self.actions = {}
+        self.depths = {}
+        self.buckets = {}
+        self.repositories = HeavyHitters(capacity, width, depth)
+        self.users = HeavyHitters(capacity, width, depth)
+        self.paths = HeavyHitters(capacity, width, depth)
+        self.path_prefixes = HeavyHitters(capacity, width, depth)
+
+    def add(self, record):
+        action = record.action
+        self.total += 1
+        self.actions[action] = self.actions.get(action, 0) + 1
+        if action == 'unparsable':
+            return
+        time, user, repository = self._parse_prefix(record.prefix)
+        if time is not None:
+            start = time - time % self.bucket
+            counts = self.buckets.get(start)
+            if counts is None:
+                counts = self.buckets[start] = {}
+            counts[action] = counts.get(action, 0) + 1
+        if user is not None:
+            self.users.add(user)
+        if repository is not None:
+            self.repositories.add(repository)
+        else:
+            repository = ''
+        # Count each distinct path and prefix once per record, e.g. for a
+        # diff or switch of a path against itself.
+        paths = set()
+        for field in _PATH_FIELDS[action]:
+            value = getattr(record, field)
+            if isinstance(value, list):
+                paths.update(value)
+            else:
+                paths.add(value)
+        prefixes = set()
+        for path in paths:
+            self.paths.add(repository + path)
+            prefixes.add('/'.join(path.split('/')[:self.prefix_depth + 1]))
+        for prefix in prefixes:
+            self.path_prefixes.add(repository + prefix)
+        if _DEPTH_FIELDS[action]:
+            depth = _DEPTH_NAMES.get(record.depth, 'unknown')
+            self.depths[depth] = self.depths.get(depth, 0) + 1
+
+    def add_records(self, records):
+        for record in records:
+            self.add(record)
+        return self
+
+    def merge(self, other):
+        """Add the counts of other, an Aggregator created with the same
+        arguments, to this one."""
+        for name in ('log_format', 'bucket', 'prefix_depth'):
+            if getattr(self, name) != getattr(other, name):
+                raise ValueError('cannot merge aggregators with %s %r and %r'
+                                 % (name, getattr(self, name),
+                                    getattr(other, name)))
+        sketch, other_sketch = self.paths.sketch, other.paths.sketch
+        if (other_sketch.width, other_sketch.depth) != \
+           (sketch.width, sketch.depth):
+            raise ValueError('cannot merge aggregators with %dx%d and %dx%d '
+                             'sketches' % (sketch.width, sketch.depth,
+                                           other_sketch.width,
+                                           other_sketch.depth))
+        self.total += other.total
+        for counts, other_counts in ((self.actions, other.actions),
+                                     (self.depths, other.depths)):
+            for key, count in other_counts.items():
+                counts[key] = counts.get(key, 0) + count
+        for start, other_counts in other.buckets.items():
+            counts = self.buckets.setdefault(start, {})
+            for action, count in other_counts.items():
+                counts[action] = counts.get(action, 0) + count
+        self.repositories.merge(other.repositories)
+        self.users.merge(other.users)
+        self.paths.merge(other.paths)
+        self.path_prefixes.merge(other.path_prefixes)
+        return self
+
+    def rates(self):
+        """Return a sorted list of (bucket start time, records per
+        second) pairs."""
+        return [(start, sum(counts.values()) / float(self.bucket))
+                for start, counts in sorted(self.buckets.items())]
+
+    def report(self, n=10):
+        """Return a plain text report of the counts, listing the top n
+        of each, as a list of lines."""
+        lines = ['%d records' % (self.total,)]
+        def section(title, items):
+            lines.append('')
+            lines.append(title)
+            for key, count in items:
+                lines.append('  %10d  %s' % (count, key))
+        def by_count(counts):
+            return sorted(counts.items(), key=lambda x: (-x[1], x[0]))
+        section('Actions', by_count(self.actions))
+        section('Repositories', self.repositories.top(n))
+        section('Users', self.users.top(n))
+        section('Paths', self.paths.top(n))
+        section('Path prefixes', self.path_prefixes.top(n))
+        section('Depths', by_count(self.depths))
+        rates = self.rates()
+        if rates:
+            lines.append('')
+            lines.append('Records per second (%d second buckets)'
+                         % (self.bucket,))
+            lines.append('  peak %.2f, mean %.2f'
+                         % (max([x[1] for x in rates]),
+                            sum([x[1] for x in rates]) / len(rates)))
+        return lines
+
+
+def _aggregate(options, records):
+    return Aggregator(**options).add_records(records)
+
+def aggregate_file(path, log_format='svnserve', processes=1, **options):
+    """Return an Aggregator of the log file at path, parsed in
+    processes processes (see parse_file).  Lines which cannot be parsed
+    are counted as 'unparsable' actions.  The other keyword arguments
+    are passed to Aggregator."""
+    options['log_format'] = log_format
+    fields = LOG_FORMATS[log_format][0]
+    results = parse_file(path, functools.partial(_aggregate, options),
+                         fields, processes, skip_errors=True)
+    aggregator = results[0]
+    for result in results[1:]:
+        aggregator.merge(result)
+    return aggregator
+
+def guess_log_format(path):
+    """Return the LOG_FORMATS key of the log file at path, or None."""
+    fp = open(path)
+    line = fp.readline()
+    fp.close()
+    if re.match(r'\d+ \d\d\d\d-', line):
+        return 'svnserve'
+    elif re.match(r'\[\d\d/', line):
+        return 'mod_dav_svn'
+    return None
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(usage='usage: %prog [options] LOGFILE',
+                          description='Print counts of the actions in an '
+                                      'svnserve or mod_dav_svn log.')
+    parser.add_option('-f', '--format', dest='log_format',
+                      choices=sorted(LOG_FORMATS),
+                      help='log format: svnserve or mod_dav_svn '
+                           '(default: guess)')
+    parser.add_option('-j', '--jobs', type='int', dest='processes',
+                      default=1, help='number of processes to parse with')
+    parser.add_option('-n', '--top', type='int', dest='top', default=10,
+                      help='number of repositories, users and paths to list')
+    parser.add_option('-b', '--bucket', type='int', dest='bucket',
+                      default=60, help='time bucket length in seconds')
+    parser.add_option('-p', '--prefix-depth', type='int',
+                      dest='prefix_depth', default=2,
+                      help='number of path components in path prefixes')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('a log file must be given')
+    log_format = options.log_format or guess_log_format(args[0])
+    if log_format is None:
+        parser.error("unknown log format in '%s'" % (args[0],))
+    aggregator = aggregate_file(args[0], log_format, options.processes,
+                                bucket=options.bucket,
+                                prefix_depth=options.prefix_depth,
+                                capacity=max(1000, options.top))
+    sys.stdout.write('\n'.join(aggregator.report(options.top)) + '\n')
+
+if __name__ == '__main__':
+    main()
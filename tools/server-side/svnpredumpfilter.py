@@ -29,9 +29,9 @@ use Subversion's 'svndumpfilter' program to include/exclude paths from
 a full dump of a repository's history.
 
 The revision log stream should be the result of 'svn log -v' or 'svn
-log -vq' when run against the root of the repository whose history
-will be filtered by a user with universal read access to the
-repository's data.  Do not use the --use-merge-history (-g) or
+log -vq' (with or without --xml) when run against the root of the
+repository whose history will be filtered by a user with universal read
+access to the repository's data.  Do not use the --use-merge-history (-g) or
 --stop-on-copy when generating this revision log stream.
 Use the default ordering of revisions (that is, '-r HEAD:0').
 
@@ -119,37 +119,91 @@ def log(msg, min_verbosity):
       sys.stderr.write("[**] ")
     sys.stderr.write(msg + "\n")
 
+class PathTrie:
+  """A tree of paths, keyed by path segment.  Each node is a dictionary
+  mapping segment names to child nodes, with the values stored at a
+  node's own path in a list under the None key."""
+
+  def __init__(self):
+    self.root = {}
+
+  def add(self, path, value):
+    node = self.root
+    for segment in path.split('/'):
+      node = node.setdefault(segment, {})
+    node.setdefault(None, []).append(value)
+
+  def has_ancestor(self, path):
+    """Return True if PATH, or one of its parents, has been added."""
+    node = self.root
+    for segment in path.split('/'):
+      node = node.get(segment)
+      if node is None:
+        return False
+      if None in node:
+        return True
+    return False
+
+  def pop_subtree(self, path):
+    """Remove PATH and everything below it from the trie, and return the
+    values which were stored there."""
+    parent = None
+    node = self.root
+    for segment in path.split('/'):
+      parent = node
+      node = node.get(segment)
+      if node is None:
+        return []
+    del parent[segment]
+
+    values = []
+    stack = [node]
+    while stack:
+      node = stack.pop()
+      for segment, child in node.items():
+        if segment is None:
+          values.extend(child)
+        else:
+          stack.append(child)
+    return values
+
 class DependencyTracker:
   def __init__(self, include_paths):
     self.include_paths = set(include_paths)
     self.dependent_paths = set()
+    self._included = PathTrie()
+    for path in self.include_paths:
+      self._included.add(path, path)
 
   def path_included(self, path):
-    for include_path in self.include_paths | self.dependent_paths:
-      if subsumes(include_path, path):
-        return True
-    return False
+    return self._included.has_ancestor(path)
 
   def include_missing_copies(self, path_copies):
-    while True:
-      log("Cross-checking %d included paths with %d copies "
-          "for missing path dependencies..." % (
-            len(self.include_paths) + len(self.dependent_paths),
-            len(path_copies)),
-          1)
-      included_copies = []
-      for path, copyfrom_path in path_copies:
-        if self.path_included(path):
-          log("Adding copy '%s' -> '%s'" % (copyfrom_path, path), 1)
+    log("Cross-checking %d included paths with %d copies "
+        "for missing path dependencies..." % (
+          len(self.include_paths) + len(self.dependent_paths),
+          len(path_copies)),
+        1)
+
+    # Index the copies by their destination, so that those made to an
+    # included path, or below it, can be found (and taken out, as they
+    # need not be looked at again) in one go.
+    copies = PathTrie()
+    for path, copyfrom_path in path_copies:
+      copies.add(path, (path, copyfrom_path))
+
+    # Every path included makes the sources of the copies below it
+    # included too, which may in turn pull in more copies.
+    worklist = list(self.include_paths | self.dependent_paths)
+    while worklist:
+      for path, copyfrom_path in copies.pop_subtree(worklist.pop()):
+        log("Adding copy '%s' -> '%s'" % (copyfrom_path, path), 1)
+        path_copies.discard((path, copyfrom_path))
+        if copyfrom_path not in self.dependent_paths:
           self.dependent_paths.add(copyfrom_path)
-          included_copies.append((path, copyfrom_path))
-      if not included_copies:
-        log("Found all missing path dependencies", 1)
-        break
-      for path, copyfrom_path in included_copies:
-        path_copies.remove((path, copyfrom_path))
-      log("Found %d new copy dependencies, need to re-check for more"
-        % len(included_copies), 1)
+          self._included.add(copyfrom_path, copyfrom_path)
+          worklist.append(copyfrom_path)
+    log("Found all missing path dependencies", 1)
 
 def readline(stream):
   line = stream.readline()
@@ -159,7 +213,96 @@ def readline(stream):
   log(line, 2)
   return line
 
+class _PrefixedStream:
+  """A file-like object returning PREFIX, then the rest of STREAM."""
+
+  def __init__(self, prefix, stream):
+    self.prefix = prefix
+    self.stream = stream
+
+  def read(self, size=-1):
+    if not self.prefix:
+      return self.stream.read(size)
+    if size < 0:
+      data, self.prefix = self.prefix + self.stream.read(), ''
+    else:
+      data, self.prefix = self.prefix[:size], self.prefix[size:]
+    return data
+
+class _PrefixedLineStream:
+  """A file-like object returning LINE, then the lines of STREAM."""
+
+  def __init__(self, line, stream):
+    self.line = line
+    self.stream = stream
+
+  def readline(self):
+    if self.line is None:
+      return self.stream.readline()
+    line, self.line = self.line, None
+    return line
+
 def svn_log_stream_get_dependencies(stream, included_paths):
+  # Tell 'svn log --xml' output from the plain text format by its
+  # first line.
+  first_line = stream.readline()
+  if first_line.startswith('<'):
+    return svn_log_xml_stream_get_dependencies(
+      _PrefixedStream(first_line, stream), included_paths)
+  return svn_log_text_stream_get_dependencies(
+    _PrefixedLineStream(first_line, stream), included_paths)
+
+def svn_log_xml_stream_get_dependencies(stream, included_paths):
+  """Like svn_log_text_stream_get_dependencies(), for the output of
+  'svn log -v --xml'.  The log is parsed incrementally, one log entry at
+  a time."""
+  try:
+    import xml.etree.cElementTree as ElementTree
+  except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+  dt = DependencyTracker(included_paths)
+  last_revision = 0
+  path_copies = set()
+  found_changed_path = False
+
+  root = None
+  try:
+    for event, elem in ElementTree.iterparse(stream, ('start', 'end')):
+      if root is None:
+        root = elem
+      if event != 'end' or elem.tag != 'logentry':
+        continue
+      revision = int(elem.get('revision'))
+      if last_revision and revision >= last_revision:
+        raise LogStreamError("Revisions are misordered.  Make sure log "
+                             "stream is from 'svn log' with the youngest "
+                             "revisions before the oldest ones (the default "
+                             "ordering).")
+      log("Parsing revision %d" % (revision), 1)
+      last_revision = revision
+
+      for path_elem in elem.iter('path'):
+        found_changed_path = True
+        copyfrom_path = path_elem.get('copyfrom-path')
+        if copyfrom_path is not None:
+          path_copies.add((sanitize_path(path_elem.text or ''),
+                           sanitize_path(copyfrom_path)))
+
+      # Only the copies are needed from here on.
+      root.clear()
+  except SyntaxError as e:
+    raise LogStreamError("Invalid XML log stream: %s" % (e))
+
+  if not found_changed_path:
+    raise LogStreamError("No changed paths found; did you remember to run "
+                         "'svn log' with the --verbose (-v) option when "
+                         "generating the input to this script?")
+
+  dt.include_missing_copies(path_copies)
+  return dt
+
+def svn_log_text_stream_get_dependencies(stream, included_paths):
   import re
 
   dt = DependencyTracker(included_paths)
@@ -60,29 +60,41 @@ def svnlook_changed(repo, revision):
         changed[filename] = {'flags': flags}
     return changed
 
-def do_put(body):
+def do_put(body, content_type='application/json'):
     opener = urllib2.build_opener(urllib2.HTTPHandler)
     request = urllib2.Request("http://%s:%d/commits" %(HOST, PORT), data=body)
-    request.add_header('Content-Type', 'application/json')
+    request.add_header('Content-Type', content_type)
     request.get_method = lambda: 'PUT'
     url = opener.open(request)
 
 
-def main(repo, revision):
-    revision = revision.lstrip('r')
+def commit_data(repo, uuid, revision):
     i = svnlook_info(repo, revision)
     data = {'type': 'svn',
             'format': 1,
             'id': int(revision),
             'changed': {},
-            'repository': svnlook_uuid(repo),
+            'repository': uuid,
             'committer': i['author'],
             'log': i['log'],
             'date': i['date'],
             }
     data['changed'].update(svnlook_changed(repo, revision))
-    body = json.dumps(data)
-    do_put(body)
+    return data
+
+def main(repo, revision):
+    """Publish REVISION of REPO.  REVISION may also be a range FIRST:LAST,
+    e.g. from svnsync or a bulk load, in which case all the revisions are
+    sent to the server in a single batch."""
+    uuid = svnlook_uuid(repo)
+    if ':' in revision:
+        first, last = [int(r.lstrip('r')) for r in revision.split(':', 1)]
+        bodies = [json.dumps(commit_data(repo, uuid, str(rev)))
+                  for rev in range(first, last + 1)]
+        do_put("\n".join(bodies) + "\n", 'application/x-ndjson')
+    else:
+        revision = revision.lstrip('r')
+        do_put(json.dumps(commit_data(repo, uuid, revision)))
 
 if __name__ == "__main__":
     if len(sys.argv) not in (3, 4):
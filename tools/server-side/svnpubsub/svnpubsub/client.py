@@ -161,6 +161,9 @@ class JSONRecordHandler:
       self.commit_callback(commit)
     elif 'stillalive' in obj:
       self.event_callback('ping', obj['stillalive'])
+    elif 'dropped' in obj:
+      # The server dropped this many records because we fell behind.
+      self.event_callback('dropped', obj['dropped'])
     elif 'metadata' in obj and self.metadata_callback:
       metadata = Metadata(obj['metadata'])
       self.metadata_callback(metadata)
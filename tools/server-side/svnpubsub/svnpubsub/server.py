@@ -51,9 +51,26 @@
 #   messages about that repository.  The repository can be * and then you
 #   will receive messages about all repositories.
 #
+#   A reconnecting client can add a "since" query parameter holding the id
+#   (revision) of the last notification it saw.  The server keeps the most
+#   recent REPLAY_SIZE notifications of each repository, and sends those
+#   that followed that id before the live stream starts.  Ids are only
+#   meaningful within a repository, so "since" needs a repository in the
+#   URL; it is refused for all repositories (*):
+#
+#   curl -sN 'http://127.0.0.1:2069/commits/svn/13f79535-47bb-0310-9956-ffa450edef68?since=1234'
+#
+# Server statistics (subscribers, rates, queues, fan-out latency):
+#   curl -s  http://127.0.0.1:2069/stats
+#
 # Example Pub clients:
 #   curl -T revinfo.json -i http://127.0.0.1:2069/commits
 #
+#   Several notifications can be published at once by sending one JSON
+#   object per line with a content type of application/x-ndjson:
+#
+#   curl -T revs.ndjson -H 'Content-Type: application/x-ndjson' -i http://127.0.0.1:2069/commits
+#
 # TODO:
 #   - Add Real access controls (not just 127.0.0.1)
 #   - Document PUT format
@@ -72,11 +89,16 @@ import sys
 import twisted
 from twisted.internet import reactor
 from twisted.internet import defer
+from twisted.internet import interfaces
 from twisted.web import server
 from twisted.web import resource
 from twisted.python import log
+from zope.interface import implementer
 
 import time
+import bisect
+import collections
+import itertools
 
 class Notification(object):
     def __init__(self, r):
@@ -99,6 +121,10 @@ class Notification(object):
     def render_log(self):
         raise NotImplementedError
 
+    def render_stream(self):
+        """Return the record exactly as it is written to subscribers."""
+        return str(self.render() + "\n\0")
+
 class Commit(Notification):
     KIND = 'COMMIT'
 
@@ -132,6 +158,68 @@ class Metadata(Notification):
 
 HEARTBEAT_TIME = 15
 
+# Number of recent notifications kept per repository for replaying to
+# clients that reconnect with a "since" parameter.
+REPLAY_SIZE = 500
+
+# While the transport of a client is full, records are queued per client.
+# Once more than QUEUE_HIGH_WATER bytes are waiting the client is a slow
+# consumer and SLOW_CONSUMER_POLICY applies: 'disconnect' evicts it, while
+# 'drop' discards its oldest queued records until QUEUE_LOW_WATER is
+# reached, and then tells the client how many it lost with a
+# {"dropped": N} record ahead of the rest.  Heartbeats are never queued.
+QUEUE_HIGH_WATER = 256 * 1024
+QUEUE_LOW_WATER = 64 * 1024
+SLOW_CONSUMER_POLICY = 'disconnect'
+
+# Content type of a PUT carrying several notifications, one per line.
+BATCH_CONTENT_TYPE = 'application/x-ndjson'
+
+# Upper bounds, in milliseconds, of the fan-out latency histogram buckets.
+LATENCY_BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+# Number of seconds over which the recent notification rate is averaged.
+RATE_WINDOW = 60
+
+class Stats(object):
+    "Counters shared by all clients of the server."
+    def __init__(self):
+        self.started = time.time()
+        self.queued_bytes = 0
+        self.evictions = 0
+        # Number of times records were dropped for a slow consumer, and
+        # the number of records dropped.
+        self.drops = 0
+        self.dropped_records = 0
+        self.dropped_heartbeats = 0
+        self.bytes_written = 0
+        self.notifications = 0
+        # Notifications per second over the last RATE_WINDOW seconds,
+        # as [second, count] pairs.
+        self.recent = collections.deque(maxlen=RATE_WINDOW)
+        # One count per LATENCY_BUCKETS entry, plus one for anything slower.
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def published(self, count, started):
+        """Record that COUNT notifications, received at time STARTED, have
+        been written to every interested client."""
+        now = time.time()
+        self.notifications += count
+        second = int(now)
+        if self.recent and self.recent[-1][0] == second:
+            self.recent[-1][1] += count
+        else:
+            self.recent.append([second, count])
+        self.latency[bisect.bisect_left(LATENCY_BUCKETS,
+                                        (now - started) * 1000)] += 1
+
+    def rate(self):
+        "Return the notifications per second over the last RATE_WINDOW."
+        horizon = time.time() - RATE_WINDOW
+        return float(sum(count for second, count in self.recent
+                         if second > horizon)) / RATE_WINDOW
+
+@implementer(interfaces.IPushProducer)
 class Client(object):
     def __init__(self, pubsub, r, kind, type, repository):
         self.pubsub = pubsub
@@ -141,28 +229,31 @@ class Client(object):
         self.type = type
         self.repository = repository
         self.alive = True
+        self.paused = False
+        self.queue = collections.deque()
+        self.queued = 0
+        # Records dropped from the front of the queue since the client
+        # last caught up.
+        self.dropped = 0
+        # Let the transport tell us when it cannot take any more data.
+        r.registerProducer(self, True)
         log.msg("OPEN: %s:%d (%d clients online)"% (r.getClientIP(), r.client.port, pubsub.cc()+1))
 
     def finished(self, reason):
         self.alive = False
+        self.discard_queue()
+        # Twisted has already dropped the request's channel if the
+        # connection was lost, leaving only the request's reference.
+        if getattr(self.r, 'channel', None) is not None:
+            self.r.unregisterProducer()
+        else:
+            self.r.producer = None
         log.msg("CLOSE: %s:%d (%d clients online)"% (self.r.getClientIP(), self.r.client.port, self.pubsub.cc()))
         try:
             self.pubsub.remove(self)
         except ValueError:
             pass
 
-    def interested_in(self, notification):
-        if self.kind != notification.KIND:
-            return False
-
-        if self.type and self.type != notification.type:
-            return False
-
-        if self.repository and self.repository != notification.repository:
-            return False
-
-        return True
-
     def notify(self, data):
         self.write(data)
 
@@ -178,9 +269,13 @@ class Client(object):
     def write_data(self, data):
         self.write(data + "\n\0")
 
+    def write_stream(self, data):
+        """Write a record already rendered by Notification.render_stream()."""
+        self.send(data)
+
     """ "Data must not be unicode" is what the interfaces.ITransport says... grr. """
     def write(self, input):
-        self.r.write(str(input))
+        self.send(str(input))
 
     def write_start(self):
         self.r.setHeader('X-SVNPubSub-Version', '1')
@@ -188,12 +283,148 @@ class Client(object):
         self.write('{"svnpubsub": {"version": 1}}\n\0')
 
     def write_heartbeat(self):
-        self.write(json.dumps({"stillalive": time.time()}) + "\n\0")
+        # A heartbeat is pointless if the client has not read what came
+        # before it, so drop it rather than adding to the queue.
+        self.send(json.dumps({"stillalive": time.time()}) + "\n\0",
+                  droppable=True)
+
+    def send(self, data, droppable=False):
+        "Write DATA to the transport, or queue it while the client is paused."
+        if not self.alive:
+            return
+        if not self.paused and not self.queue:
+            self.r.write(data)
+            self.pubsub.stats.bytes_written += len(data)
+            return
+        stats = self.pubsub.stats
+        if droppable:
+            stats.dropped_heartbeats += 1
+            return
+        self.queue.append(data)
+        self.queued += len(data)
+        stats.queued_bytes += len(data)
+        if self.queued > QUEUE_HIGH_WATER:
+            self.overflow()
+
+    def overflow(self):
+        stats = self.pubsub.stats
+        if SLOW_CONSUMER_POLICY == 'drop':
+            dropped = 0
+            while self.queued > QUEUE_LOW_WATER:
+                data = self.queue.popleft()
+                self.queued -= len(data)
+                stats.queued_bytes -= len(data)
+                # A batch is queued as one write of several records.
+                dropped += data.count('\0')
+            self.dropped += dropped
+            stats.drops += 1
+            stats.dropped_records += dropped
+            log.msg("DROP: %s:%d (%d records dropped, %d bytes queued)"
+                    % (self.r.getClientIP(), self.r.client.port, dropped,
+                       self.queued))
+            return
+
+        stats.evictions += 1
+        log.msg("EVICT: %s:%d (%d bytes queued)"
+                % (self.r.getClientIP(), self.r.client.port, self.queued))
+        self.alive = False
+        self.discard_queue()
+        # finished() will be called back as the connection goes down.
+        self.r.transport.loseConnection()
+
+    def discard_queue(self):
+        self.pubsub.stats.queued_bytes -= self.queued
+        self.queue.clear()
+        self.queued = 0
+
+    # IPushProducer
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        if self.queue and self.alive:
+            # Coalesce everything that piled up into a single write,
+            # after a marker for any records dropped before it.
+            data = ''.join(self.queue)
+            if self.dropped:
+                data = json.dumps({"dropped": self.dropped}) + "\n\0" + data
+                self.dropped = 0
+            self.discard_queue()
+            self.r.write(data)
+            self.pubsub.stats.bytes_written += len(data)
+
+    def stopProducing(self):
+        self.alive = False
+        self.discard_queue()
+
+
+class Subscribers(object):
+    """The set of connected Clients, indexed by what they subscribed to.
+
+    Clients are bucketed on (kind, type, repository), where a type or
+    repository of None is the wildcard.  A notification can only match
+    four buckets, so finding its subscribers costs a few dict lookups
+    plus the number of interested clients, no matter how many other
+    clients are connected."""
+
+    def __init__(self):
+        self.__buckets = {}
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    @staticmethod
+    def key(client):
+        return (client.kind, client.type or None, client.repository or None)
+
+    def add(self, client):
+        self.__buckets.setdefault(self.key(client), set()).add(client)
+        self.__count += 1
+
+    def remove(self, client):
+        "Remove CLIENT; raise ValueError if it is not subscribed."
+        key = self.key(client)
+        bucket = self.__buckets.get(key)
+        if not bucket or client not in bucket:
+            raise ValueError('client not subscribed')
+        bucket.remove(client)
+        if not bucket:
+            del self.__buckets[key]
+        self.__count -= 1
+
+    def __iter__(self):
+        for bucket in self.__buckets.values():
+            for client in bucket:
+                yield client
+
+    def counts(self):
+        "Return a dict mapping (kind, type, repository) to a client count."
+        return dict((key, len(bucket))
+                    for key, bucket in self.__buckets.items())
+
+    def matching(self, notification):
+        "Return a list of the clients interested in NOTIFICATION."
+        kind = notification.KIND
+        type = notification.type
+        repository = notification.repository
+        matches = []
+        for key in ((kind, type, repository),
+                    (kind, None, repository),
+                    (kind, type, None),
+                    (kind, None, None)):
+            bucket = self.__buckets.get(key)
+            if bucket:
+                # Copy, as writing may cause a client to go away.
+                matches.extend(bucket)
+        return matches
 
 
 class SvnPubSub(resource.Resource):
     isLeaf = True
-    clients = []
+    clients = Subscribers()
+    stats = Stats()
 
     __notification_uri_map = {'commits': Commit.KIND,
                               'metadata': Metadata.KIND}
@@ -201,6 +432,54 @@ class SvnPubSub(resource.Resource):
     def __init__(self, notification_class):
         resource.Resource.__init__(self)
         self.__notification_class = notification_class
+        # Repository -> deque of (sequence, notification, data), oldest first.
+        self.__backlog = {}
+        self.__sequence = itertools.count()
+
+    def remember(self, notification, data):
+        "Append NOTIFICATION, rendered as DATA, to its repository's backlog."
+        backlog = self.__backlog.get(notification.repository)
+        if backlog is None:
+            backlog = collections.deque(maxlen=REPLAY_SIZE)
+            self.__backlog[notification.repository] = backlog
+        backlog.append((next(self.__sequence), notification, data))
+
+    def replay(self, client, since):
+        """Write to CLIENT the remembered notifications of its repository
+        that it is interested in and that followed the notification with
+        id SINCE, in publishing order.  CLIENT must name a repository, as
+        ids are only meaningful within one.
+
+        Numeric ids are taken to be revisions, so anything with a higher id
+        is replayed.  Otherwise everything after the notification with the
+        matching id is sent, or the whole backlog if it is no longer known."""
+        assert client.repository is not None
+        try:
+            since_rev = int(since)
+        except ValueError:
+            since_rev = None
+
+        backlog = [e for e in self.__backlog.get(client.repository, ())
+                   if e[1].KIND == client.kind
+                   and (not client.type or client.type == e[1].type)]
+        if since_rev is not None:
+            entries = []
+            for entry in backlog:
+                try:
+                    if int(entry[1].id) > since_rev:
+                        entries.append(entry)
+                except ValueError:
+                    pass
+        else:
+            entries = backlog
+            ids = [str(e[1].id) for e in backlog]
+            if since in ids:
+                # Skip up to and including the last sighting of SINCE.
+                entries = backlog[len(ids) - ids[::-1].index(since):]
+
+        for _, _, data in entries:
+            client.write_stream(data)
+        return len(entries)
 
     def cc(self):
         return len(self.clients)
@@ -215,7 +494,7 @@ class SvnPubSub(resource.Resource):
         repository = None
         type = None
 
-        uri = request.uri.split('/')
+        uri = request.path.split('/')
         uri_len = len(uri)
         if uri_len < 2 or uri_len > 4:
             request.setResponseCode(400)
@@ -232,27 +511,62 @@ class SvnPubSub(resource.Resource):
         if uri_len == 4:
           repository = uri[3]
 
-        # Convert wild card to None.
-        if type == '*':
+        # Convert wild card, or an empty path component, to None.
+        if type in ('*', ''):
           type = None
-        if repository == '*':
+        if repository in ('*', ''):
           repository = None
 
+        since = request.args.get('since', [None])[0]
+        if since and repository is None:
+            request.setResponseCode(400)
+            return "'since' needs a repository\n"
+
         c = Client(self, request, kind, type, repository)
-        self.clients.append(c)
         c.start()
+        if since:
+            log.msg("REPLAY: %d notifications since '%s'"
+                    % (self.replay(c, since), since))
+        self.clients.add(c)
         return twisted.web.server.NOT_DONE_YET
 
     def notifyAll(self, notification):
-        data = notification.render()
-
-        log.msg("%s: %s (%d clients)"
-                % (notification.KIND, notification.render_log(), self.cc()))
-        for client in self.clients:
-            if client.interested_in(notification):
-                client.write_data(data)
+        self.notifyBatch([notification])
+
+    def notifyBatch(self, notifications, started=None):
+        """Publish NOTIFICATIONS, in order, making a single write to each
+        client interested in any of them.  STARTED is when they were
+        received, for the fan-out latency statistics."""
+        if started is None:
+            started = time.time()
+        pending = {}
+        for notification in notifications:
+            # Render once; every subscriber is handed the same buffer.
+            data = notification.render_stream()
+            self.remember(notification, data)
+            interested = self.clients.matching(notification)
+
+            log.msg("%s: %s (%d clients, %d interested, %d bytes queued, "
+                    "%d evicted)"
+                    % (notification.KIND, notification.render_log(),
+                       self.cc(), len(interested), self.stats.queued_bytes,
+                       self.stats.evictions))
+            for client in interested:
+                records = pending.get(client)
+                if records is None:
+                    pending[client] = [data]
+                else:
+                    records.append(data)
+
+        for client, records in pending.items():
+            if len(records) == 1:
+                client.write_stream(records[0])
+            else:
+                client.write_stream(''.join(records))
+        self.stats.published(len(notifications), started)
 
     def render_PUT(self, request):
+        started = time.time()
         request.setHeader('content-type', 'text/plain')
         ip = request.getClientIP()
         if ip != "127.0.0.1":
@@ -261,24 +575,90 @@ class SvnPubSub(resource.Resource):
         input = request.content.read()
         #import pdb;pdb.set_trace()
         #print "input: %s" % (input)
+
+        # A batch is newline-delimited JSON, one notification per line.
+        # Nothing is published unless every line is valid.
+        content_type = request.getHeader('content-type') or ''
+        if content_type.split(';')[0].strip() == BATCH_CONTENT_TYPE:
+            records = [line for line in input.split('\n') if line.strip()]
+        else:
+            records = [input]
         try:
-            data = json.loads(input)
-            notification = self.__notification_class(data)
+            notifications = [self.__notification_class(json.loads(record))
+                             for record in records]
         except ValueError as e:
             request.setResponseCode(400)
             errstr = str(e)
-            log.msg("%s: failed due to: %s" % (notification.KIND, errstr))
+            log.msg("%s: failed due to: %s"
+                    % (self.__notification_class.KIND, errstr))
             return errstr
-        self.notifyAll(notification)
+        self.notifyBatch(notifications, started)
         return "Ok"
 
 
+class SvnPubSubStats(resource.Resource):
+    """Report the state of the server as a JSON object:
+
+      clients        subscriber count by kind, then type, then repository,
+                     where '*' is the wildcard
+      notifications  total published, and the rate per second over the
+                     last RATE_WINDOW seconds
+      bytes_written  total bytes written to clients
+      queues         bytes queued for paused clients, the number of paused
+                     clients and the deepest queue, plus the slow-consumer
+                     eviction and drop counters (drops is the number of
+                     times records were dropped, dropped_records how many)
+      latency        histogram of the time from receiving a PUT until the
+                     last write to an interested client, keyed by the
+                     upper bound of each bucket in milliseconds
+    """
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'application/json')
+        clients = SvnPubSub.clients
+        stats = SvnPubSub.stats
+
+        subscribers = {}
+        for (kind, type, repository), count in clients.counts().items():
+            subscribers.setdefault(kind, {}) \
+                       .setdefault(type or '*', {})[repository or '*'] = count
+
+        paused = 0
+        deepest = 0
+        for client in clients:
+            if client.paused:
+                paused += 1
+            deepest = max(deepest, client.queued)
+
+        latency = {}
+        for bound, count in zip(LATENCY_BUCKETS + ('inf',), stats.latency):
+            latency[str(bound)] = count
+
+        return json.dumps({
+            'uptime': time.time() - stats.started,
+            'clients': {'total': len(clients), 'subscribed': subscribers},
+            'notifications': {'total': stats.notifications,
+                              'per_second': stats.rate()},
+            'bytes_written': stats.bytes_written,
+            'queues': {'queued_bytes': stats.queued_bytes,
+                       'paused_clients': paused,
+                       'deepest': deepest,
+                       'evictions': stats.evictions,
+                       'drops': stats.drops,
+                       'dropped_records': stats.dropped_records,
+                       'dropped_heartbeats': stats.dropped_heartbeats},
+            'latency': latency,
+            }) + "\n"
+
+
 def svnpubsub_server():
     root = resource.Resource()
     c = SvnPubSub(Commit)
     m = SvnPubSub(Metadata)
     root.putChild('commits', c)
     root.putChild('metadata', m)
+    root.putChild('stats', SvnPubSubStats())
     return server.Site(root)
 
 if __name__ == "__main__":
@@ -25,7 +25,9 @@
 #  svnwcsub.py svnwcsub.conf
 #
 # On startup svnwcsub checks the working copy's path, runs a single svn update
-# and then watches for changes to that path.
+# and then watches for changes to that path.  The changed paths of each commit
+# are looked up in a trie of the watched working copies' repository paths, and
+# the working copies affected are updated by a pool of worker threads.
 #
 # See svnwcsub.conf for more information on its contents.
 #
@@ -35,10 +37,8 @@
 # - fold BigDoEverythingClasss ("BDEC") into Daemon
 # - fold WorkingCopy._get_match() into __init__
 # - remove wc_ready(). assume all WorkingCopy instances are usable.
-#   place the instances into .watch at creation. the .update_applies()
-#   just returns if the wc is disabled (eg. could not find wc dir)
-# - figure out way to avoid the ASF-specific PRODUCTION_RE_FILTER
-#   (a base path exclusion list should work for the ASF)
+#   place the instances into .watch and the WorkingCopyTrie at creation,
+#   skipping a wc that is disabled (eg. could not find wc dir)
 # - add support for SIGHUP to reread the config and reinitialize working copies
 # - joes will write documentation for svnpubsub as these items become fulfilled
 # - make LOGLEVEL configurable
@@ -49,7 +49,6 @@ import threading
 import sys
 import stat
 import os
-import re
 import posixpath
 try:
   import ConfigParser
@@ -61,6 +60,10 @@ try:
   import Queue
 except ImportError:
   import queue as Queue
+try:
+  import sqlite3
+except ImportError:
+  sqlite3 = None
 import optparse
 import functools
 try:
@@ -123,38 +126,48 @@ except (ImportError, AttributeError):
         # This will read the entire directory list to memory.
         return not os.listdir(path)
 
+def wc_needs_cleanup(path):
+    """Return True if the working copy at PATH holds locks or unfinished
+    work items, as left behind by an interrupted operation."""
+    dotsvn = os.path.join(path, '.svn')
+    if os.path.exists(os.path.join(dotsvn, 'lock')):
+        # Pre-1.7 working copy format.
+        return True
+    wcdb = os.path.join(dotsvn, 'wc.db')
+    if not os.path.exists(wcdb):
+        return False
+    if sqlite3 is None:
+        # Can't tell, so assume the worst.
+        return True
+    try:
+        conn = sqlite3.connect(wcdb)
+        try:
+            rows = conn.execute('SELECT 1 FROM WC_LOCK UNION ALL '
+                                'SELECT 1 FROM WORK_QUEUE LIMIT 1').fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return True
+    return len(rows) > 0
+
 class WorkingCopy(object):
     def __init__(self, bdec, path, url):
         self.path = path
         self.url = url
 
+        # Set when an operation on the WC fails, so that the next update
+        # runs 'svn cleanup' first.  We know nothing about the WC yet.
+        self.needs_cleanup = True
+        # Seconds taken by the latest cleanup and update.
+        self.cleanup_time = None
+        self.update_time = None
+
         try:
             self.match, self.uuid = self._get_match(bdec.svnbin, bdec.env)
             bdec.wc_ready(self)
         except:
             logging.exception('problem with working copy: %s', path)
 
-    def update_applies(self, uuid, path):
-        if self.uuid != uuid:
-            return False
-
-        path = str(path)
-        if path == self.match:
-            #print "ua: Simple match"
-            # easy case. woo.
-            return True
-        if len(path) < len(self.match):
-            # path is potentially a parent directory of match?
-            #print "ua: parent check"
-            if self.match[0:len(path)] == path:
-                return True
-        if len(path) > len(self.match):
-            # path is potentially a sub directory of match
-            #print "ua: sub dir check"
-            if path[0:len(self.match)] == self.match:
-                return True
-        return False
-
     def _get_match(self, svnbin, env):
         ### quick little hack to auto-checkout missing working copies
         dotsvn = os.path.join(self.path, ".svn")
@@ -177,7 +190,45 @@ class WorkingCopy(object):
         return str(relpath), uuid
 
 
-PRODUCTION_RE_FILTER = re.compile("/websites/production/[^/]+/")
+class WorkingCopyTrie(object):
+    """The working copies of one repository, arranged in a trie on the
+    path segments of their repository paths (WorkingCopy.match).
+
+    Each node is a (children, wcs) pair, where CHILDREN maps a path
+    segment to the next node and WCS lists the working copies of the
+    path spelled out by the segments leading to the node."""
+
+    def __init__(self):
+        self.root = ({ }, [ ])
+
+    def add(self, wc):
+        node = self.root
+        for segment in self._segments(wc.match):
+            node = node[0].setdefault(segment, ({ }, [ ]))
+        node[1].append(wc)
+
+    def find(self, path, found):
+        """Add to the set FOUND every working copy that PATH lies within,
+        and, if PATH is a directory above some working copies, those."""
+        node = self.root
+        found.update(node[1])
+        for segment in self._segments(path):
+            node = node[0].get(segment)
+            if node is None:
+                return
+            found.update(node[1])
+
+        # Everything below PATH is affected too.
+        stack = list(node[0].values())
+        while stack:
+            children, wcs = stack.pop()
+            found.update(wcs)
+            stack.extend(children.values())
+
+    @staticmethod
+    def _segments(path):
+        return [segment for segment in path.split('/') if segment]
+
 
 class BigDoEverythingClasss(object):
     def __init__(self, config):
@@ -186,19 +237,42 @@ class BigDoEverythingClasss(object):
         self.tracking = config.get_track()
         self.hook = config.get_optional_value('hook')
         self.streams = config.get_value('streams').split()
-        self.worker = BackgroundWorker(self.svnbin, self.env, self.hook)
+        self.cleanup_interval = float(config.get_optional_value(
+            'cleanup_interval', 0))
+        self.worker = BackgroundWorker(self.svnbin, self.env, self.hook,
+                                       config.get_workers(),
+                                       float(config.get_optional_value(
+                                           'debounce', 0)))
         self.watch = [ ]
+        # Repository UUID -> WorkingCopyTrie of the watched WCs
+        self.tries = { }
 
     def start(self):
         for path, url in self.tracking.items():
             # working copies auto-register with the BDEC when they are ready.
             WorkingCopy(self, path, url)
 
+        if self.cleanup_interval:
+            t = threading.Thread(target=self._periodic_cleanup,
+                                 name='svnwcsub-cleanup')
+            t.setDaemon(True)
+            t.start()
+
+    def _periodic_cleanup(self):
+        # Updates only clean up WCs known to need it, so sweep now and then
+        # for anything that slipped through.
+        while True:
+            time.sleep(self.cleanup_interval)
+            logging.info("scheduling cleanup of %d WC", len(self.watch))
+            for wc in list(self.watch):
+                self.worker.add_work(OP_CLEANUP, wc)
+
     def wc_ready(self, wc):
         # called when a working copy object has its basic info/url,
         # Add it to our watchers, and trigger an svn update.
         logging.info("Watching WC at %s <-> %s" % (wc.path, wc.url))
         self.watch.append(wc)
+        self.tries.setdefault(wc.uuid, WorkingCopyTrie()).add(wc)
         self.worker.add_work(OP_BOOT, wc)
 
     def _normalize_path(self, path):
@@ -214,23 +288,20 @@ class BigDoEverythingClasss(object):
         logging.info("COMMIT r%d (%d paths) from %s"
                      % (commit.id, len(commit.changed), url))
 
-        paths = map(self._normalize_path, commit.changed)
-        if len(paths):
-            pre = posixpath.commonprefix(paths)
-            if pre == "/websites/":
-                # special case for svnmucc "dynamic content" buildbot commits
-                # just take the first production path to avoid updating all cms working copies
-                for p in paths:
-                    m = PRODUCTION_RE_FILTER.match(p)
-                    if m:
-                        pre = m.group(0)
-                        break
-
-            #print "Common Prefix: %s" % (pre)
-            wcs = [wc for wc in self.watch if wc.update_applies(commit.repository, pre)]
+        trie = self.tries.get(commit.repository)
+        if trie is None:
+            return
+
+        # Match each changed path on its own, so that a commit touching
+        # two unrelated trees does not update everything in between.
+        wcs = set()
+        for path in commit.changed:
+            trie.find(self._normalize_path(str(path)), wcs)
+
+        if wcs:
             logging.info("Updating %d WC for r%d" % (len(wcs), commit.id))
             for wc in wcs:
-                self.worker.add_work(OP_UPDATE, wc)
+                self.worker.add_work(OP_UPDATE, wc, commit.id)
 
 
 # Start logging warnings if the work backlog reaches this many items
@@ -239,65 +310,155 @@ OP_BOOT = 'boot'
 OP_UPDATE = 'update'
 OP_CLEANUP = 'cleanup'
 
-class BackgroundWorker(threading.Thread):
-    def __init__(self, svnbin, env, hook):
-        threading.Thread.__init__(self)
+class BackgroundWorker(object):
+    """Run operations on working copies in a pool of WORKERS threads.
+
+    Operations on any one working copy are run one at a time, in the
+    order they were added, but different working copies are worked on
+    concurrently.  Each working copy with pending operations is on the
+    .ready queue at most once, and never while a thread is running one
+    of its operations.
 
-        # The main thread/process should not wait for this thread to exit.
-        ### compat with Python 2.5
-        self.setDaemon(True)
+    An update always brings a working copy to HEAD, so a request for an
+    update while an update or a boot (which updates too) is already
+    waiting is absorbed into it.  If DEBOUNCE
+    is non-zero, a newly queued update is held back for that many seconds
+    to absorb the rest of a burst of commits."""
 
+    def __init__(self, svnbin, env, hook, workers=1, debounce=0):
         self.svnbin = svnbin
         self.env = env
         self.hook = hook
-        self.q = Queue.Queue()
+        self.workers = workers
+        self.debounce = debounce
+
+        # Protects .pending, .revisions, .backlog, .absorbed and .has_started
+        self.lock = threading.Lock()
+        # WorkingCopy -> list of the operations waiting to be run on it
+        self.pending = { }
+        # WorkingCopy -> highest revision behind its waiting update
+        self.revisions = { }
+        self.backlog = 0
+        self.absorbed = 0
+        self.ready = Queue.Queue()
 
         self.has_started = False
 
+    def start(self):
+        for i in range(self.workers):
+            t = threading.Thread(target=self.run,
+                                 name='svnwcsub-worker-%d' % i)
+            # The main thread/process should not wait for this thread to exit.
+            ### compat with Python 2.5
+            t.setDaemon(True)
+            t.start()
+
     def run(self):
         while True:
             # This will block until something arrives
-            operation, wc = self.q.get()
+            wc = self.ready.get()
+            self.lock.acquire()
+            try:
+                operation = self.pending[wc].pop(0)
+                revision = None
+                if operation in (OP_UPDATE, OP_BOOT):
+                    revision = self.revisions.pop(wc, None)
+                self.backlog -= 1
+                backlog = self.backlog + 1
+            finally:
+                self.lock.release()
 
             # Warn if the queue is too long.
-            # (Note: the other thread might have added entries to self.q
-            # after the .get() and before the .qsize().)
-            qsize = self.q.qsize()+1
-            if operation != OP_BOOT and qsize > BACKLOG_TOO_HIGH:
-                logging.warn('worker backlog is at %d', qsize)
+            if operation != OP_BOOT and backlog > BACKLOG_TOO_HIGH:
+                logging.warn('worker backlog is at %d', backlog)
 
             try:
                 if operation == OP_UPDATE:
-                    self._update(wc)
+                    self._update(wc, revision=revision)
                 elif operation == OP_BOOT:
-                    self._update(wc, boot=True)
+                    self._update(wc, boot=True, revision=revision)
                 elif operation == OP_CLEANUP:
                     self._cleanup(wc)
                 else:
                     logging.critical('unknown operation: %s', operation)
             except:
                 logging.exception('exception in worker')
+                wc.needs_cleanup = True
 
-            # In case we ever want to .join() against the work queue
-            self.q.task_done()
-
-    def add_work(self, operation, wc):
-        # Start the thread when work first arrives. Thread-start needs to
-        # be delayed in case the process forks itself to become a daemon.
-        if not self.has_started:
-            self.start()
-            self.has_started = True
-
-        self.q.put((operation, wc))
+            # Hand the working copy to the next free thread if more work
+            # arrived for it while we were busy.
+            self.lock.acquire()
+            try:
+                if self.pending[wc]:
+                    self._schedule(wc)
+                else:
+                    del self.pending[wc]
+            finally:
+                self.lock.release()
+
+    def add_work(self, operation, wc, revision=None):
+        """Queue OPERATION on WC.  REVISION is the revision that prompted
+        an update, if known."""
+        self.lock.acquire()
+        try:
+            # Start the threads when work first arrives. Thread-start needs
+            # to be delayed in case the process forks itself to become a
+            # daemon. Work is added from several threads, so this is done
+            # under the lock.
+            if not self.has_started:
+                self.start()
+                self.has_started = True
+
+            operations = self.pending.get(wc)
+            if operation == OP_UPDATE:
+                if operations and (OP_UPDATE in operations
+                                   or OP_BOOT in operations):
+                    # The waiting update or boot will bring WC to HEAD,
+                    # which covers this request as well.
+                    self.absorbed += 1
+                    self._note_revision(wc, revision)
+                    return
+                self._note_revision(wc, revision)
+
+            self.backlog += 1
+            if operations is not None:
+                # Either queued already, or being worked on. Whoever runs
+                # its current operation will requeue it.
+                operations.append(operation)
+            else:
+                self.pending[wc] = [operation]
+                self._schedule(wc)
+        finally:
+            self.lock.release()
+
+    def _note_revision(self, wc, revision):
+        known = self.revisions.get(wc)
+        if known is None or (revision is not None and revision > known):
+            self.revisions[wc] = revision
+
+    def _schedule(self, wc):
+        "Make WC available to the threads. Must be called with .lock held."
+        if self.debounce and self.pending[wc][0] == OP_UPDATE:
+            # Let the update absorb whatever else arrives in the meantime.
+            t = threading.Timer(self.debounce, self.ready.put, (wc,))
+            t.setDaemon(True)
+            t.start()
+        else:
+            self.ready.put(wc)
 
-    def _update(self, wc, boot=False):
-        "Update the specified working copy."
+    def _update(self, wc, boot=False, revision=None):
+        """Update the specified working copy. REVISION is the highest
+        revision known to have prompted the update, for logging."""
 
-        # For giggles, let's clean up the working copy in case something
-        # happened earlier.
-        self._cleanup(wc)
+        # Clean up the working copy if something happened to it earlier.
+        if wc.needs_cleanup or wc_needs_cleanup(wc.path):
+            self._cleanup(wc)
 
-        logging.info("updating: %s", wc.path)
+        if revision is None:
+            logging.info("updating: %s", wc.path)
+        else:
+            logging.info("updating: %s for r%s (%d requests absorbed so far)",
+                         wc.path, revision, self.absorbed)
 
         ## Run the hook
         HEAD = svn_info(self.svnbin, self.env, wc.url)['Revision']
@@ -326,12 +487,15 @@ class BackgroundWorker(threading.Thread):
                 '--',
                 wc.url + '@' + HEAD,
                 wc.path]
+        started = time.time()
         check_call(args, env=self.env)
+        wc.update_time = time.time() - started
 
         ### check the loglevel before running 'svn info'?
         info = svn_info(self.svnbin, self.env, wc.path)
         assert info['Revision'] == HEAD
-        logging.info("updated: %s now at r%s", wc.path, info['Revision'])
+        logging.info("updated: %s now at r%s in %.1fs", wc.path,
+                     info['Revision'], wc.update_time)
 
         ## Run the hook
         if self.hook:
@@ -353,7 +517,11 @@ class BackgroundWorker(threading.Thread):
                 '--config-option',
                 'config:miscellany:use-commit-times=on',
                 wc.path]
+        started = time.time()
         check_call(args, env=self.env)
+        wc.cleanup_time = time.time() - started
+        wc.needs_cleanup = False
+        logging.info("cleaned up: %s in %.1fs", wc.path, wc.cleanup_time)
 
 
 class ReloadableConfig(ConfigParser.SafeConfigParser):
@@ -394,6 +562,13 @@ class ReloadableConfig(ConfigParser.SafeConfigParser):
                 env[name] = value
         return env
 
+    def get_workers(self):
+        "Return the number of worker threads, which must be at least 1."
+        workers = int(self.get_optional_value('workers', 1))
+        if workers < 1:
+            raise ValueError("'workers' must be at least 1, not %d" % workers)
+        return workers
+
     def get_track(self):
         "Return the {PATH: URL} dictionary of working copies to track."
         track = dict(self.items('track'))
@@ -541,7 +716,10 @@ def main(args):
     handle_options(options)
 
     c = ReloadableConfig(config_file)
-    bdec = BigDoEverythingClasss(c)
+    try:
+        bdec = BigDoEverythingClasss(c)
+    except ValueError as e:
+        parser.error('%s: %s' % (config_file, e))
 
     # We manage the logfile ourselves (along with possible rotation). The
     # daemon process can just drop stdout/stderr into /dev/null.
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Unit tests for svnpubsub.server's subscription matching, replay, slow
+# consumer handling, batches and statistics.  Run this without
+# arguments; Twisted must be installed.
+#
+
+import io
+import json
+import unittest
+
+from twisted.internet import defer
+
+from svnpubsub import server
+
+
+class FakeRequest(object):
+    "Just enough of a twisted.web request for SvnPubSub.render_GET."
+
+    class client(object):
+        port = 12345
+
+    class transport(object):
+        lost = False
+
+        @classmethod
+        def loseConnection(cls):
+            cls.lost = True
+
+    def __init__(self, path, since=None, content=None, content_type=None):
+        self.uri = self.path = path
+        self.args = {}
+        if since is not None:
+            self.args['since'] = [since]
+        self.content = io.StringIO(content)
+        self.content_type = content_type
+        self.code = 200
+        self.written = []
+        self.finish = defer.Deferred()
+        self.producer = None
+        self.transport = type('transport', (FakeRequest.transport,), {})
+
+    def notifyFinish(self):
+        return self.finish
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def getHeader(self, name):
+        if name.lower() == 'content-type':
+            return self.content_type
+        return None
+
+    def getClientIP(self):
+        return '127.0.0.1'
+
+    def setHeader(self, name, value):
+        pass
+
+    def setResponseCode(self, code):
+        self.code = code
+
+    def write(self, data):
+        self.written.append(data)
+
+
+def commit(repository, id, type='svn'):
+    return server.Commit({'repository': repository, 'type': type,
+                          'format': 1, 'id': id})
+
+
+class TestCase(unittest.TestCase):
+    def setUp(self):
+        server.SvnPubSub.clients = server.Subscribers()
+        server.SvnPubSub.stats = server.Stats()
+        self.pubsub = server.SvnPubSub(server.Commit)
+        self.saved = (server.QUEUE_HIGH_WATER, server.QUEUE_LOW_WATER,
+                      server.SLOW_CONSUMER_POLICY)
+
+    def tearDown(self):
+        (server.QUEUE_HIGH_WATER, server.QUEUE_LOW_WATER,
+         server.SLOW_CONSUMER_POLICY) = self.saved
+
+    def subscribe(self, path, since=None):
+        request = FakeRequest(path, since)
+        result = self.pubsub.render_GET(request)
+        return request, result
+
+    def test_empty_is_wildcard(self):
+        for path in ('/commits', '/commits/', '/commits//', '/commits/*/',
+                     '/commits//*'):
+            server.SvnPubSub.clients = server.Subscribers()
+            self.subscribe(path)
+            matches = self.pubsub.clients.matching(commit('repos1', 1))
+            self.assertEqual(len(matches), 1, path)
+        self.assertEqual(self.pubsub.clients.counts(),
+                         {('COMMIT', None, None): 1})
+
+    def test_since_needs_repository(self):
+        request, result = self.subscribe('/commits/svn/*', '3')
+        self.assertEqual(request.code, 400)
+        self.assertEqual(len(self.pubsub.clients), 0)
+
+    def test_replay_is_per_repository(self):
+        for repository, id in (('repos1', 5), ('repos2', 100),
+                               ('repos1', 6), ('repos2', 101)):
+            notification = commit(repository, id)
+            self.pubsub.remember(notification, notification.render_stream())
+        request, result = self.subscribe('/commits/svn/repos1', '5')
+        replayed = [x for x in request.written if '"id": 6' in x]
+        self.assertEqual(len(replayed), 1)
+        self.assertFalse([x for x in request.written if 'repos2' in x])
+
+    def fill_queue(self, count):
+        "Subscribe a paused client and publish COUNT commits to it."
+        server.QUEUE_HIGH_WATER = 1000
+        server.QUEUE_LOW_WATER = 300
+        request, result = self.subscribe('/commits/svn/repos1')
+        request.producer.pauseProducing()
+        for id in range(1, count + 1):
+            self.pubsub.notifyAll(commit('repos1', id))
+        return request
+
+    def test_evict(self):
+        request = self.fill_queue(20)
+        self.assertTrue(request.transport.lost)
+        self.assertEqual(self.pubsub.stats.evictions, 1)
+        self.assertEqual(self.pubsub.stats.queued_bytes, 0)
+        request.finish.errback(Exception('connection lost'))
+        self.assertEqual(request.producer, None)
+        self.assertEqual(len(self.pubsub.clients), 0)
+
+    def test_drop(self):
+        server.SLOW_CONSUMER_POLICY = 'drop'
+        request = self.fill_queue(20)
+        client = request.producer
+        self.assertFalse(request.transport.lost)
+        stats = self.pubsub.stats
+        self.assertTrue(stats.drops >= 1)
+        self.assertTrue(client.queued <= server.QUEUE_HIGH_WATER)
+        self.assertEqual(stats.queued_bytes, client.queued)
+
+        # The client is told how many records it lost, then gets the rest.
+        written = len(request.written)
+        client.resumeProducing()
+        self.assertEqual(len(request.written), written + 1)
+        records = [json.loads(x) for x in request.written[-1].split('\0')
+                   if x.strip()]
+        self.assertEqual(records[0], {'dropped': stats.dropped_records})
+        ids = [x['commit']['id'] for x in records[1:]]
+        self.assertEqual(ids, list(range(21 - len(ids), 21)))
+        self.assertEqual(len(ids) + stats.dropped_records, 20)
+        self.assertEqual(client.dropped, 0)
+
+    def test_batch(self):
+        request, result = self.subscribe('/commits/svn/repos1')
+        other, result = self.subscribe('/commits/svn/repos2')
+        started = len(request.written), len(other.written)
+        lines = [json.dumps({'repository': 'repos1', 'type': 'svn',
+                             'format': 1, 'id': id}) for id in (7, 8)]
+        put = FakeRequest('/commits', content='\n'.join(lines) + '\n',
+                          content_type=server.BATCH_CONTENT_TYPE)
+        self.assertEqual(self.pubsub.render_PUT(put), 'Ok')
+        # both commits in a single write, and nothing for repos2
+        self.assertEqual(len(request.written), started[0] + 1)
+        self.assertEqual(request.written[-1].count('\0'), 2)
+        self.assertEqual(len(other.written), started[1])
+        self.assertEqual(self.pubsub.stats.notifications, 2)
+
+        # a bad line rejects the whole batch
+        put = FakeRequest('/commits', content=lines[0] + '\n{"id": 9}\n',
+                          content_type=server.BATCH_CONTENT_TYPE)
+        self.pubsub.render_PUT(put)
+        self.assertEqual(put.code, 400)
+        self.assertEqual(len(request.written), started[0] + 1)
+
+    def test_stats(self):
+        self.subscribe('/commits/svn/repos1')
+        self.subscribe('/commits')
+        self.pubsub.notifyAll(commit('repos1', 1))
+        stats = json.loads(server.SvnPubSubStats().render_GET(
+            FakeRequest('/stats')))
+        self.assertEqual(stats['clients'],
+                         {'total': 2,
+                          'subscribed': {'COMMIT': {'svn': {'repos1': 1},
+                                                    '*': {'*': 1}}}})
+        self.assertEqual(stats['notifications']['total'], 1)
+        self.assertEqual(sum(stats['latency'].values()), 1)
+        self.assertEqual(stats['queues']['drops'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+#
+# Licensed to the Apache Software Foundation (ASF) under one or more
+# contributor license agreements.  See the NOTICE file distributed with
+# this work for additional information regarding copyright ownership.
+# The ASF licenses this file to You under the Apache License, Version 2.0
+# (the "License"); you may not use this file except in compliance with
+# the License.  You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#
+# Unit tests for svnwcsub's work queue and working copy matching, which
+# need neither svn nor a working copy.  Run this without arguments.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import svnwcsub
+
+
+class FakeWC(object):
+    def __init__(self, match):
+        self.match = match
+
+    def __repr__(self):
+        return 'FakeWC(%r)' % (self.match,)
+
+
+class WorkerTestCase(unittest.TestCase):
+    def worker(self, debounce=0):
+        worker = svnwcsub.BackgroundWorker('svn', {}, None, 1, debounce)
+        # Don't start any threads; the tests take work off .ready.
+        worker.has_started = True
+        return worker
+
+    def ready(self, worker):
+        wcs = []
+        while not worker.ready.empty():
+            wcs.append(worker.ready.get())
+        return wcs
+
+    def test_coalesce_updates(self):
+        worker = self.worker()
+        wc, other = FakeWC('/a'), FakeWC('/b')
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 5)
+        worker.add_work(svnwcsub.OP_UPDATE, other, 6)
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 7)
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 6)
+        self.assertEqual(self.ready(worker), [wc, other])
+        self.assertEqual(worker.pending[wc], [svnwcsub.OP_UPDATE])
+        self.assertEqual(worker.revisions[wc], 7)
+        self.assertEqual(worker.absorbed, 2)
+        self.assertEqual(worker.backlog, 2)
+
+    def test_boot_absorbs_update(self):
+        worker = self.worker()
+        wc = FakeWC('/a')
+        worker.add_work(svnwcsub.OP_BOOT, wc)
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 5)
+        self.assertEqual(self.ready(worker), [wc])
+        self.assertEqual(worker.pending[wc], [svnwcsub.OP_BOOT])
+        self.assertEqual(worker.revisions[wc], 5)
+        self.assertEqual(worker.absorbed, 1)
+
+        # Once the boot is running, an update has to be queued after it.
+        worker.pending[wc].pop(0)
+        worker.revisions.pop(wc)
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 6)
+        self.assertEqual(worker.pending[wc], [svnwcsub.OP_UPDATE])
+
+    def test_operations_stay_in_order(self):
+        worker = self.worker()
+        wc = FakeWC('/a')
+        worker.add_work(svnwcsub.OP_CLEANUP, wc)
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 5)
+        worker.add_work(svnwcsub.OP_CLEANUP, wc)
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 6)
+        # The WC is on the queue once, however much work it has.
+        self.assertEqual(self.ready(worker), [wc])
+        self.assertEqual(worker.pending[wc],
+                         [svnwcsub.OP_CLEANUP, svnwcsub.OP_UPDATE,
+                          svnwcsub.OP_CLEANUP])
+
+    def test_debounce(self):
+        worker = self.worker(debounce=0.2)
+        wc = FakeWC('/a')
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 5)
+        worker.add_work(svnwcsub.OP_UPDATE, wc, 6)
+        self.assertEqual(self.ready(worker), [])
+        self.assertEqual(worker.ready.get(timeout=5), wc)
+        self.assertEqual(worker.absorbed, 1)
+
+        # Other operations are not held back.
+        other = FakeWC('/b')
+        worker.add_work(svnwcsub.OP_CLEANUP, other)
+        self.assertEqual(self.ready(worker), [other])
+
+    def test_start_once(self):
+        worker = svnwcsub.BackgroundWorker('svn', {}, None, 1, 0)
+        started = []
+        def start():
+            started.append(threading.current_thread())
+            # Give the other threads a chance to race us.
+            time.sleep(0.05)
+        worker.start = start
+        threads = [threading.Thread(target=worker.add_work,
+                                    args=(svnwcsub.OP_CLEANUP, FakeWC(str(i))))
+                   for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(started), 1)
+        self.assertEqual(len(self.ready(worker)), 8)
+
+
+class ConfigTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def config(self, text):
+        fname = os.path.join(self.tmpdir, 'svnwcsub.conf')
+        fp = open(fname, 'w')
+        fp.write(text)
+        fp.close()
+        return svnwcsub.ReloadableConfig(fname)
+
+    def test_workers(self):
+        self.assertEqual(self.config('[DEFAULT]\n').get_workers(), 1)
+        self.assertEqual(self.config('[DEFAULT]\nworkers: 4\n').get_workers(),
+                         4)
+        for value in ('0', '-1', 'many'):
+            config = self.config('[DEFAULT]\nworkers: %s\n' % value)
+            self.assertRaises(ValueError, config.get_workers)
+
+
+class TrieTestCase(unittest.TestCase):
+    def find(self, trie, *paths):
+        found = set()
+        for path in paths:
+            trie.find(path, found)
+        return sorted(wc.match for wc in found)
+
+    def test_find(self):
+        trie = svnwcsub.WorkingCopyTrie()
+        for match in ('/site/trunk', '/site/trunk/content', '/site/branches/x',
+                      '/tools'):
+            trie.add(FakeWC(match))
+        # within a working copy, and within two nested ones
+        self.assertEqual(self.find(trie, '/tools/a/b'), ['/tools'])
+        self.assertEqual(self.find(trie, '/site/trunk/content/index.html'),
+                         ['/site/trunk', '/site/trunk/content'])
+        # a directory above working copies
+        self.assertEqual(self.find(trie, '/site'),
+                         ['/site/branches/x', '/site/trunk',
+                          '/site/trunk/content'])
+        self.assertEqual(len(self.find(trie, '/')), 4)
+        # segments are compared whole, not as string prefixes
+        self.assertEqual(self.find(trie, '/toolset/a', '/site/trunk2'), [])
+        # each changed path on its own
+        self.assertEqual(self.find(trie, '/tools/x', '/site/branches/x/y'),
+                         ['/site/branches/x', '/tools'])
+
+    def test_root_wc(self):
+        trie = svnwcsub.WorkingCopyTrie()
+        trie.add(FakeWC('/'))
+        self.assertEqual(self.find(trie, '/anything/at/all'), ['/'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+
+# ====================================================================
+#    Licensed to the Apache Software Foundation (ASF) under one
+#    or more contributor license agreements.  See the NOTICE file
+#    distributed with this work for additional information
+#    regarding copyright ownership.  The ASF licenses this file
+#    to you under the Apache License, Version 2.0 (the
+#    "License"); you may not use this file except in compliance
+#    with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an
+#    "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#    KIND, either express or implied.  See the License for the
+#    specific language governing permissions and limitations
+#    under the License.
+# ====================================================================
+
+# Run this without arguments to run unit tests of fsfs-reshard.py on
+# small made-up repositories.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+def load_source(name, path):
+  try:
+    import importlib.util
+  except ImportError:
+    # Python <3.5
+    import imp
+    return imp.load_source(name, path)
+  spec = importlib.util.spec_from_file_location(name, path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+fsfs_reshard = load_source('fsfs_reshard',
+                           os.path.join(os.path.dirname(
+                             os.path.abspath(__file__)), 'fsfs-reshard.py'))
+
+
+class Interrupted(Exception):
+  pass
+
+
+class ReshardTests(unittest.TestCase):
+
+  def setUp(self):
+    self.repos = tempfile.mkdtemp()
+    self.db = os.path.join(self.repos, 'db')
+    os.mkdir(self.db)
+    self.write('format', '5\n')
+    self.write('db/current', '9 a 1\n')
+    self.write('db/format', '2\n')
+    for name in ('revs', 'revprops'):
+      os.makedirs(os.path.join(self.db, name))
+      for rev in range(10):
+        self.write('db/%s/%d' % (name, rev), '%s %d\n' % (name, rev))
+    self.stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+
+  def tearDown(self):
+    sys.stdout.close()
+    sys.stdout = self.stdout
+    shutil.rmtree(self.repos)
+
+  def write(self, name, contents):
+    f = open(os.path.join(self.repos, name), 'w')
+    f.write(contents)
+    f.close()
+
+  def layout(self, name):
+    """Return {subdirectory: [files]} for db/NAME, with None for the files
+    directly in it."""
+    layout = {}
+    for dirpath, dirnames, filenames in os.walk(os.path.join(self.db, name)):
+      subdir = os.path.relpath(dirpath, os.path.join(self.db, name))
+      layout[subdir != '.' and subdir or None] = sorted(map(int, filenames))
+    return layout
+
+  def check_contents(self, name, max_files_per_shard):
+    for rev in range(10):
+      if max_files_per_shard:
+        path = os.path.join(self.db, name, str(rev // max_files_per_shard),
+                            str(rev))
+      else:
+        path = os.path.join(self.db, name, str(rev))
+      f = open(path)
+      self.assertEqual(f.read(), '%s %d\n' % (name, rev))
+      f.close()
+
+  def run_main(self, *args):
+    argv = sys.argv
+    sys.argv = ['fsfs-reshard.py'] + list(args)
+    try:
+      fsfs_reshard.main()
+    except SystemExit as e:
+      self.assertEqual(e.code, 0)
+    finally:
+      sys.argv = argv
+
+  def run_interrupted(self, function_name, when, *args):
+    """Run main() with ARGS, raising Interrupted in the call of the module
+    function FUNCTION_NAME for which WHEN(*ITS_ARGS) is true."""
+    function = getattr(fsfs_reshard, function_name)
+    def interrupt(*function_args):
+      if when(*function_args):
+        raise Interrupted
+      return function(*function_args)
+    setattr(fsfs_reshard, function_name, interrupt)
+    try:
+      self.assertRaises(Interrupted, self.run_main, *args)
+    finally:
+      setattr(fsfs_reshard, function_name, function)
+    self.assertFalse(os.path.exists(os.path.join(self.db, 'format')))
+
+  def check_sharded(self, max_files_per_shard):
+    for name in ('revs', 'revprops'):
+      self.assertEqual(self.layout(name)[None], [])
+      self.check_contents(name, max_files_per_shard)
+    f = open(os.path.join(self.db, 'format'))
+    self.assertEqual(f.read(), '3\nlayout sharded %d\n' % max_files_per_shard)
+    f.close()
+    self.assertFalse(os.path.exists(os.path.join(self.db, 'reshard-journal')))
+
+  def test_shard(self):
+    self.run_main('-j', '2', self.repos, '4')
+    self.check_sharded(4)
+    self.assertEqual(self.layout('revs'),
+                     {None: [], '0': [0, 1, 2, 3], '1': [4, 5, 6, 7],
+                      '2': [8, 9]})
+
+  def test_resume_shard(self):
+    # interrupted once db/revs is done, while sharding db/revprops
+    self.run_interrupted('shard', lambda path, *args: 'revprops' in path,
+                         self.repos, '4')
+    self.assertEqual(self.layout('revs')[None], [])
+    self.run_main(self.repos, '4')
+    self.check_sharded(4)
+
+  def test_resume_move(self):
+    # interrupted half way through the moves into db/revs.reshard
+    moves = []
+    def when(pairs):
+      moves.append(pairs)
+      return len(moves) == 2
+    self.run_interrupted('move_files', when, '-j', '1', self.repos, '4')
+    self.run_main('-j', '1', self.repos, '4')
+    self.check_sharded(4)
+
+  def test_resume_linearise(self):
+    self.run_main(self.repos, '4')
+    # reshard, interrupted while linearising db/revprops
+    self.run_interrupted('linearise', lambda path, *args: 'revprops' in path,
+                         self.repos, '3')
+    self.assertEqual(list(self.layout('revs').keys()), [None])
+    self.run_main(self.repos, '3')
+    self.check_sharded(3)
+
+  def test_resume_with_other_arguments(self):
+    self.run_interrupted('shard', lambda path, *args: 'revprops' in path,
+                         self.repos, '4')
+    stderr = sys.stderr
+    sys.stderr = open(os.devnull, 'w')
+    try:
+      try:
+        sys.argv, argv = ['fsfs-reshard.py', self.repos, '3'], sys.argv
+        fsfs_reshard.main()
+      except SystemExit as e:
+        self.assertEqual(e.code, 1)
+      else:
+        self.fail('main() did not exit')
+    finally:
+      sys.argv = argv
+      sys.stderr.close()
+      sys.stderr = stderr
+
+  def test_shard_twice(self):
+    path = os.path.join(self.db, 'revs')
+    fsfs_reshard.shard(path, 3, 0, 9, 4)
+    fsfs_reshard.shard(path, 3, 0, 9, 4)
+    self.assertEqual(self.layout('revs'),
+                     {None: [], '0': [0, 1, 2], '1': [3, 4, 5],
+                      '2': [6, 7, 8], '3': [9]})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+# ====================================================================
+#    Licensed to the Apache Software Foundation (ASF) under one
+#    or more contributor license agreements.  See the NOTICE file
+#    distributed with this work for additional information
+#    regarding copyright ownership.  The ASF licenses this file
+#    to you under the Apache License, Version 2.0 (the
+#    "License"); you may not use this file except in compliance
+#    with the License.  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing,
+#    software distributed under the License is distributed on an
+#    "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+#    KIND, either express or implied.  See the License for the
+#    specific language governing permissions and limitations
+#    under the License.
+# ====================================================================
+
+# Run this without arguments to run unit tests of svn-backup-dumps.py,
+# with stand-ins for svnadmin and svnlook.
+
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+def load_source(name, path):
+    try:
+        import importlib.util
+    except ImportError:
+        # Python <3.5
+        import imp
+        return imp.load_source(name, path)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+svn_backup_dumps = load_source('svn_backup_dumps',
+                               os.path.join(os.path.dirname(
+                                 os.path.abspath(__file__)),
+                                 'svn-backup-dumps.py'))
+
+# 'svnadmin dump ... -r FROM:TO REPOS' writes a line per revision, and
+# 'svnlook youngest REPOS' prints HEAD.
+FAKE_SVN = """\
+import sys
+if sys.argv[1] == 'youngest':
+    print(%(head)d)
+else:
+    fromrev, torev = sys.argv[-2].split(':')
+    for rev in range(int(fromrev), int(torev) + 1):
+        sys.stdout.write('revision %%d\\n' %% rev)
+"""
+
+
+class Options:
+    rev = None
+    cnt = None
+    quiet = False
+    deltas = False
+    relative_incremental = False
+    verify = False
+    jobs = 1
+    svnadmin_path = None
+    svnlook_path = None
+    gzip_path = None
+    bzip2_path = None
+    bzip2 = False
+    gzip = False
+    overwrite = 0
+    transfer = None
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+
+class AddRangeTests(unittest.TestCase):
+
+    def test_add_range(self):
+        ranges = []
+        svn_backup_dumps.add_range(ranges, 10, 19)
+        svn_backup_dumps.add_range(ranges, 30, 39)
+        self.assertEqual(ranges, [[10, 19], [30, 39]])
+        # adjacent on the left, then overlapping
+        svn_backup_dumps.add_range(ranges, 0, 9)
+        svn_backup_dumps.add_range(ranges, 35, 45)
+        self.assertEqual(ranges, [[0, 19], [30, 45]])
+        # bridging a gap
+        svn_backup_dumps.add_range(ranges, 20, 29)
+        self.assertEqual(ranges, [[0, 45]])
+        # within a range
+        svn_backup_dumps.add_range(ranges, 5, 6)
+        self.assertEqual(ranges, [[0, 45]])
+        # spanning several ranges
+        ranges = [[0, 1], [3, 4], [6, 7], [20, 21]]
+        svn_backup_dumps.add_range(ranges, 2, 10)
+        self.assertEqual(ranges, [[0, 10], [20, 21]])
+
+
+class SvnBackupTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.repos = os.path.join(self.tmpdir, 'repos')
+        for subdir in ('db', 'conf', 'hooks'):
+            os.makedirs(os.path.join(self.repos, subdir))
+        self.dumpdir = os.path.join(self.tmpdir, 'dumps')
+        os.mkdir(self.dumpdir)
+        self.manifest_path = os.path.join(self.dumpdir, 'repos.manifest')
+        self.set_head(29)
+        self.stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+
+    def tearDown(self):
+        sys.stdout.close()
+        sys.stdout = self.stdout
+        shutil.rmtree(self.tmpdir)
+
+    def set_head(self, head):
+        self.svn = os.path.join(self.tmpdir, 'svn')
+        f = open(self.svn, 'w')
+        f.write('#!%s\n' % sys.executable)
+        f.write(FAKE_SVN % {'head': head})
+        f.close()
+        os.chmod(self.svn, stat.S_IRWXU)
+
+    def backup(self, **kwargs):
+        options = Options(svnadmin_path=self.svn, svnlook_path=self.svn,
+                          **kwargs)
+        return svn_backup_dumps.SvnBackup(options,
+                                          ['svn-backup-dumps.py',
+                                           self.repos, self.dumpdir])
+
+    def manifest(self):
+        f = open(self.manifest_path)
+        manifest = json.load(f)
+        f.close()
+        return manifest
+
+    def test_manifest(self):
+        self.assertTrue(self.backup(cnt=10).execute())
+        manifest = self.manifest()
+        self.assertEqual(sorted(manifest['dumps']),
+                         ['repos.000000-000009.svndmp',
+                          'repos.000010-000019.svndmp',
+                          'repos.000020-000029.svndmp'])
+        self.assertEqual(manifest['ranges'], [[0, 29]])
+        entry = manifest['dumps']['repos.000010-000019.svndmp']
+        self.assertEqual((entry['from'], entry['to'], entry['compression']),
+                         (10, 19, 'none'))
+        absfilename = os.path.join(self.dumpdir, 'repos.000010-000019.svndmp')
+        self.assertEqual(entry['size'], os.path.getsize(absfilename))
+        self.assertEqual(entry['sha256'],
+                         svn_backup_dumps.file_sha256(absfilename))
+
+        # The manifest is read back, and -i carries on from it.
+        self.set_head(34)
+        self.assertTrue(self.backup(relative_incremental=True).execute())
+        manifest = self.manifest()
+        self.assertTrue('repos.000030-000034.svndmp' in manifest['dumps'])
+        self.assertEqual(manifest['ranges'], [[0, 34]])
+
+    def test_find_gaps(self):
+        self.assertTrue(self.backup(cnt=10).execute())
+        os.remove(self.manifest_path)
+        os.remove(os.path.join(self.dumpdir, 'repos.000010-000019.svndmp'))
+        backup = self.backup()
+        self.assertEqual(backup.find_gaps(), [[10, 19]])
+        self.assertEqual(backup.get_last_dumped_rev(), 29)
+
+    def test_recover_manifest(self):
+        self.assertTrue(self.backup(cnt=10).execute())
+        manifest = self.manifest()
+
+        # Without a manifest, the dump directory is scanned.
+        os.remove(self.manifest_path)
+        self.backup()
+        scanned = self.manifest()
+        self.assertEqual(scanned['ranges'], manifest['ranges'])
+        self.assertEqual(sorted(scanned['dumps']), sorted(manifest['dumps']))
+        for entry in scanned['dumps'].values():
+            self.assertEqual(entry['sha256'], None)
+
+        # The ranges of an older manifest are worked out from its dumps.
+        del manifest['ranges']
+        f = open(self.manifest_path, 'w')
+        json.dump(manifest, f)
+        f.close()
+        self.assertEqual(self.backup().get_last_dumped_rev(), 29)
+
+        f = open(self.manifest_path, 'w')
+        f.write('{"dumps": ')
+        f.close()
+        self.assertRaises(svn_backup_dumps.SvnBackupException, self.backup)
+
+    def test_is_dumped(self):
+        self.assertTrue(self.backup(cnt=10).execute())
+        filename = 'repos.000020-000029.svndmp'
+        absfilename = os.path.join(self.dumpdir, filename)
+        self.assertTrue(self.backup().is_dumped(filename))
+
+        # Changed contents of the same size and time are only found by
+        # checking the checksum.
+        st = os.stat(absfilename)
+        f = open(absfilename, 'r+')
+        f.write('R')
+        f.close()
+        os.utime(absfilename, (st.st_atime, st.st_mtime))
+        self.assertTrue(self.backup().is_dumped(filename))
+        self.assertRaises(svn_backup_dumps.SvnBackupException,
+                          self.backup(verify=True).is_dumped, filename)
+
+        # A different time is enough without --verify, and stops -c.
+        os.utime(absfilename, (st.st_atime, st.st_mtime + 10))
+        self.assertRaises(svn_backup_dumps.SvnBackupException,
+                          self.backup().is_dumped, filename)
+        self.set_head(39)
+        self.assertRaises(svn_backup_dumps.SvnBackupException,
+                          self.backup(cnt=10).execute)
+
+        # -O dumps it again.
+        self.assertTrue(self.backup(cnt=10, overwrite=2).execute())
+        self.assertTrue(self.backup(verify=True).is_dumped(filename))
+
+        # A dump file which is not in the manifest stops -c as well.
+        os.remove(os.path.join(self.dumpdir, 'repos.000000-000009.svndmp'))
+        self.assertFalse(self.backup().is_dumped('repos.000000-000009.svndmp'))
+        f = open(os.path.join(self.dumpdir, 'repos.000040-000049.svndmp'), 'w')
+        f.close()
+        self.assertRaises(svn_backup_dumps.SvnBackupException,
+                          self.backup().is_dumped,
+                          'repos.000040-000049.svndmp')
+
+    def test_read_error(self):
+        class Stdout:
+            def read(self, size):
+                raise IOError('read error')
+            def close(self):
+                pass
+        class Proc:
+            stdout = Stdout()
+            def kill(self):
+                pass
+            def wait(self):
+                return 0
+        backup = self.backup(cnt=10)
+        Popen = svn_backup_dumps.Popen
+        svn_backup_dumps.Popen = lambda *args, **kwargs: Proc()
+        try:
+            self.assertRaises(IOError, backup.create_dump, False, False, 0, 9)
+        finally:
+            svn_backup_dumps.Popen = Popen
+        # Nothing is recorded, and the truncated dump is gone.
+        self.assertEqual(self.manifest()['dumps'], {})
+        self.assertEqual(os.listdir(self.dumpdir), ['repos.manifest'])
+
+
+if __name__ == '__main__':
+    unittest.main()
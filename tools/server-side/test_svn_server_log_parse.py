@@ -38,6 +38,9 @@ import svn.core
 
 import svn_server_log_parse
 
+def count_records(records):
+    return len(list(records))
+
 class TestCase(unittest.TestCase):
     def setUp(self):
         # Define a class to stuff everything passed to any handle_
@@ -47,7 +50,8 @@ class TestCase(unittest.TestCase):
                 if attr.startswith('handle_'):
                     return lambda *a: setattr(self, 'result', a)
                 raise AttributeError
-        self.parse = cls().parse
+        self.parser = cls()
+        self.parse = self.parser.parse
 
     def test_unknown(self):
         line = 'unknown log line'
@@ -354,6 +358,180 @@ class TestCase(unittest.TestCase):
         self.assertEqual(self.result, ('/foo', 9, svn.core.svn_depth_unknown,
                                        True))
 
+    def test_parse_stream(self):
+        lines = ['1 2008-04-15 ::1 jrandom repos commit r3\n',
+                 '1 2008-04-15 ::1 jrandom repos get-dir /a%20b r3 props\n',
+                 '1 2008-04-15 ::1 jrandom repos ERR - 160013 Not found\n']
+        records = list(svn_server_log_parse.parse_stream(lines, 5))
+        self.assertEqual([r.action for r in records],
+                         ['commit', 'get_dir', 'unknown'])
+        self.assertEqual(records[0].prefix, '1 2008-04-15 ::1 jrandom repos')
+        self.assertEqual(records[0].revision, 3)
+        self.assertEqual(records[1],
+                         svn_server_log_parse.RECORD_TYPES['get_dir'](
+                             'get_dir', '1 2008-04-15 ::1 jrandom repos',
+                             '/a b', 3, False, True))
+        self.assertEqual(records[2].line, 'ERR - 160013 Not found')
+        self.assertRaises(svn_server_log_parse.Error, list,
+                          svn_server_log_parse.parse_stream(['commit 3']))
+
+        # With skip_errors, a bad line does not stop the lines after it.
+        records = list(svn_server_log_parse.parse_stream(
+                         ['1 2008-04-15 ::1 jrandom repos get-dir /trunk\n']
+                         + lines, 5, skip_errors=True))
+        self.assertEqual([r.action for r in records],
+                         ['unparsable', 'commit', 'get_dir', 'unknown'])
+        self.assertEqual(records[0].prefix, '1 2008-04-15 ::1 jrandom repos')
+        self.assertEqual(records[0].line, 'get-dir /trunk')
+        self.assertTrue(isinstance(records[0].error,
+                                   svn_server_log_parse.MatchError))
+
+        # Parser.parse_stream calls the handle_ methods.
+        self.assertEqual(self.parser.parse_stream(lines[:2], 5), 2)
+        self.assertEqual(self.result, ('/a b', 3, False, True))
+        self.assertEqual(self.parser.prefix, '1 2008-04-15 ::1 jrandom repos')
+
+    def test_read_lines(self):
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, b'commit r1\nreparent /\n\ncommit r22\nstat /@1')
+            os.close(fd)
+            size = os.path.getsize(path)
+            expected = list(svn_server_log_parse._read_lines(path, 0, size))
+            self.assertEqual(len(expected), 5)
+            # Every line is read exactly once however the file is split.
+            for i in range(size + 1):
+                for j in range(i, size + 1):
+                    lines = (list(svn_server_log_parse._read_lines(path, 0, i))
+                             + list(svn_server_log_parse._read_lines(path, i, j))
+                             + list(svn_server_log_parse._read_lines(path, j,
+                                                                     size)))
+                    self.assertEqual(lines, expected)
+            self.assertEqual(svn_server_log_parse.parse_file(path, count_records,
+                                                             processes=4),
+                             [5])
+        finally:
+            os.remove(path)
+
+    def test_count_min_sketch(self):
+        sketch = svn_server_log_parse.CountMinSketch(64, 4)
+        other = svn_server_log_parse.CountMinSketch(64, 4)
+        for i in range(1000):
+            sketch.add('/trunk/%d' % (i % 100,))
+            other.add('/trunk/%d' % (i % 10,))
+        self.assertTrue(sketch.estimate('/trunk/7') >= 10)
+        sketch.merge(other)
+        self.assertTrue(sketch.estimate('/trunk/7') >= 110)
+        self.assertEqual(sketch.total, 2000)
+        self.assertRaises(ValueError, sketch.merge,
+                          svn_server_log_parse.CountMinSketch(32, 4))
+
+    def test_heavy_hitters(self):
+        hitters = svn_server_log_parse.HeavyHitters(5, batch=16)
+        for i in range(2000):
+            hitters.add('/hot/%d' % (i % 3,))
+            hitters.add('/cold/%d' % (i,))
+        self.assertEqual(hitters.top(3), [('/hot/0', 667), ('/hot/1', 667),
+                                          ('/hot/2', 666)])
+        self.assertTrue(len(hitters.counts) <= 10)
+        other = svn_server_log_parse.HeavyHitters(5, batch=16)
+        for i in range(100):
+            other.add('/hot/2', 10)
+        hitters.merge(other)
+        self.assertEqual(hitters.top(1), [('/hot/2', 1666)])
+
+        hitters = svn_server_log_parse.HeavyHitters(1, batch=1)
+        for key in ('a', 'b', 'b', 'c'):
+            hitters.add(key)
+        self.assertEqual(hitters.top(1), [('b', 2)])
+        self.assertRaises(ValueError, svn_server_log_parse.HeavyHitters, 0)
+
+    def test_aggregator(self):
+        lines = [
+          '1 2008-04-15T20:41:24.000000Z ::1 alice repos1 update /trunk r9 depth=files\n',
+          '1 2008-04-15T20:41:59.000000Z ::1 alice repos1 get-file /trunk/a/b r9\n',
+          '1 2008-04-15T20:42:00.000000Z ::1 bob repos2 log (/trunk /tags) r9:0\n',
+          '1 2008-04-15T20:42:01.000000Z ::1 bob repos2 ERR - 160013 Not found\n',
+        ]
+        aggregators = []
+        for part in (lines[:1], lines[1:]):
+            aggregator = svn_server_log_parse.Aggregator(bucket=60)
+            aggregator.add_records(svn_server_log_parse.parse_stream(part, 5))
+            aggregators.append(aggregator)
+        aggregator = aggregators[0].merge(aggregators[1])
+        self.assertEqual(aggregator.total, 4)
+        self.assertEqual(aggregator.actions, {'update': 1, 'get_file': 1,
+                                              'log': 1, 'unknown': 1})
+        self.assertEqual(aggregator.depths, {'files': 1})
+        self.assertEqual(aggregator.buckets, {1208292060: {'update': 1,
+                                                           'get_file': 1},
+                                              1208292120: {'log': 1,
+                                                           'unknown': 1}})
+        self.assertEqual(aggregator.rates(), [(1208292060, 2 / 60.0),
+                                              (1208292120, 2 / 60.0)])
+        self.assertEqual(aggregator.users.top(5), [('alice', 2), ('bob', 2)])
+        self.assertEqual(aggregator.repositories.top(1), [('repos1', 2)])
+        self.assertEqual(aggregator.paths.top(5),
+                         [('repos1/trunk', 1), ('repos1/trunk/a/b', 1),
+                          ('repos2/tags', 1), ('repos2/trunk', 1)])
+        self.assertEqual(aggregator.path_prefixes.top(1),
+                         [('repos1/trunk', 1)])
+        self.assertEqual(aggregator.path_prefixes.top(5)[1],
+                         ('repos1/trunk/a', 1))
+
+    def test_aggregate_file(self):
+        lines = [
+          '1 2008-04-15T20:41:24.000000Z ::1 alice repos1 update /trunk r9 depth=files\n',
+          '1 2008-04-15T20:41:25.000000Z ::1 alice repos1 get-dir /trunk\n',
+          '1 2008-04-15T20:41:26.000000Z ::1 alice repos1 update /trunk r9 depth=bogus\n',
+          '1 2008-04-15T20:41:59.000000Z ::1 alice repos1 get-file /trunk/a/b r9\n',
+        ]
+        fd, path = tempfile.mkstemp()
+        try:
+            os.write(fd, ''.join(lines).encode('ascii'))
+            os.close(fd)
+            aggregator = svn_server_log_parse.aggregate_file(path)
+        finally:
+            os.remove(path)
+        self.assertEqual(aggregator.total, 4)
+        self.assertEqual(aggregator.actions, {'update': 1, 'get_file': 1,
+                                              'unparsable': 2})
+        self.assertEqual(aggregator.buckets, {1208292060: {'update': 1,
+                                                           'get_file': 1}})
+        self.assertEqual(aggregator.users.top(5), [('alice', 2)])
+
+    def test_aggregator_distinct_paths(self):
+        lines = [
+          '1 2008-04-15T20:41:24.000000Z ::1 alice repos1 diff /trunk/a r9:8 /trunk/a\n',
+          '1 2008-04-15T20:41:25.000000Z ::1 alice repos1 switch /trunk/a /trunk/b@9\n',
+        ]
+        aggregator = svn_server_log_parse.Aggregator()
+        aggregator.add_records(svn_server_log_parse.parse_stream(lines, 5))
+        self.assertEqual(aggregator.paths.top(5),
+                         [('repos1/trunk/a', 2), ('repos1/trunk/b', 1)])
+        self.assertEqual(aggregator.path_prefixes.top(5),
+                         [('repos1/trunk/a', 2), ('repos1/trunk/b', 1)])
+        aggregator = svn_server_log_parse.Aggregator(prefix_depth=1)
+        aggregator.add_records(svn_server_log_parse.parse_stream(lines, 5))
+        self.assertEqual(aggregator.path_prefixes.top(5),
+                         [('repos1/trunk', 2)])
+
+    def test_aggregator_merge_mismatch(self):
+        Aggregator = svn_server_log_parse.Aggregator
+        aggregator = Aggregator()
+        for other in (Aggregator(bucket=300), Aggregator(prefix_depth=3),
+                      Aggregator(log_format='mod_dav_svn'),
+                      Aggregator(width=1024), Aggregator(depth=5)):
+            self.assertRaises(ValueError, aggregator.merge, other)
+        self.assertEqual(aggregator.total, 0)
+        aggregator.merge(Aggregator(capacity=10))
+
+    def test_mod_dav_svn_prefix(self):
+        parse_prefix = svn_server_log_parse.LOG_FORMATS['mod_dav_svn'][1]
+        self.assertEqual(parse_prefix('[15/Apr/2008:22:41:24 +0200] bob repos'),
+                         (1208292084, 'bob', 'repos'))
+        self.assertEqual(parse_prefix('- bob repos'), (None, None, None))
+
 if __name__ == '__main__':
     if len(sys.argv) == 1:
         # No arguments so run the unit tests.